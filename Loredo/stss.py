@@ -4,13 +4,174 @@ SinusoidTimeSeriesSimulator class for basic periodogram experiments.
 2021-01-06:  Created by Tom Loredo (based on ThinnedSchusterPDF.py)
 """
 
+from multiprocessing import Pool
+
 from numpy import *
+from numpy.random import default_rng, SeedSequence
 from scipy.stats import norm
-from scipy.fft import rfft, rfftfreq
+from scipy.fft import rfft, rfftfreq, fft, ifft, next_fast_len
+
+# numpy 2 renamed trapz to trapezoid (and 2.4 removed trapz):
+try:
+    from numpy import trapezoid as trapz
+except ImportError:
+    pass
 
 
 twopi = 2*pi
 
+# Uniform frequency grids with at least this many frequencies use the
+# chirp-z transform in schuster_pgram:
+CZT_MIN_FREQS = 16
+
+# Memory (bytes) for the cos/sin arrays of a block of frequencies in the
+# direct sums of schuster_pgram:
+MEMORY_BUDGET = 2**26
+
+
+def uniform_step(x, rtol=1e-10):
+    """
+    Return the step of `x` if it is a uniform grid (deviations from the
+    ideal grid below `rtol` times max(abs(x))), else None.
+    """
+    x = asarray(x, dtype=float)
+    if x.ndim != 1 or x.shape[0] < 2:
+        return None
+    step = (x[-1] - x[0])/(x.shape[0] - 1)
+    ideal = x[0] + step*arange(x.shape[0])
+    if abs(x - ideal).max() > rtol*abs(x).max():
+        return None
+    return step
+
+
+def schuster_czt(y, dt, f0, df, m):
+    """
+    Compute the Schuster periodogram of data `y` (1-D, or 2-D with one
+    series per row) sampled at times k*dt, k = 0..n-1, on the uniform
+    frequency grid f0 + j*df, j = 0..m-1, using the chirp-z transform
+    (Bluestein's algorithm: three FFTs of length ~n+m).
+
+    With a = f0*dt and r = df*dt, the sums are
+        sum_k y_k exp(2 pi i (a + r j) k)
+            = exp(i pi r j**2) * sum_k u_k exp(-i pi r (j-k)**2),
+        u_k = y_k exp(2 pi i a k + i pi r k**2),
+    a convolution of u with a chirp; the leading phase drops out of
+    the power.
+    """
+    y = asarray(y, dtype=float)
+    n = y.shape[-1]
+    a, r = f0*dt, df*dt
+    k = arange(n, dtype=float)
+    L = next_fast_len(n + m - 1)
+
+    # Reduce the chirp phases (in cycles) to [0, 2) before exp:
+    u = y * exp(1j*pi*((2*a*k + r*k*k) % 2.))
+    chirp = zeros(L, dtype=complex)
+    l = arange(maximum(m, n), dtype=float)
+    c = exp(-1j*pi*((r*l*l) % 2.))
+    chirp[:m] = c[:m]
+    chirp[L-n+1:] = c[1:n][::-1]
+
+    conv = ifft(fft(u, L, axis=-1) * fft(chirp), axis=-1)[..., :m]
+    return (conv.real**2 + conv.imag**2)/n
+
+
+def schuster_direct(y, times, freqs, memory_budget=None):
+    """
+    Compute the Schuster periodogram of data `y` (1-D, or 2-D with one
+    series per row) at arbitrary `times` and `freqs`, as matrix products
+    over blocks of frequencies.
+    """
+    if memory_budget is None:
+        memory_budget = MEMORY_BUDGET
+    y = asarray(y, dtype=float)
+    times = asarray(times, dtype=float)
+    freqs = asarray(freqs, dtype=float)
+    n = times.shape[0]
+    pg = empty(y.shape[:-1] + freqs.shape)
+    block = maximum(1, int(memory_budget//(16*n)))
+    for start in range(0, freqs.shape[0], block):
+        stop = minimum(start + block, freqs.shape[0])
+        wt = twopi*outer(freqs[start:stop], times)
+        C = y @ cos(wt).T
+        S = y @ sin(wt).T
+        pg[..., start:stop] = (C**2 + S**2)/n
+    return pg
+
+
+def schuster_pgram(y, times, freqs, method='auto'):
+    """
+    Compute the Schuster periodogram of data `y` (1-D, or 2-D with one
+    series per row) sampled at `times`, for the frequencies `freqs` (1-D).
+
+    method : 'auto', 'czt' or 'direct'
+        'czt' requires uniform `times` and `freqs`; 'auto' uses it for
+        uniform grids with at least CZT_MIN_FREQS frequencies, and the
+        blocked direct sums otherwise.
+    """
+    if method not in ('auto', 'czt', 'direct'):
+        raise ValueError("method must be 'auto', 'czt' or 'direct'")
+    times = asarray(times, dtype=float)
+    freqs = asarray(freqs, dtype=float)
+    if method != 'direct':
+        dt = uniform_step(times)
+        df = uniform_step(freqs)
+        if freqs.shape[0] == 1:
+            df = 0.
+        uniform = dt is not None and df is not None
+        if method == 'czt' and not uniform:
+            raise ValueError('czt requires uniform times and frequencies')
+        if uniform and (method == 'czt' or freqs.shape[0] >= CZT_MIN_FREQS):
+            # A time offset only changes the phase of the sums:
+            return schuster_czt(y, dt, freqs[0], df, freqs.shape[0])
+    return schuster_direct(y, times, freqs)
+
+
+def lml_posterior(pgram, pgram_t, sig, df=1., x=None):
+    """
+    Compute the log marginal likelihood and the marginal posterior PDF
+    (flat prior) for frequency from periodogram values `pgram` on a
+    uniform grid with spacing `df` (or on the grid `x`, as for `trapz`)
+    along the last axis, and the posterior density at the true frequency
+    from its periodogram value `pgram_t` (one per row of `pgram`).
+    """
+    lml = pgram/sig
+    lml_max = lml.max(axis=-1, keepdims=True)
+    mpp = exp(lml - lml_max)
+    Z = trapz(mpp, x=x, dx=df, axis=-1)[..., newaxis]
+    mpp = mpp/Z
+    mpp_t = exp(pgram_t/sig - lml_max[..., 0])/Z[..., 0]
+    return lml, mpp, mpp_t
+
+
+def hpd_coverage(mpp, mpp_t, x=None):
+    """
+    Return the probability inside the HPD region whose boundary passes
+    through the posterior density `mpp_t` at the true frequency, for each
+    row of the posterior `mpp` on a uniform grid (or on the non-uniform
+    grid `x`, weighting each point by the width of its trapezoid cell).
+    """
+    mpp_t = asarray(mpp_t)[..., newaxis]
+    if x is None:
+        weighted = mpp
+    else:
+        dx = diff(x)
+        weighted = mpp*concatenate(([dx[0]], dx[:-1] + dx[1:], [dx[-1]]))
+    return where(mpp > mpp_t, weighted, 0.).sum(axis=-1)/weighted.sum(axis=-1)
+
+
+def _calibration_chunk(sim, seed, n_sims, over, return_mpp):
+    """
+    Simulate and analyze one chunk of a calibration study (run by the
+    worker processes of `calibrate`).
+    """
+    y = sim.simulate_batch(n_sims, rng=default_rng(seed))
+    freqs, pgram, lml, mpp, mpp_t = sim.pgram_lml_batch(y, over)
+    p_in = hpd_coverage(mpp, mpp_t)
+    if return_mpp:
+        return p_in, mpp_t, mpp
+    return p_in, mpp_t, None
+
 
 class SinusoidTimeSeriesSimulator:
     """
@@ -57,21 +218,28 @@ class SinusoidTimeSeriesSimulator:
         self.noise = self.norm.rvs(self.n)
         self.y = self.signal + self.noise
 
-    def pgram(self, f):
+    def simulate_batch(self, n_sims, rng=None):
         """
-        Compute the Schuster periodogram the slow way, for an arbitrary
-        frequency grid.
+        Simulate `n_sims` observations in one draw, returning the data as
+        an (n_sims, n) array (the `y` attribute is not changed).
+
+        rng : numpy.random.Generator, seed, or None
+        """
+        rng = default_rng(rng)
+        return self.signal + rng.normal(scale=self.sig, size=(n_sims, self.n))
+
+    def pgram(self, f, method='auto'):
+        """
+        Compute the Schuster periodogram for an arbitrary frequency grid.
+
+        Uniform grids use the chirp-z transform, others the direct sums
+        in blocks of frequencies; see `schuster_pgram` for `method`.
         """
         f = asarray(f)
         scalar_in = f.ndim == 0
 
         freqs = atleast_1d(f)
-        pg = empty_like(freqs)
-        for i, f in enumerate(freqs):
-            wt = twopi*f*self.times
-            C = sum(self.y * cos(wt))
-            S = sum(self.y * sin(wt))
-            pg[i] = (C**2 + S**2)/self.n
+        pg = schuster_pgram(self.y, self.times, freqs, method=method)
 
         if scalar_in:
             return pg[0]
@@ -97,21 +265,166 @@ class SinusoidTimeSeriesSimulator:
         Evaluate the Schuster periodogram and the log marginal likelihood
         for frequency.
         """
-        # Frequency grid, oversampled if requested:
+        freqs = self.lml_freqs(over)
+        pgram = self.pgram(freqs)
+        # Log marginal likelihood and marginal posterior PDF for frequency,
+        # and the posterior PDF at the true freq:
+        lml, mpp, mpp_t = lml_posterior(pgram, self.pgram(self.nu), self.sig,
+                                        freqs[1] - freqs[0])
+        return freqs, pgram, lml, mpp, mpp_t
+
+    def pgram_lml_adaptive(self, threshold=30., rtol=1e-4, max_levels=30):
+        """
+        Evaluate `pgram_lml` on an adaptive, non-uniform frequency grid.
+
+        Starting from the Fourier frequencies, intervals are bisected
+        where the posterior matters, until the log of the normalization Z,
+        the maximum log marginal likelihood and the probability in the HPD
+        region reaching the true frequency change by less than `rtol` and
+        no interval may hide a higher peak or a crossing of the HPD boundary
+        (or after `max_levels` bisections).
+
+        Within an interval of width h the periodogram is assumed to exceed
+        its larger end value by at most the factor 1/sinc(h*n*dt/2)**2 of a
+        single sinusoid.  An interval is refined if this bound may reach
+        within `threshold` of the maximum log marginal likelihood, and
+        either h > 0.5/(n*dt), its trapezoid error exceeds its share of
+        rtol*Z, the bound exceeds the maximum by more than rtol (a peak
+        between the samples), or the HPD boundary may cross it (the bound
+        exceeds mpp_t while an end does not) with a probability above rtol.
+
+        Returns freqs, pgram, lml, mpp, mpp_t like `pgram_lml`.
+        """
+        freqs = self.ffreqs
+        pgram = self.pgram(freqs)
+        pgram_t = self.pgram(self.nu)
+        span = freqs[-1] - freqs[0]
+        logZ = p_in = peak = None
+        for level in range(max_levels):
+            lml = pgram/self.sig
+            lml_max = lml.max()
+            mpp = exp(lml - lml_max)
+            Z = trapz(mpp, x=freqs)
+            mpp_t = exp(pgram_t/self.sig - lml_max)
+            logZ_new = log(Z) + lml_max
+            p_new = hpd_coverage(mpp, mpp_t, x=freqs)
+            stable = logZ is not None and abs(logZ_new - logZ) < rtol and \
+                abs(p_new - p_in) < rtol and abs(lml_max - peak) < rtol
+            logZ, p_in, peak = logZ_new, p_new, lml_max
+
+            h = diff(freqs)
+            x = h*self.n*self.dt/2
+            scallop = where(x < 0.95, sinc(minimum(x, 0.95))**2, 0.)
+            with errstate(divide='ignore', over='ignore'):
+                bound = maximum(pgram[:-1], pgram[1:])/scallop/self.sig
+                mpp_bound = exp(bound - lml_max)
+            candidate = bound >= lml_max - threshold
+
+            # Trapezoid error h**3 |f''|/12 of each interval, with f'' from
+            # the second divided differences at its ends:
+            slope = diff(mpp)/h
+            curv = zeros_like(mpp)
+            curv[1:-1] = abs(2*diff(slope)/(h[:-1] + h[1:]))
+            curv[0], curv[-1] = curv[1], curv[-2]
+            error = h**3*maximum(curv[:-1], curv[1:])/12
+            # The HPD boundary may cross an interval if the bound exceeds
+            # mpp_t while an end does not (a peak above mpp_t between two
+            # samples below it), and the interval can hold at most h times
+            # the bound:
+            crossing = (mpp_bound > mpp_t) & \
+                ((mpp[:-1] <= mpp_t) | (mpp[1:] <= mpp_t))
+            mass = h*mpp_bound
+            unresolved = bound > lml_max + rtol
+
+            # A stable Z or HPD probability does not show a peak or a
+            # crossing the last bisection missed, so those are refined
+            # until the bound rules them out:
+            bounded = candidate & (unresolved | (crossing & (mass > rtol*Z)))
+            active = bounded
+            if not stable:
+                active = active | (candidate & ((x > 0.25) |
+                                                (error > rtol*Z*h/span)))
+            if not active.any():
+                break
+            new = 0.5*(freqs[:-1] + freqs[1:])[active]
+            freqs = concatenate((freqs, new))
+            pgram = concatenate((pgram, self.pgram(new)))
+            order = argsort(freqs)
+            freqs, pgram = freqs[order], pgram[order]
+
+        lml, mpp, mpp_t = lml_posterior(pgram, pgram_t, self.sig, x=freqs)
+        return freqs, pgram, lml, mpp, mpp_t
+
+    def lml_freqs(self, over=1.):
+        """
+        Frequency grid for `pgram_lml`, oversampled if requested.
+        """
         if over == 1.:
-            freqs = self.ffreqs
+            return self.ffreqs
         else:
-            freqs = linspace(0, 0.5/self.dt, over*self.n)
-        df = freqs[1] - freqs[0]
+            return linspace(0, 0.5/self.dt, int(over*self.n))
 
-        pgram = self.pgram(freqs)
-        # Log marginal likelihood for frequency:
-        lml = pgram/self.sig
-        # Marginal posterior PDF for frequency:
-        lml_max = lml.max()
-        mpp = exp(lml - lml_max)
-        Z = trapz(mpp, dx=df)
-        mpp = mpp/Z
-        # Value at true freq:
-        mpp_t = exp(self.pgram(self.nu)/self.sig - lml_max)/Z
+    def pgram_lml_batch(self, y, over=1.):
+        """
+        Evaluate `pgram_lml` for many datasets `y` (an (n_sims, n) array,
+        e.g., from `simulate_batch`) at once, with one chirp-z transform
+        over all rows.  Returns freqs and (n_sims, n_freqs) arrays pgram,
+        lml and mpp, and the (n_sims,) array mpp_t.
+        """
+        freqs = self.lml_freqs(over)
+        pgram = schuster_pgram(y, self.times, freqs)
+        pgram_t = schuster_pgram(y, self.times, array([self.nu]))[..., 0]
+        lml, mpp, mpp_t = lml_posterior(pgram, pgram_t, self.sig,
+                                        freqs[1] - freqs[0])
         return freqs, pgram, lml, mpp, mpp_t
+
+    def calibrate(self, n_sims, over=50, seed=None, processes=1,
+                  chunk=100, return_mpp=False):
+        """
+        Perform an HPD calibration study with `n_sims` simulated datasets.
+
+        The datasets are simulated and analyzed in chunks of `chunk`
+        datasets, each with its own random stream spawned from
+        `SeedSequence(seed)`, so the results for a given seed do not
+        depend on the number of `processes` (None uses all CPUs).
+
+        Returns the (n_sims,) arrays p_in (probability in the HPD region
+        reaching the true frequency) and mpp_t (posterior density at the
+        true frequency), and with `return_mpp` also the frequency grid
+        and the (n_sims, n_freqs) marginal posteriors.
+        """
+        sizes = [minimum(chunk, n_sims - start)
+                 for start in range(0, n_sims, chunk)]
+        seeds = SeedSequence(seed).spawn(len(sizes))
+        args = [(self, seed, size, over, return_mpp)
+                for seed, size in zip(seeds, sizes)]
+        if processes == 1:
+            results = [_calibration_chunk(*a) for a in args]
+        else:
+            with Pool(processes) as pool:
+                results = pool.starmap(_calibration_chunk, args)
+
+        p_in = concatenate([r[0] for r in results])
+        mpp_t = concatenate([r[1] for r in results])
+        if return_mpp:
+            mpp = concatenate([r[2] for r in results])
+            return p_in, mpp_t, self.lml_freqs(over), mpp
+        return p_in, mpp_t
+
+
+if __name__ == '__main__':
+    # Check pgram_lml_adaptive against a dense uniform grid (over=2000,
+    # whose own HPD probabilities are good to about 1e-3): the HPD
+    # probability, the peak of the posterior and the maximum lml.
+    sim = SinusoidTimeSeriesSimulator(0.1, 200, 3.1, 1., 0., 1.)
+    rng = default_rng(1)
+    for k in range(10):
+        sim.y = sim.signal + rng.normal(scale=sim.sig, size=sim.n)
+        freqs, pgram, lml, mpp, mpp_t = sim.pgram_lml_adaptive()
+        dfreqs, dpgram, dlml, dmpp, dmpp_t = sim.pgram_lml(over=2000)
+        p_in = hpd_coverage(mpp, mpp_t, x=freqs)
+        dp_in = hpd_coverage(dmpp, dmpp_t)
+        print(freqs.shape[0], p_in, dp_in, mpp.max()/dmpp.max() - 1)
+        assert abs(p_in - dp_in) < 2e-3
+        assert abs(mpp.max()/dmpp.max() - 1) < 1e-3
+        assert abs(lml.max() - dlml.max()) < 1e-3
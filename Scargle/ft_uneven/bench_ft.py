@@ -0,0 +1,300 @@
+import sys
+import time
+
+import numpy as np
+from numba import njit
+
+
+# benchmarks for the ft_uneven modules
+# run all with: python bench_ft.py, or single ones with: python bench_ft.py fused ...
+
+
+# returns the best wall time of repeat calls of func(*args, **kwargs)
+def best_time(func, *args, repeat=3, **kwargs):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# returns the number of allocations made by numba compiled code during func(*args, **kwargs)
+def numba_allocations(func, *args, **kwargs):
+    from numba.core.runtime import rtsys, _nrt_python
+    _nrt_python.memsys_enable_stats()
+    before = rtsys.get_allocation_stats().alloc
+    func(*args, **kwargs)
+    after = rtsys.get_allocation_stats().alloc
+    _nrt_python.memsys_disable_stats()
+    return after - before
+
+
+def random_series(num_val, num_omg, seed=0):
+    rng = np.random.default_rng(seed)
+    times = np.sort(rng.uniform(0, 100, num_val))
+    values = rng.standard_normal(num_val) + np.sin(3.0 * times)
+    weights = rng.uniform(0.5, 2.0, num_val)
+    omegas = np.sort(rng.uniform(0.01, 20, num_omg))
+    return values, times, weights, omegas
+
+
+# numba_ft.ft_uneven before the fused kernel: temporary arrays for every sum
+@njit
+def _ft_uneven_arrays(values, times, omegas, ft_sign, time_zero, weights=None):
+    num_val = len(values)
+    num_omg = len(omegas)
+    fts = np.zeros(num_omg, dtype=np.cdouble)
+    if weights is None:
+        weights = np.ones(num_val)
+    values = weights * values
+    for i in range(num_omg):
+        omg = omegas[i]
+        if omg:
+            csum = np.sum(weights * np.cos(2.0 * omg * times))
+            ssum = np.sum(weights * np.sin(2.0 * omg * times))
+            tau = 0.5 * np.arctan2(ssum, csum)
+
+            sumr = np.sum(values * np.cos(omg * times - tau))
+            sumi = np.sum(values * np.sin(omg * times - tau))
+
+            scos2 = np.sum(weights * (np.cos(omg * times - tau))**2)
+            ssin2 = np.sum(weights * (np.sin(omg * times - tau))**2)
+
+            ft_real = sumr/(2**0.5 * scos2**0.5)
+            ft_imag = ft_sign * sumi / (2**0.5 * ssin2**0.5)
+            phi_this = tau - omg * time_zero
+
+            fts[i] = (ft_real + ft_imag * 1j) * np.exp(1j*phi_this)
+        else:
+            fts[i] = np.sum(values)/np.sqrt(num_val)
+    return fts
+
+
+# fused single pass kernel of numba_ft.ft_uneven against the version with temporary arrays
+def bench_fused():
+    import numba_ft
+
+    print('fused kernel: numba_ft.ft_uneven against temporary arrays')
+    print(f'{"N_times":>8} {"N_omegas":>8} {"weights":>7} {"allocs old":>10} {"allocs new":>10} '
+          f'{"old [s]":>8} {"new [s]":>8} {"speedup":>7} {"max rel diff":>12}')
+    for num_val, num_omg in ((100, 10000), (1000, 2000), (10000, 500)):
+        values, times, weights, omegas = random_series(num_val, num_omg)
+        for wts in (None, weights):
+            # compile first
+            old = _ft_uneven_arrays(values, times, omegas, 1, 0, weights=wts)
+            new = numba_ft.ft_uneven(values, times, omegas, 1, 0, weights=wts)
+            allocs_old = numba_allocations(_ft_uneven_arrays, values, times, omegas, 1, 0, weights=wts)
+            allocs_new = numba_allocations(numba_ft.ft_uneven, values, times, omegas, 1, 0, weights=wts)
+            time_old = best_time(_ft_uneven_arrays, values, times, omegas, 1, 0, weights=wts)
+            time_new = best_time(numba_ft.ft_uneven, values, times, omegas, 1, 0, weights=wts)
+            diff = np.max(np.abs(new - old)) / np.max(np.abs(old))
+            print(f'{num_val:8d} {num_omg:8d} {str(wts is not None):>7} {allocs_old:10d} {allocs_new:10d} '
+                  f'{time_old:8.4f} {time_new:8.4f} {time_old / time_new:7.2f} {diff:12.2e}')
+
+
+# py_ft.ft_uneven_bulk(multithreading=True) before the shared memory pool: a new pool and pickled arguments for every call
+def _bulk_pool_starmap(values, times, omegas, ft_sign, time_zero):
+    from multiprocessing import Pool
+    import py_ft
+    pool = Pool()
+    n = len(values)
+    results = pool.starmap(py_ft.ft_uneven, zip(values, times, [omegas]*n, [ft_sign]*n, [time_zero]*n))
+    pool.close()
+    pool.join()
+    return results
+
+
+# persistent shared memory pool of py_ft.ft_uneven_bulk against a new pool with pickled arguments
+def bench_pool():
+    import py_ft
+
+    print('process pool: py_ft.ft_uneven_bulk(multithreading=True)')
+    print(f'{"n_series":>8} {"N_times":>8} {"N_omegas":>8} {"old [s]":>8} {"first [s]":>9} {"reuse [s]":>9} {"speedup":>7}')
+    for n_series, num_val, num_omg in ((20000, 20, 10), (2000, 100, 50), (200, 500, 200)):
+        rng = np.random.default_rng(0)
+        values = rng.standard_normal((n_series, num_val))
+        # 2-dim times, so all versions calculate the series one by one (1-dim times would use the shared basis)
+        times = np.sort(rng.uniform(0, 100, (n_series, num_val)), axis=1)
+        omegas = np.linspace(0.01, 20, num_omg)
+
+        time_old = best_time(_bulk_pool_starmap, values, times, omegas, 1, 0, repeat=1)
+        with py_ft.BulkExecutor() as executor:
+            time_first = best_time(py_ft.ft_uneven_bulk, values, times, omegas, 1, 0, multithreading=True, executor=executor,
+                                   repeat=1)
+            time_reuse = best_time(py_ft.ft_uneven_bulk, values, times, omegas, 1, 0, multithreading=True, executor=executor)
+        print(f'{n_series:8d} {num_val:8d} {num_omg:8d} {time_old:8.3f} {time_first:9.3f} {time_reuse:9.3f} '
+              f'{time_old / time_reuse:7.2f}')
+
+
+# a new process: imports numba_ft and calculates one bulk transform, prints the time to the first result
+_STARTUP_SCRIPT = '''
+import time
+start = time.perf_counter()
+import numpy as np
+import numba_ft
+values = np.random.standard_normal((100, 200))
+times = np.tile(np.sort(np.random.uniform(0, 100, 200)), (100, 1))
+numba_ft.ft_uneven_bulk_adaptive(values, times, np.linspace(0.01, 20, 100), 1.0, 0.0)
+print(time.perf_counter() - start)
+'''
+
+
+# time to the first result of numba_ft in new processes, with an empty and with a filled on-disk cache
+def bench_startup():
+    import os
+    import subprocess
+    import tempfile
+
+    print('startup: time to first result of numba_ft.ft_uneven_bulk_adaptive in a new process')
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+
+        def run(script):
+            out = subprocess.run([sys.executable, '-c', script], cwd=here, env=env, check=True, capture_output=True, text=True)
+            return float(out.stdout.split()[-1])
+
+        print(f'cold (empty cache):        {run(_STARTUP_SCRIPT):8.3f} s')
+        print(f'warm (cache filled):       {run(_STARTUP_SCRIPT):8.3f} s')
+        run('import numba_ft; numba_ft.warm_up(); print(0)')
+        print(f'warm (after warm_up()):    {run(_STARTUP_SCRIPT):8.3f} s')
+
+
+# thread scaling of numba_ft.bulk_kernel for all forms of times and omegas (1d or 2d)
+# fails (SystemExit) if the speedup on n threads is below min_efficiency * n, or if multithreading=True on all threads is
+# not faster than multithreading=False, which catches swapped or serial parallel kernels
+# with a single thread (NUMBA_NUM_THREADS=1) nothing can be checked, which is printed as a warning
+def bench_scaling(min_efficiency=0.5):
+    import numba
+    import numba_ft
+
+    max_threads = numba.config.NUMBA_NUM_THREADS
+    threads = sorted({2**k for k in range(max_threads.bit_length()) if 2**k <= max_threads} | {max_threads})
+    n_series, num_val, num_omg = 64, 500, 500
+    values, times, weights, omegas = random_series(num_val, num_omg)
+    values = np.tile(values, (n_series, 1))
+    shapes = {'t 2d, omg 2d': (np.tile(times, (n_series, 1)), np.tile(omegas, (n_series, 1))),
+              't 2d, omg 1d': (np.tile(times, (n_series, 1)), omegas),
+              't 1d, omg 2d': (times, np.tile(omegas, (n_series, 1))),
+              't 1d, omg 1d': (times, omegas)}
+
+    print(f'thread scaling: numba_ft.bulk_kernel, {n_series} series, {num_val} times, {num_omg} omegas')
+    if max_threads == 1:
+        print('warning: only 1 thread, the speedup of multithreading=True is not checked')
+    print(f'{"shape":>13} {"threads":>7} {"time [s]":>9} {"speedup":>7} {"efficiency":>10}')
+    failed = []
+    for name, (t, omg) in shapes.items():
+        numba_ft.bulk_kernel(values, t, omg, 1, 0, multithreading=False)
+        numba_ft.bulk_kernel(values, t, omg, 1, 0, multithreading=True)
+        time_serial = best_time(numba_ft.bulk_kernel, values, t, omg, 1, 0, multithreading=False)
+        for n in threads:
+            numba.set_num_threads(n)
+            time_n = best_time(numba_ft.bulk_kernel, values, t, omg, 1, 0, multithreading=True)
+            speedup = time_serial / time_n
+            print(f'{name:>13} {n:7d} {time_n:9.4f} {speedup:7.2f} {speedup / n:10.2f}')
+            if n > 1 and speedup < min_efficiency * n:
+                failed.append(f'{name} on {n} threads: speedup {speedup:.2f}')
+        numba.set_num_threads(max_threads)
+        if max_threads > 1 and time_n >= time_serial:
+            failed.append(f'{name}: multithreading=True ({time_n:.4f} s) not faster than multithreading=False ({time_serial:.4f} s)')
+    if failed:
+        raise SystemExit('thread scaling regression: ' + '; '.join(failed))
+
+
+# cuda_ft.non_uniform_ft_call_cuda before the packed layout: every series copied element by element into a padded array,
+# arguments used for all series copied once per series
+def _marshal_padded(array, n_series):
+    if isinstance(array, np.ndarray) and array.dtype != object and array.ndim == 2:
+        return array
+    if not isinstance(array[0], (list, np.ndarray)):
+        temp = np.zeros((n_series, len(array)))
+        for i in range(n_series):
+            temp[i, :] = array[:]
+        return temp
+    temp = np.zeros((len(array), max(len(x) for x in array)))
+    for i in range(len(array)):
+        for k in range(len(array[i])):
+            temp[i, k] = array[i][k]
+    return temp
+
+
+# input marshalling of cuda_ft.non_uniform_ft_call_cuda (packing, compute on the CPU backend, unpacking)
+# against the element by element copies into padded arrays it replaced
+def bench_packing():
+    import cuda_ft
+    from packed import PackedBatch
+
+    n_series, num_val, num_omg = 2000, 200, 50
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(num_val // 2, num_val + 1, n_series)
+    times = np.sort(rng.uniform(0, 100, num_val))
+    omegas = np.linspace(0.01, 20, num_omg)
+    inputs = {'rectangular': (rng.standard_normal((n_series, num_val)), np.tile(times, (n_series, 1))),
+              'ragged': ([rng.standard_normal(n) for n in lengths], [np.sort(rng.uniform(0, 100, n)) for n in lengths]),
+              'shared times': (rng.standard_normal((n_series, num_val)), times)}
+
+    print(f'input marshalling: cuda_ft.non_uniform_ft_call_cuda, {n_series} series, up to {num_val} times, {num_omg} omegas')
+    print(f'{"input":>12} {"old [s]":>8} {"pack [s]":>8} {"speedup":>7} {"compute [s]":>11} {"unpack [s]":>10} {"times MB":>8}')
+    for name, (values, t) in inputs.items():
+        def old():
+            return _marshal_padded(values, n_series), _marshal_padded(t, n_series), _marshal_padded(omegas, n_series)
+        time_old = best_time(old, repeat=1)
+        time_pack = best_time(PackedBatch.from_lists, values, t, omegas)
+        batch = PackedBatch.from_lists(values, t, omegas)
+        # compile first
+        fts = cuda_ft.non_uniform_ft_call_cuda_packed(batch, 1, 0, device='cpu')
+        time_compute = best_time(cuda_ft.non_uniform_ft_call_cuda_packed, batch, 1, 0, device='cpu')
+        time_unpack = best_time(batch.to_padded, fts, num_val)
+        print(f'{name:>12} {time_old:8.4f} {time_pack:8.4f} {time_old / time_pack:7.1f} {time_compute:11.4f} {time_unpack:10.4f} '
+              f'{batch.times.nbytes / 2**20:8.2f}')
+
+
+# dtype=float32 (float32 cos and sin, float64 sums) against float64, for short and long baselines
+# naive: error of float32 phases omg*times without the reduction in float64
+def bench_precision():
+    import numba_ft
+    import py_ft
+
+    print('precision: dtype=float32 against float64, error relative to max |fts|')
+    print(f'{"T":>7} {"N_times":>7} {"N_omegas":>8} {"naive":>8} {"py_ft":>8} {"numba":>8} '
+          f'{"py 64 [s]":>9} {"py 32 [s]":>9} {"nb 64 [s]":>9} {"nb 32 [s]":>9}')
+    rng = np.random.default_rng(0)
+    n_series = 20
+    for baseline, num_val, num_omg in ((100, 1000, 2000), (1e5, 1000, 2000), (1e5, 10000, 500)):
+        times = np.sort(rng.uniform(0, baseline, num_val))
+        values = rng.standard_normal((n_series, num_val)) + np.sin(3.0 * times)
+        omegas = np.sort(rng.uniform(0.01, 20, num_omg))
+        ref = numba_ft.bulk_kernel(values, np.tile(times, (n_series, 1)), omegas, 1, 0)
+        scale = np.max(np.abs(ref))
+
+        arg = np.multiply.outer(omegas, times.astype(np.float32))
+        naive = np.abs(np.cos(arg.astype(np.float32)) @ values[0] - np.cos(np.multiply.outer(omegas, times)) @ values[0])
+        error_naive = np.max(naive) / np.sqrt(2 * num_val) / scale
+
+        error_py = np.max(np.abs(py_ft.ft_uneven(values[0], times, omegas, 1, 0, dtype=np.float32) - ref[0])) / scale
+        fts = numba_ft.bulk_kernel(values, np.tile(times, (n_series, 1)), omegas, 1, 0, dtype=np.float32)
+        error_numba = np.max(np.abs(fts - ref)) / scale
+
+        time_py = [best_time(py_ft.ft_uneven, values[0], times, omegas, 1, 0, dtype=dtype, repeat=1) for dtype in (np.float64, np.float32)]
+        time_nb = [best_time(numba_ft.bulk_kernel, values, np.tile(times, (n_series, 1)), omegas, 1, 0, dtype=dtype)
+                   for dtype in (np.float64, np.float32)]
+        print(f'{baseline:7.0e} {num_val:7d} {num_omg:8d} {error_naive:8.1e} {error_py:8.1e} {error_numba:8.1e} '
+              f'{time_py[0]:9.4f} {time_py[1]:9.4f} {time_nb[0]:9.4f} {time_nb[1]:9.4f}')
+
+
+BENCHMARKS = {
+    'fused': bench_fused,
+    'pool': bench_pool,
+    'startup': bench_startup,
+    'scaling': bench_scaling,
+    'packing': bench_packing,
+    'precision': bench_precision,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print()
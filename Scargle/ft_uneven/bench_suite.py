@@ -0,0 +1,425 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from bench_ft import best_time
+
+
+# benchmark and regression suite for all backends of ft_uneven
+#
+#     python bench_suite.py [--quick] [--json results.json]   sweep, printed and optionally stored as JSON
+#     python bench_suite.py compare old.json new.json          compares two stored sweeps (e.g. of two commits)
+#     python bench_suite.py reference [--regenerate]           checks all backends against ft_uneven.m
+#
+# the reference check reads its cases from reference_inputs.json (only --regenerate writes it, from reference_cases)
+# and uses reference_outputs.json if it exists, written by make_reference.m from the same inputs,
+# and otherwise a line by line python transliteration of ft_uneven.m
+# run it with NUMBA_ENABLE_CUDASIM=1 (or on a GPU) to also check the cuda kernels
+
+
+# sizes of the sweep, SWEEP_QUICK is used with --quick
+SWEEP = {'n_times': (100, 1000, 10000), 'n_omegas': (100, 1000), 'batch': (1, 32), 'weights': (False, True)}
+SWEEP_QUICK = {'n_times': (100, 1000), 'n_omegas': (100,), 'batch': (1, 8), 'weights': (False, True)}
+
+# a backend is slower in compare if its time grew by more than this factor
+SLOWDOWN = 1.25
+
+# error of the reference check allowed for backends that are not exact to rounding (relative to max |fts|),
+# the others are checked against the rtol of check_reference
+REFERENCE_RTOL = {'[float32]': 1e-5, '[nufft]': 1e-8}
+
+
+# inputs of one case of the sweep, the series have different times (2d) unless a backend uses the shared ones (1d)
+def make_case(n_times, n_omegas, batch, weights, seed=0):
+    rng = np.random.default_rng(seed)
+    times = np.sort(rng.uniform(0, 100, (batch, n_times)), axis=1)
+    return {'values': rng.standard_normal((batch, n_times)) + np.sin(3.0 * times),
+            'times': times,
+            'times_shared': times[0],
+            'omegas': np.linspace(0.0, 20, n_omegas),
+            'weights': rng.uniform(0.5, 2.0, (batch, n_times)) if weights else None}
+
+
+def _row(array, i):
+    return None if array is None else array[i]
+
+
+def _shared(case):
+    return None if case['weights'] is None else case['weights'][0]
+
+
+# backends: name -> (uses threads, function(case, threads) returning the function to time)
+# the shared-basis backends get the same times and weights for all series, all others different ones
+def _py_single(case, threads):
+    import py_ft
+    return lambda: [py_ft.ft_uneven(v, t, case['omegas'], 1, 0, weights=_row(case['weights'], i))
+                    for i, (v, t) in enumerate(zip(case['values'], case['times']))]
+
+
+def _py_bulk_serial(case, threads):
+    import py_ft
+    return lambda: py_ft.ft_uneven_bulk(case['values'], case['times'], case['omegas'], 1, 0, weights=case['weights'])
+
+
+def _py_bulk_pool(case, threads):
+    import py_ft
+    executor = py_ft.BulkExecutor(processes=threads)
+    # the pool is started before timing
+    py_ft.ft_uneven_bulk(case['values'][:1], case['times'][:1], case['omegas'][:2], 1, 0, multithreading=True, executor=executor)
+    func = lambda: py_ft.ft_uneven_bulk(case['values'], case['times'], case['omegas'], 1, 0, weights=case['weights'],
+                                        multithreading=True, executor=executor)
+    func.close = executor.close
+    return func
+
+
+def _py_bulk_shared(case, threads):
+    import py_ft
+    import shared_basis
+    # the basis is calculated in every call, not taken from the cache
+    return lambda: (shared_basis.clear_cache(),
+                    py_ft.ft_uneven_bulk(case['values'], case['times_shared'], case['omegas'], 1, 0, weights=_shared(case)))
+
+
+def _numba_single(case, threads):
+    import numba_ft
+    return lambda: [numba_ft.ft_uneven(v, t, case['omegas'], 1.0, 0.0, weights=_row(case['weights'], i))
+                    for i, (v, t) in enumerate(zip(case['values'], case['times']))]
+
+
+def _numba_bulk_kernel(case, threads):
+    import numba_ft
+    return lambda: numba_ft.ft_uneven_bulk_adaptive(case['values'], case['times'], case['omegas'], 1, 0, weights=case['weights'])
+
+
+def _numba_packed(case, threads):
+    import numba_ft
+    weights = None if case['weights'] is None else list(case['weights'])
+    return lambda: numba_ft.ft_uneven_bulk_adaptive(list(case['values']), list(case['times']), case['omegas'], 1, 0, weights=weights)
+
+
+def _numba_shared(case, threads):
+    import numba_ft
+    import shared_basis
+    return lambda: (shared_basis.clear_cache(),
+                    numba_ft.ft_uneven_bulk_adaptive(case['values'], case['times_shared'], case['omegas'], 1, 0, weights=_shared(case)))
+
+
+def _cuda_cpu(case, threads):
+    import cuda_ft
+    return lambda: cuda_ft.non_uniform_ft_call_cuda(case['values'], case['times'], case['omegas'], 1, 0, weights=case['weights'],
+                                                    device='cpu')
+
+
+BACKENDS = {
+    'py_ft.ft_uneven': (False, _py_single),
+    'py_ft.ft_uneven_bulk[serial]': (False, _py_bulk_serial),
+    'py_ft.ft_uneven_bulk[pool]': (True, _py_bulk_pool),
+    'py_ft.ft_uneven_bulk[shared basis]': (False, _py_bulk_shared),
+    'numba_ft.ft_uneven': (False, _numba_single),
+    'numba_ft.ft_uneven_bulk_adaptive[bulk_kernel]': (True, _numba_bulk_kernel),
+    'numba_ft.ft_uneven_bulk_adaptive[packed]': (True, _numba_packed),
+    'numba_ft.ft_uneven_bulk_adaptive[shared basis]': (False, _numba_shared),
+    'cuda_ft.non_uniform_ft_call_cuda[cpu]': (True, _cuda_cpu),
+}
+
+
+# peak memory in bytes allocated through python and numpy during func() (memory allocated by numba itself is not seen)
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# thread counts of the sweep: powers of 2 up to the number of cpus (and numba threads)
+def thread_counts():
+    import numba
+    max_threads = numba.config.NUMBA_NUM_THREADS
+    return sorted({2**k for k in range(max_threads.bit_length()) if 2**k <= max_threads} | {max_threads})
+
+
+# runs one backend on one case, returns a dict of the results
+# first_call is the time of the first call in this process, jit_time the part of it spent on compiling
+# (or loading from the on-disk cache of numba) and setting up
+def run_case(name, case, threads):
+    import numba
+    _, make = BACKENDS[name]
+    numba.set_num_threads(threads)
+    func = make(case, threads)
+    try:
+        start = time.perf_counter()
+        func()
+        first_call = time.perf_counter() - start
+        repeat = 1 if first_call > 1.0 else 3
+        best = best_time(func, repeat=repeat)
+        memory = peak_memory(func)
+    finally:
+        if hasattr(func, 'close'):
+            func.close()
+        numba.set_num_threads(numba.config.NUMBA_NUM_THREADS)
+    batch, n_times = case['values'].shape
+    return {'backend': name, 'n_times': n_times, 'n_omegas': len(case['omegas']), 'batch': batch,
+            'weights': case['weights'] is not None, 'threads': threads, 'time': best,
+            'throughput': batch * n_times * len(case['omegas']) / best,
+            'peak_memory': memory, 'first_call': first_call, 'jit_time': max(first_call - best, 0.0)}
+
+
+# environment of a run, to tell the stored results apart
+def environment():
+    import numba
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+                                capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'machine': platform.platform(),
+            'processor': platform.processor(), 'cpus': os.cpu_count(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'numba': numba.__version__}
+
+
+# the whole sweep, every backend for every size, weighting and (for threaded backends) thread count
+def sweep(sizes=SWEEP, backends=None):
+    results = []
+    print(f'{"backend":>47} {"N_times":>7} {"N_omegas":>8} {"batch":>5} {"weights":>7} {"threads":>7} '
+          f'{"time [s]":>9} {"Msamp*freq/s":>12} {"peak MB":>8} {"jit [s]":>8}')
+    for n_times in sizes['n_times']:
+        for n_omegas in sizes['n_omegas']:
+            for batch in sizes['batch']:
+                for weights in sizes['weights']:
+                    case = make_case(n_times, n_omegas, batch, weights)
+                    for name in backends or BACKENDS:
+                        threaded, _ = BACKENDS[name]
+                        for threads in (thread_counts() if threaded else (1,)):
+                            result = run_case(name, case, threads)
+                            results.append(result)
+                            print(f'{name:>47} {n_times:7d} {n_omegas:8d} {batch:5d} {str(weights):>7} {threads:7d} '
+                                  f'{result["time"]:9.4f} {result["throughput"] / 1e6:12.1f} '
+                                  f'{result["peak_memory"] / 2**20:8.2f} {result["jit_time"]:8.3f}')
+    return results
+
+
+def _key(result):
+    return result['backend'], result['n_times'], result['n_omegas'], result['batch'], result['weights'], result['threads']
+
+
+# compares two JSON files written by the sweep, fails (SystemExit) if a case got slower by more than SLOWDOWN
+def compare(old_path, new_path, slowdown=SLOWDOWN):
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    old_results = {_key(result): result for result in old['results']}
+    print(f'comparing {old["environment"]["commit"]} with {new["environment"]["commit"]}')
+    print(f'{"backend":>47} {"N_times":>7} {"N_omegas":>8} {"batch":>5} {"weights":>7} {"threads":>7} '
+          f'{"old [s]":>9} {"new [s]":>9} {"ratio":>6}')
+    slower = []
+    for result in new['results']:
+        key = _key(result)
+        if key not in old_results:
+            continue
+        ratio = result['time'] / old_results[key]['time']
+        print(f'{key[0]:>47} {key[1]:7d} {key[2]:8d} {key[3]:5d} {str(key[4]):>7} {key[5]:7d} '
+              f'{old_results[key]["time"]:9.4f} {result["time"]:9.4f} {ratio:6.2f}')
+        if ratio > slowdown:
+            slower.append(f'{key[0]} {key[1:]}: {ratio:.2f}x')
+    if slower:
+        raise SystemExit('slower than before: ' + '; '.join(slower))
+
+
+# This Block of methods is used to check the backends against ft_uneven.m
+
+
+# python transliteration of ft_uneven.m, one frequency at a time
+def reference_ft_uneven(xx_vec, tt_vec, ww_vec, ft_sign, tt_zero, wt_vec=None):
+    if wt_vec is not None:
+        xx_vec = wt_vec * xx_vec
+    num_xt = len(xx_vec)
+    ft_vec = np.zeros(len(ww_vec), dtype=np.complex128)
+    ls_vec = np.zeros(len(ww_vec))
+    for ii_ww, wrun in enumerate(ww_vec):
+        if wrun == 0:
+            ft_vec[ii_ww] = np.sum(xx_vec) / np.sqrt(num_xt)
+            ls_vec[ii_ww] = ft_vec[ii_ww].real**2
+            continue
+        wt = 1.0 if wt_vec is None else wt_vec
+        csum = np.sum(wt * np.cos(2.0 * wrun * tt_vec))
+        ssum = np.sum(wt * np.sin(2.0 * wrun * tt_vec))
+        wtau = 0.5 * np.arctan2(ssum, csum)
+
+        sumr = np.sum(xx_vec * np.cos(wrun * tt_vec - wtau))
+        sumi = np.sum(xx_vec * np.sin(wrun * tt_vec - wtau))
+        scos2 = np.sum(wt * np.cos(wrun * tt_vec - wtau)**2)
+        ssin2 = np.sum(wt * np.sin(wrun * tt_vec - wtau)**2)
+
+        ft_real = sumr / (np.sqrt(2) * np.sqrt(scos2))
+        ft_imag = ft_sign * sumi / (np.sqrt(2) * np.sqrt(ssin2))
+        phi_this = wtau - wrun * tt_zero
+        ft_vec[ii_ww] = complex(ft_real, ft_imag) * np.exp(1j * phi_this)
+        ls_vec[ii_ww] = sumr**2 / scos2 + sumi**2 / ssin2
+    return ft_vec, ls_vec
+
+
+# cases of the reference check: short and long series, weights on and off, both signs, omega = 0 and a time origin,
+# the last ones with evenly spaced omegas for the recurrence and the nufft
+def reference_cases(seed=1):
+    rng = np.random.default_rng(seed)
+    cases = []
+    for n_times, n_omegas, weighted, ft_sign, tt_zero, even in ((10, 7, False, 1, 0.0, False), (50, 40, True, -1, 3.5, False),
+                                                              (300, 120, False, -1, 10.0, False), (300, 120, True, 1, -2.0, False),
+                                                              (1000, 25, True, 1, 0.0, False), (400, 200, False, 1, 0.0, True),
+                                                              (2000, 300, True, -1, 5.0, True)):
+        tt_vec = np.sort(rng.uniform(0, 50, n_times))
+        if even:
+            ww_vec = np.linspace(0.0, 15, n_omegas)
+        else:
+            ww_vec = np.concatenate(([0.0], np.sort(rng.uniform(0.01, 15, n_omegas - 1))))
+        cases.append({'xx_vec': rng.standard_normal(n_times) + np.cos(1.3 * tt_vec),
+                      'tt_vec': tt_vec,
+                      'ww_vec': ww_vec,
+                      'wt_vec': rng.uniform(0.2, 3.0, n_times) if weighted else None,
+                      'ft_sign': ft_sign, 'tt_zero': tt_zero})
+    return cases
+
+
+def write_reference_inputs(path, cases):
+    with open(path, 'w') as file:
+        json.dump([{key: (value.tolist() if isinstance(value, np.ndarray) else [] if value is None else value)
+                    for key, value in case.items()} for case in cases], file)
+
+
+# cases written by write_reference_inputs (json keeps the floats exactly)
+def read_reference_inputs(path):
+    with open(path) as file:
+        cases = json.load(file)
+    return [{'xx_vec': np.array(case['xx_vec'], dtype=np.float64), 'tt_vec': np.array(case['tt_vec'], dtype=np.float64),
+             'ww_vec': np.array(case['ww_vec'], dtype=np.float64),
+             'wt_vec': np.array(case['wt_vec'], dtype=np.float64) if len(case['wt_vec']) else None,
+             'ft_sign': case['ft_sign'], 'tt_zero': case['tt_zero']} for case in cases]
+
+
+# reference outputs (ft_vec, ls_vec) of every case, from make_reference.m if its output exists
+def reference_outputs(cases, path):
+    if os.path.exists(path):
+        with open(path) as file:
+            outputs = json.load(file)
+        return 'ft_uneven.m', [(np.atleast_1d(out['ft_real']) + 1j * np.atleast_1d(out['ft_imag']), np.atleast_1d(out['ls_vec']))
+                               for out in outputs]
+    return 'python transliteration of ft_uneven.m', [reference_ft_uneven(**case) for case in cases]
+
+
+# fts of one case from every backend
+def backend_outputs(case):
+    import cuda_ft
+    import numba_ft
+    import py_ft
+    import shared_basis
+
+    values, times, omegas, weights = case['xx_vec'], case['tt_vec'], case['ww_vec'], case['wt_vec']
+    sign, zero = case['ft_sign'], case['tt_zero']
+    weights_2d = None if weights is None else weights[None]
+    shared_basis.clear_cache()
+    outputs = {
+        'py_ft.ft_uneven': py_ft.ft_uneven(values, times, omegas, sign, zero, weights=weights, return_ls=True),
+        'py_ft.ft_uneven_bulk[serial]': py_ft.ft_uneven_bulk([values], [times], [omegas], sign, zero,
+                                                             weights=None if weights is None else [weights], return_ls=True)[0],
+        'py_ft.ft_uneven_bulk[shared basis]': py_ft.ft_uneven_bulk(values[None], times, omegas, sign, zero, weights=weights,
+                                                                   return_ls=True)[0],
+        'numba_ft.ft_uneven': numba_ft.ft_uneven(values, times, omegas, float(sign), float(zero), weights=weights),
+        'numba_ft.ft_uneven_bulk_adaptive[bulk_kernel]': numba_ft.ft_uneven_bulk_adaptive(values[None], times[None], omegas, sign, zero,
+                                                                                          weights=weights_2d)[0],
+        'numba_ft.ft_uneven_bulk_adaptive[packed]': numba_ft.ft_uneven_bulk_adaptive([values], [times], omegas, sign, zero,
+                                                                                     weights=None if weights is None else [weights])[0],
+        'numba_ft.ft_uneven_bulk_adaptive[shared basis]': numba_ft.ft_uneven_bulk_adaptive(values[None], times, omegas, sign, zero,
+                                                                                           weights=weights)[0],
+        'cuda_ft.non_uniform_ft_call_cuda[cpu]': cuda_ft.non_uniform_ft_call_cuda([values], times, omegas, sign, zero, weights=weights_2d,
+                                                                                  device='cpu')[0, :len(omegas)],
+    }
+    if cuda_ft.cuda.is_available():
+        outputs['cuda_ft.non_uniform_ft_call_cuda[gpu]'] = cuda_ft.non_uniform_ft_call_cuda([values], times, omegas, sign, zero,
+                                                                                            weights=weights_2d, device='gpu')[0, :len(omegas)]
+    # recurrence, nufft (evenly spaced omegas only), float32 and harmonics paths
+    # the second harmonic of omegas/2 is on the omegas of the case (halving is exact)
+    even = py_ft.uniform_grid(omegas, times, 1e-12) is not None
+    outputs['py_ft.ft_uneven[recurrence]'] = py_ft.ft_uneven(values, times, omegas, sign, zero, weights=weights, return_ls=True,
+                                                            recurrence_tol=1e-12)
+    outputs['numba_ft.ft_uneven[recurrence]'] = numba_ft.ft_uneven(values, times, omegas, float(sign), float(zero), weights=weights,
+                                                                   recurrence_tol=1e-12)
+    if even:
+        outputs['py_ft.ft_uneven[nufft]'] = py_ft.ft_uneven(values, times, omegas, sign, zero, weights=weights, return_ls=True,
+                                                           method='nufft')
+    outputs['py_ft.ft_uneven[float32]'] = py_ft.ft_uneven(values, times, omegas, sign, zero, weights=weights, return_ls=True,
+                                                         dtype=np.float32)
+    outputs['numba_ft.ft_uneven[float32]'] = numba_ft.ft_uneven(values.astype(np.float32), times, omegas, float(sign), float(zero),
+                                                                weights=None if weights is None else weights.astype(np.float32))
+    fts, _ = py_ft.ft_uneven(values, times, omegas / 2, sign, zero, weights=weights, return_ls=True, n_harmonics=2)
+    outputs['py_ft.ft_uneven[harmonics]'] = fts[1]
+    fts, _ = numba_ft.ft_uneven_harmonics(values, times, omegas / 2, float(sign), float(zero), 2, weights=weights)
+    outputs['numba_ft.ft_uneven_harmonics'] = fts[1]
+
+    with py_ft.BulkExecutor(processes=2) as executor:
+        outputs['py_ft.ft_uneven_bulk[pool]'] = py_ft.ft_uneven_bulk([values], [times], [omegas], sign, zero,
+                                                                     weights=None if weights is None else [weights], return_ls=True,
+                                                                     multithreading=True, executor=executor)[0]
+    return outputs
+
+
+# checks every backend against the reference, fails (SystemExit) if an error relative to max |fts| (or max lss) is above rtol
+# (or REFERENCE_RTOL of the backend), regenerate: writes reference_inputs.json from reference_cases first
+# (make_reference.m has to be run again afterwards)
+def check_reference(rtol=1e-9, directory=None, regenerate=False):
+    directory = directory or os.path.dirname(os.path.abspath(__file__))
+    inputs = os.path.join(directory, 'reference_inputs.json')
+    if regenerate:
+        write_reference_inputs(inputs, reference_cases())
+    cases = read_reference_inputs(inputs) if os.path.exists(inputs) else reference_cases()
+    source, references = reference_outputs(cases, os.path.join(directory, 'reference_outputs.json'))
+
+    print(f'reference check against {source}')
+    print(f'{"backend":>47} {"case":>4} {"fts error":>10} {"lss error":>10}')
+    failed = []
+    errors = {}
+    for k, (case, (ft_ref, ls_ref)) in enumerate(zip(cases, references)):
+        for name, output in backend_outputs(case).items():
+            fts, lss = output if isinstance(output, tuple) else (output, None)
+            limit = next((value for key, value in REFERENCE_RTOL.items() if key in name), rtol)
+            ft_error = np.max(np.abs(fts - ft_ref)) / np.max(np.abs(ft_ref))
+            ls_error = np.nan if lss is None else np.max(np.abs(lss - ls_ref)) / np.max(np.abs(ls_ref))
+            errors.setdefault(name, []).append(ft_error)
+            print(f'{name:>47} {k:4d} {ft_error:10.1e} {ls_error:10.1e}')
+            if not ft_error <= limit or ls_error > limit:
+                failed.append(f'{name} case {k}: {ft_error:.1e}')
+    if failed:
+        raise SystemExit('disagreement with the reference: ' + '; '.join(failed))
+    return {'source': source, 'rtol': rtol, 'max_error': {name: max(values) for name, values in errors.items()}}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='benchmark and regression suite of the ft_uneven backends')
+    parser.add_argument('command', nargs='*', default=['sweep'], help='sweep (default), reference, or compare OLD.json NEW.json')
+    parser.add_argument('--quick', action='store_true', help='small sizes only')
+    parser.add_argument('--json', help='stores the results of the sweep and the reference check in this file')
+    parser.add_argument('--backend', action='append', choices=list(BACKENDS), help='run only this backend (repeatable)')
+    parser.add_argument('--regenerate', action='store_true', help='rewrite reference_inputs.json (then rerun make_reference.m)')
+    args = parser.parse_args()
+
+    if args.command[0] == 'compare':
+        compare(*args.command[1:3])
+    elif args.command[0] == 'reference':
+        check_reference(regenerate=args.regenerate)
+    else:
+        reference = check_reference()
+        print()
+        results = sweep(SWEEP_QUICK if args.quick else SWEEP, args.backend)
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump({'environment': environment(), 'reference': reference, 'results': results}, file, indent=1)
@@ -0,0 +1,229 @@
+import numpy as np
+
+import py_ft
+
+
+# autocorrelation and cross-correlation functions of unevenly sampled series (Scargle 1989, paper III)
+# the power spectrum |FT|**2 (or the cross spectrum FT_a * conj(FT_b)) is calculated on an evenly spaced
+# frequency grid and transformed back to an evenly spaced lag grid with numpy.fft.irfft
+# the same is done for the sampling pattern (values 1), its correlation function (the spectral window) is divided out
+# FT is the sum over the samples of w * v * exp(1j*omg*t), the ft of ft_uneven without its normalization:
+# the tau rotation drops out of |FT|**2, but the division by sqrt(2*scos2) and sqrt(2*ssin2) does not, so |ft_uneven|**2
+# is not the transform of the sums over pairs (it differs from it already for evenly sampled data off the Fourier frequencies)
+# FT_a * conj(FT_b) is the sum over all pairs of w_a * w_b * a * b * exp(1j*omg*(t_a - t_b)), so for evenly sampled data
+# (dlag the sampling step) the result is sum(a(t) * b(t + lag)) / (number of pairs at lag) up to rounding (nufft: its tol),
+# for uneven times the pairs are interpolated to the lag grid, the pairs at exactly the same time (every sample with itself
+# in acf_uneven) would be mixed with the close pairs at lag 0 and bias it, so their sums (constant in omg) are subtracted
+# from both spectra before the transform and lag 0 is their exact ratio
+# only requires the "numpy" module
+
+
+# frequency spacing and number of frequencies for lags 0, dlag, 2*dlag, ... and series spanning baseline
+# the lag grid of the fft has to be longer than 2*baseline, or the correlation of long lags wraps around to short ones
+# returns (omegas, n_fft), n_fft is odd so the grid has no frequency at the Nyquist frequency of the lag grid
+def _frequency_grid(baseline, dlag):
+    num_lag = int(np.ceil(baseline / dlag)) + 1
+    n_fft = 2 * num_lag - 1
+    return 2 * np.pi * np.arange(num_lag) / (n_fft * dlag), n_fft
+
+
+# list of 1-dim arrays, one per series, from the arguments of the bulk functions (1-dim arguments are used for all series)
+def _series(array, n_series):
+    if array is None:
+        return [None] * n_series
+    if py_ft.is2d(array):
+        return [np.asarray(x, dtype=np.float64) for x in array]
+    return [np.asarray(array, dtype=np.float64)] * n_series
+
+
+# default lag spacing: the mean spacing of the samples of the densest series
+def _default_dlag(times):
+    return min(np.ptp(t) / (len(t) - 1) for t in times if len(t) > 1)
+
+
+# sum of w * v * exp(1j*omg*t) for the omegas (evenly spaced from 0) of one series, ndarray(1 dim) complex
+# direct: in blocks of frequencies (see py_ft.block_size), nufft: nufft_ft.nufft1 in O(N log N)
+def _series_sums(values, times, weights, omegas, method, tol=1e-10):
+    coeffs = values if weights is None else weights * values
+    if method == 'nufft':
+        import nufft_ft
+        return nufft_ft.nufft1((omegas[1] - omegas[0]) * times, coeffs.astype(np.complex128), len(omegas), tol)
+    sums = np.empty(len(omegas), dtype=np.complex128)
+    block = py_ft.block_size(len(times))
+    for start in range(0, len(omegas), block):
+        arg = py_ft.phases(omegas[start:start + block], times)
+        sums[start:start + block] = np.cos(arg) @ coeffs + 1j * (np.sin(arg) @ coeffs)
+    return sums
+
+
+# FT of all series on omegas, ndarray(2 dim) (n_series, len(omegas))
+# method: 'direct', 'nufft' or 'auto' (see py_ft.use_nufft), multithreading: the series are calculated by the pool of
+# py_ft.default_executor
+def _spectra(values, times, weights, omegas, method, multithreading):
+    if method not in ('direct', 'nufft', 'auto'):
+        raise ValueError(f"method needs to be 'direct', 'nufft' or 'auto', but is {method}")
+    if method == 'auto':
+        method = 'nufft' if py_ft.use_nufft(max(len(t) for t in times), omegas, max(times, key=len), 1e-10) else 'direct'
+    args = [(v, t, w, omegas, method) for v, t, w in zip(values, times, weights)]
+    if multithreading:
+        return np.array(py_ft.default_executor().map(_series_sums, args))
+    return np.array([_series_sums(*arg) for arg in args])
+
+
+# times (sorted, without repetitions) with the sums of w * v and of w over the samples at each of them
+def _per_time(values, times, weights):
+    unique, inverse = np.unique(times, return_inverse=True)
+    weights = np.ones(len(times)) if weights is None else weights
+    return unique, np.bincount(inverse, weights * values, len(unique)), np.bincount(inverse, weights, len(unique))
+
+
+# sums over the pairs of samples of a and b at the same time (lag exactly 0) of w_a * a * w_b * b and of w_a * w_b,
+# for every pair of series, returns two ndarrays(1 dim) (n_series)
+def _zero_lag_sums(values_a, times_a, weights_a, values_b, times_b, weights_b):
+    sums = np.zeros((2, len(values_a)))
+    for i, args in enumerate(zip(values_a, times_a, weights_a, values_b, times_b, weights_b)):
+        times_a_i, wvalues_a, wsum_a = _per_time(*args[:3])
+        times_b_i, wvalues_b, wsum_b = _per_time(*args[3:])
+        _, index_a, index_b = np.intersect1d(times_a_i, times_b_i, assume_unique=True, return_indices=True)
+        sums[:, i] = wvalues_a[index_a] @ wvalues_b[index_b], wsum_a[index_a] @ wsum_b[index_b]
+    return sums
+
+
+# values with the (weighted) mean subtracted
+def _demeaned(values, weights):
+    return [v - np.average(v, weights=w) for v, w in zip(values, weights)]
+
+
+# the correlation function on lags 0, ..., n_fft - 1 (negative lags at the end) from a cross spectrum on omegas
+def _correlation(spectrum, n_fft):
+    return np.fft.irfft(spectrum, n_fft, axis=-1)
+
+
+# spectrum and window (cross spectra on omegas) without their zero lag sums, to the correlation on lags 0, ..., n_fft - 1
+# with the exact ratio of the zero lag sums at lag 0 (nan without pairs at the same time)
+def _normalized_correlation(spectrum, window, zero_lag, n_fft):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlation = _correlation(spectrum - zero_lag[0][:, None], n_fft) / _correlation(window - zero_lag[1][:, None], n_fft)
+        correlation[:, 0] = zero_lag[0] / zero_lag[1]
+    return correlation
+
+
+# values: list or ndarray(1 dim) for one series, or list (containing lists or ndarrays(1 dim)) or ndarray(2 dim) for many
+# times, weights: same as values, or list or ndarray(1 dim) used for all series, weights can be None
+# max_lag, dlag: float or None, the lags are 0, dlag, ..., max_lag, by default max_lag is the longest baseline
+# and dlag the mean spacing of the samples of the densest series
+# demean: boolean, subtract the (weighted) mean of every series first
+# method: 'direct', 'nufft' or 'auto', how the fts are calculated, the nufft takes O(N log N) per series
+# multithreading: boolean, see py_ft.ft_uneven_bulk
+# returns (lags, acf), acf is ndarray(1 dim) for one series and ndarray(2 dim) (n_series, len(lags)) for many
+def acf_uneven(values, times, max_lag=None, dlag=None, weights=None, demean=True, method='auto', multithreading=False):
+    single = not py_ft.is2d(values)
+    if single:
+        values = [values]
+    n_series = len(values)
+    values = _series(values, n_series)
+    times = _series(times, n_series)
+    weights = _series(weights, n_series)
+
+    baseline = max(np.ptp(t) for t in times)
+    if dlag is None:
+        dlag = _default_dlag(times)
+    if max_lag is None:
+        max_lag = baseline
+    omegas, n_fft = _frequency_grid(baseline, dlag)
+    num_lag = int(np.floor(max_lag / dlag + 1e-9)) + 1
+
+    if demean:
+        values = _demeaned(values, weights)
+    fts = _spectra(values, times, weights, omegas, method, multithreading)
+    windows = _spectra([np.ones(len(t)) for t in times], times, weights, omegas, method, multithreading)
+
+    zero_lag = _zero_lag_sums(values, times, weights, values, times, weights)
+    acf = _normalized_correlation(np.abs(fts)**2, np.abs(windows)**2, zero_lag, n_fft)[:, :num_lag]
+    lags = dlag * np.arange(num_lag)
+    if single:
+        return lags, acf[0]
+    return lags, acf
+
+
+# pairs of series a and b, every argument as in acf_uneven, values_a and values_b need the same number of series
+# returns (lags, ccf) with lags -max_lag, ..., max_lag and ccf(lag) the correlation of a(t) with b(t + lag)
+def ccf_uneven(values_a, times_a, values_b, times_b, max_lag=None, dlag=None, weights_a=None, weights_b=None, demean=True,
+               method='auto', multithreading=False):
+    single = not py_ft.is2d(values_a)
+    if single:
+        values_a = [values_a]
+        values_b = [values_b]
+    n_series = len(values_a)
+    if len(values_b) != n_series:
+        raise ValueError(f'values_a and values_b need the same number of series, but have {n_series} and {len(values_b)}')
+    values_a, values_b = _series(values_a, n_series), _series(values_b, n_series)
+    times_a, times_b = _series(times_a, n_series), _series(times_b, n_series)
+    weights_a, weights_b = _series(weights_a, n_series), _series(weights_b, n_series)
+
+    # lags between a and b reach over both series
+    baseline = max(max(ta.max(), tb.max()) - min(ta.min(), tb.min()) for ta, tb in zip(times_a, times_b))
+    if dlag is None:
+        dlag = _default_dlag(times_a + times_b)
+    if max_lag is None:
+        max_lag = baseline
+    omegas, n_fft = _frequency_grid(baseline, dlag)
+    num_lag = int(np.floor(max_lag / dlag + 1e-9)) + 1
+
+    if demean:
+        values_a = _demeaned(values_a, weights_a)
+        values_b = _demeaned(values_b, weights_b)
+    # both series of all pairs in one bulk calculation
+    fts = _spectra(values_a + values_b, times_a + times_b, weights_a + weights_b, omegas, method, multithreading)
+    windows = _spectra([np.ones(len(t)) for t in times_a + times_b], times_a + times_b, weights_a + weights_b, omegas, method,
+                       multithreading)
+
+    # positive lags at the start of the irfft, negative ones at the end
+    order = np.concatenate((np.arange(n_fft - num_lag + 1, n_fft), np.arange(num_lag)))
+    zero_lag = _zero_lag_sums(values_a, times_a, weights_a, values_b, times_b, weights_b)
+    ccf = _normalized_correlation(fts[:n_series] * np.conj(fts[n_series:]), windows[:n_series] * np.conj(windows[n_series:]),
+                                  zero_lag, n_fft)[:, order]
+    lags = dlag * np.arange(-num_lag + 1, num_lag)
+    if single:
+        return lags, ccf[0]
+    return lags, ccf
+
+
+# test if code runs and compare with the direct sums over all pairs for evenly sampled data
+if __name__ == '__main__':
+    ran = np.random.standard_normal
+    times = np.arange(200.0)
+    a = ran(size=200)
+    b = np.roll(a, 5) + 0.1 * ran(size=200)
+
+    lags, acf = acf_uneven(a, times, max_lag=50)
+    a0 = a - a.mean()
+    direct = np.array([np.dot(a0[:200 - j], a0[j:]) / (200 - j) for j in range(51)])
+    print(np.max(np.abs(acf - direct)))
+    assert np.max(np.abs(acf - direct)) < 1e-12
+    lags, acf = acf_uneven(a, times, max_lag=50, method='nufft')
+    assert np.max(np.abs(acf - direct)) < 1e-8
+
+    lags, ccf = ccf_uneven(a, times, b, times, max_lag=20)
+    print(lags[np.argmax(ccf)])
+    b0 = b - b.mean()
+    direct = np.array([np.dot(a0[max(0, -j):200 - max(0, j)], b0[max(0, j):200 + min(0, j)]) / (200 - abs(j)) for j in range(-20, 21)])
+    assert np.max(np.abs(ccf - direct)) < 1e-12
+
+    # uneven sampling: lag 0 is the (weighted) variance, white noise has no correlation at the other lags
+    rng = np.random.default_rng(4)
+    for seed in range(5):
+        times = np.sort(rng.uniform(0, 200, size=300))
+        noise = rng.standard_normal(300)
+        weights = rng.uniform(0.5, 2, size=300)
+        lags, acf = acf_uneven(noise, times, max_lag=20)
+        print(acf[0], np.var(noise), np.max(np.abs(acf[1:])))
+        assert abs(acf[0] - np.var(noise)) < 1e-12 and np.max(np.abs(acf[1:])) < 0.5
+        lags, acf = acf_uneven(noise, times, max_lag=20, weights=weights)
+        wnoise = weights * (noise - np.average(noise, weights=weights))
+        assert abs(acf[0] - wnoise @ wnoise / (weights @ weights)) < 1e-12
+    lags, ccf = ccf_uneven(noise, times, noise, times, max_lag=20)
+    assert abs(ccf[lags == 0][0] - np.var(noise)) < 1e-12
+
+    lags, acf = acf_uneven(np.sin(0.3 * times) + 0.1 * ran(size=300), times, max_lag=40, dlag=0.5)
+    print(lags[np.argmax(acf[10:]) + 10], 2 * np.pi / 0.3)
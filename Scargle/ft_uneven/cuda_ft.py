@@ -4,290 +4,247 @@ import numba
 import math 
 import cmath
 
+import instrument
+from packed import PackedBatch
+from py_ft import trig_dtype
 
-# only call non_uniform_call_cuda
+
+# only call non_uniform_ft_call_cuda or non_uniform_ft_call_cuda_packed
 # equivivalt to py_ft.ft_uneven_bulk
-# all times and omegas that are not on pos 0 for each time series, will lead to erros
-# this is not checked in the code to aviod slow-down
-# returned value is an ndarray (2-dim), which is not cropped according to the amount of omegas
+# the series are passed to the GPU in the packed layout of packed.PackedBatch, so every value of times
+# (also 0) is allowed and no space is wasted for series of different lengths
+# non_uniform_ft_call_cuda returns an ndarray (2-dim), which is not cropped according to the amount of omegas
 # additional space is filled with 0 (0+0j)
 
 
-# times and omegas are only allowed to be 0 for the first element of each time_series
-# types => values : 2d float64, times : 2d float64, omegas : 2d float64, fts : complex128, ft_sign : int, t_zeros = float64
+# cos and sin of arg, if single in float32 after reducing arg to [-pi, pi] in float64 (see py_ft.phases)
+# both are returned as float64, so the sums are accumulated in float64
+def _cos_sin(arg, single):
+    if single:
+        phase = numba.float32(arg - 2.0 * math.pi * math.floor(arg / (2.0 * math.pi) + 0.5))
+        return float(math.cos(phase)), float(math.sin(phase))
+    return math.cos(arg), math.sin(arg)
+
+
+_cos_sin_gpu = cuda.jit(device=True)(_cos_sin)
+_cos_sin_cpu = numba.njit(cache=True)(_cos_sin)
+
+
+# the body of the kernels, compiled for the GPU and the CPU with the cos_sin of the same target
+# returns the ft of frequency y of the packed batch, weights: 1d float64 (or float32) or None (all weights 1),
+# values are expected to be multiplied with the weights already, the other arguments are those of the kernels
+def _make_ft_frequency(cos_sin):
+    def ft_frequency(y, values, weights, times, omegas, value_offsets, time_offsets, omega_series, ft_sign, t_zero):
+        x = omega_series[y]
+        start = value_offsets[x]
+        stop = value_offsets[x + 1]
+        shift = time_offsets[x] - start
+        omg = omegas[y]
+        single = values.itemsize == 4
+        if omg == 0:
+            summe = 0.0
+            for i in range(start, stop):
+                summe += values[i]
+            return complex(summe/math.sqrt(float(stop - start)))
+
+        csum = 0.0
+        ssum = 0.0
+        for i in range(start, stop):
+            cos_arg, sin_arg = cos_sin(2.0 * omg * times[i + shift], single)
+            weight = 1.0 if weights is None else weights[i]
+            csum += weight * cos_arg
+            ssum += weight * sin_arg
+        tau = 0.5 * math.atan2(ssum, csum)
+
+        sumr = 0.0
+        sumi = 0.0
+        scos2 = 0.0
+        ssin2 = 0.0
+
+        for i in range(start, stop):
+            cos_arg, sin_arg = cos_sin(omg * times[i + shift] - tau, single)
+            weight = 1.0 if weights is None else weights[i]
+            sumr += values[i] * cos_arg
+            sumi += values[i] * sin_arg
+            scos2 += weight * cos_arg * cos_arg
+            ssin2 += weight * sin_arg * sin_arg
+
+        ft_real = sumr / (math.sqrt(2.0) * math.sqrt(scos2))
+        ft_imag = ft_sign * sumi / (math.sqrt(2.0) * math.sqrt(ssin2))
+        phi_this = tau - omg * t_zero
+
+        return complex(ft_real, ft_imag) * cmath.exp(complex(0, phi_this))
+    return ft_frequency
+
+
+_ft_frequency_gpu = cuda.jit(device=True)(_make_ft_frequency(_cos_sin_gpu))
+_ft_frequency_cpu = numba.njit(cache=True)(_make_ft_frequency(_cos_sin_cpu))
+
+
+# one thread per frequency, omega_series gives the series of each frequency
+# float32 values use float32 cos and sin (see _cos_sin)
+# types => values : 1d float64, times : 1d float64, omegas : 1d float64, value_offsets, time_offsets, omega_series : 1d int64,
+# fts : 1d complex128, ft_sign : float64, t_zero : float64, values and weights can also be 1d float32
 @cuda.jit
-def non_uniform_ft_cuda_no_weights(values, times, omegas, fts, ft_sign, t_zero):
-    x, y = cuda.grid(2)
-    if x < omegas.shape[0] and y < omegas.shape[1] and (y == 0 or omegas[x, y] != 0):
-        if omegas[x, y] == 0:
-            count = 1
-            summe = values[x, 0]
-            while count < omegas.shape[1] and times[x, count] != 0:
-                summe += values[x, count]
-                count += 1
-            fts[x, y] = complex(summe/math.sqrt(float(count)))
-        else:
-            max_time = 1
-            while max_time < omegas.shape[1] and times[x, max_time] != 0:
-                max_time += 1
-            csum = 0
-            ssum = 0
-            for i in range(max_time):
-                csum += math.cos(2.0 * omegas[x, y] * times[x, i])
-                ssum += math.sin(2.0 * omegas[x, y] * times[x, i])
-            tau = 0.5 * math.atan2(ssum, csum)
-
-            sumr = 0
-            sumi = 0
-            scos2 = 0
-            ssin2 = 0
-
-            for i in range(max_time):
-                sumr += values[x, i] * math.cos(omegas[x, y] * times[x, i] - tau)
-                sumi += values[x, i] * math.sin(omegas[x, y] * times[x, i] - tau)
-                scos2 += math.pow(math.cos(omegas[x, y] * times[x, i] - tau), 2)
-                ssin2 += math.pow(math.sin(omegas[x, y] * times[x, i] - tau), 2)
-
-            ft_real = sumr / (math.sqrt(2.0) * math.sqrt(scos2))
-            ft_imag = ft_sign * sumi / (math.sqrt(2.0) * math.sqrt(ssin2))
-            phi_this = tau - omegas[x, y] * t_zero
-
-            fts[x, y] = complex(ft_real, ft_imag) * cmath.exp(complex(0, phi_this))
+def non_uniform_ft_cuda_no_weights(values, times, omegas, value_offsets, time_offsets, omega_series, fts, ft_sign, t_zero):
+    y = cuda.grid(1)
+    if y < omegas.shape[0]:
+        fts[y] = _ft_frequency_gpu(y, values, None, times, omegas, value_offsets, time_offsets, omega_series, ft_sign, t_zero)
 
 
+# values are expected to be multiplied with the weights already
 @cuda.jit
-def non_uniform_ft_cuda_with_weights(values, weights, times, omegas, fts, ft_sign, t_zero):
-    x, y = cuda.grid(2)
-    if x < omegas.shape[0] and y < omegas.shape[1] and (y == 0 or omegas[x, y] != 0):
-        if omegas[x, y] == 0:
-            count = 1
-            summe = values[x, 0]
-            while count < omegas.shape[1] and times[x, count] != 0:
-                summe += values[x, count]
-                count += 1
-            fts[x, y] = complex(summe/math.sqrt(float(count)))
-        else:
-            max_time = 1
-            while max_time < omegas.shape[1] and times[x, max_time] != 0:
-                max_time += 1
-            csum = 0
-            ssum = 0
-            for i in range(max_time):
-                csum += weights[x, i] * math.cos(2.0 * omegas[x, y] * times[x, i])
-                ssum += weights[x, i] * math.sin(2.0 * omegas[x, y] * times[x, i])
-            tau = 0.5 * math.atan2(ssum, csum)
-
-            sumr = 0
-            sumi = 0
-            scos2 = 0
-            ssin2 = 0
-
-            for i in range(max_time):
-                sumr += values[x, i] * math.cos(omegas[x, y] * times[x, i] - tau)
-                sumi += values[x, i] * math.sin(omegas[x, y] * times[x, i] - tau)
-                scos2 += weights[x, i] * math.pow(math.cos(omegas[x, y] * times[x, i] - tau), 2)
-                ssin2 += weights[x, i] * math.pow(math.sin(omegas[x, y] * times[x, i] - tau), 2)
-
-            ft_real = sumr / (math.sqrt(2.0) * math.sqrt(scos2))
-            ft_imag = ft_sign * sumi / (math.sqrt(2.0) * math.sqrt(ssin2))
-            phi_this = tau - omegas[x, y] * t_zero
-
-            fts[x, y] = complex(ft_real, ft_imag) * cmath.exp(complex(0, phi_this))
-
-
-def non_uniform_ft_call_cuda(values, times, omegas, ft_sign, t_zero, kernel=(16, 16), weights=None):
-    # make values in the right shape and stuff
-    if type(values) == list:
-        if len([True for x in values if type(x) != list]) != 0:
-                raise TypeError(f'values needs to contain only lists if it is 1-dimensonal')
-        max_len = max([len(x) for x in values])
-        temp = np.zeros((len(values), max_len))
-        for i in range(len(values)):
-            for k in range(len(values[i])):
-                temp[i, k] = values[i][k]
-        values = temp
-
-    elif type(values) == np.ndarray:
-        if len(values.shape) == 1:
-            if len([True for x in values if type(x) != list]) != 0:
-                raise TypeError(f'values needs to contain only lists if it is 1-dimensonal')
-            max_len = max([len(x) for x in values])
-            temp = np.zeros((len(values), max_len))
-            for i in range(len(values)):
-                for k in range(len(values[i])):
-                    temp[i, k] = values[i][k]
-            values = temp
-
-        elif len(values.shape) != 2:
-            raise TypeError(f'values is expected to be 2-dimensional, but recived array was {len(values.shape)} dimesions')
-
-    else: 
-        raise TypeError(f'values is expected to be list or numpy ndarray, but type is {type(values)}')
-
-    # make times
-    if type(times) == list:
-        if len([True for x in times if type(x) != list]) == 0:
-            max_len = max([len(x) for x in times])
-            temp = np.zeros((len(times), max_len))
-            for i in range(len(times)):
-                for k in range(len(times[i])):
-                    temp[i, k] = times[i][k]
-            times = temp
-        elif len([True for x in times if type(float(x)) != float]):
-            temp = np.zeros((len(values), len(times)))
-            for i in range(len(values)):
-                temp[i, :] = times[:]
-            times = temp
-        else:
-            raise TypeError(f'times needs to contain only lists or floats if it is 1-dimensonal')
-
-    elif type(times) == np.ndarray:
-        if len(times.shape) == 1:
-            if len([True for x in times if type(x) != list]) == 0:
-                max_len = max([len(x) for x in times])
-                temp = np.zeros((len(times), max_len))
-                for i in range(len(times)):
-                    for k in range(len(times[i])):
-                        temp[i, k] = times[i][k]
-                times = temp
-            elif times.dtype == np.float64 or times.dtype == np.float32 or times.dtype == np.int32:
-                temp = np.zeros((len(values), len(times)))
-                for i in range(len(values)):
-                    temp[i, :] = times[:]
-                times = temp
-            else:
-                raise TypeError(f'times needs to contain only lists or floats if it is 1-dimensonal')
-
-        elif len(times.shape) != 2:
-            raise TypeError(f'times is expected to be 2-dimensional, but recived array was {len(times.shape)} dimesions')
-
-    else: 
-        raise TypeError(f'times is expected to be list or numpy ndarray, but type is {type(times)}')
-
-    # make omegas
-    if type(omegas) == list:
-        if len([True for x in omegas if type(x) != list]) == 0:
-            max_len = max([len(x) for x in omegas])
-            temp = np.zeros((len(omegas), max_len))
-            for i in range(len(omegas)):
-                for k in range(len(omegas[i])):
-                    temp[i, k] = omegas[i][k]
-            omegas = temp
-        elif len([True for x in omegas if type(float(x)) != float]):
-            temp = np.zeros((len(values), len(omegas)))
-            for i in range(len(values)):
-                temp[i, :] = omegas[:]
-            omegas = temp
-        else:
-            raise TypeError(f'omegas needs to contain only lists or floats if it is 1-dimensonal')
-
-    elif type(omegas) == np.ndarray:
-        if len(omegas.shape) == 1:
-            if len([True for x in omegas if type(x) != list]) == 0:
-                max_len = max([len(x) for x in omegas])
-                temp = np.zeros((len(omegas), max_len))
-                for i in range(len(omegas)):
-                    for k in range(len(omegas[i])):
-                        temp[i, k] = omegas[i][k]
-                omegas = temp
-            elif times.dtype == np.float64 or times.dtype == np.float32 or times.dtype == np.int32:
-                temp = np.zeros((len(values), len(omegas)))
-                for i in range(len(values)):
-                    temp[i, :] = omegas[:]
-                omegas = temp
-            else:
-                raise TypeError(f'omegas needs to contain only lists or floats if it is 1-dimensonal')
-
-        elif len(omegas.shape) != 2:
-            raise TypeError(f'omegas is expected to be 2-dimensional, but recived array was {len(omegas.shape)} dimesions')
-
-    else: 
-        raise TypeError(f'omegas is expected to be list or numpy ndarray, but type is {type(omegas)}')
-
-    if not weights is None:
-        # make times
-        if type(weights) == list:
-            if len([True for x in weights if type(x) != list]) == 0:
-                max_len = max([len(x) for x in weights])
-                temp = np.zeros((len(weights), max_len))
-                for i in range(len(weights)):
-                    for k in range(len(weights[i])):
-                        temp[i, k] = weights[i][k]
-                weights = temp
-            elif len([True for x in weights if type(float(x)) != float]):
-                temp = np.zeros((len(values), len(weights)))
-                for i in range(len(values)):
-                    temp[i, :] = weights[:]
-                weights = temp
-            else:
-                raise TypeError(f'weights needs to contain only lists or floats if it is 1-dimensonal')
-
-        elif type(weights) == np.ndarray:
-            if len(weights.shape) == 1:
-                if len([True for x in weights if type(x) != list]) == 0:
-                    max_len = max([len(x) for x in weights])
-                    temp = np.zeros((len(weights), max_len))
-                    for i in range(len(times)):
-                        for k in range(len(weights[i])):
-                            temp[i, k] = weights[i][k]
-                    weights = temp
-                elif weights.dtype == np.float64 or weights.dtype == np.float32 or weights.dtype == np.int32:
-                    temp = np.zeros((len(values), len(weights)))
-                    for i in range(len(values)):
-                        temp[i, :] = weights[:]
-                    weights = temp
-                else:
-                    raise TypeError(f'weights needs to contain only lists or floats if it is 1-dimensonal')
-
-            elif len(weights.shape) != 2:
-                raise TypeError(f'weights is expected to be 2-dimensional, but recived array was {len(weights.shape)} dimesions')
-
-        else: 
-            raise TypeError(f'weights is expected to be list or numpy ndarray, but type is {type(weights)}')
-
+def non_uniform_ft_cuda_with_weights(values, weights, times, omegas, value_offsets, time_offsets, omega_series, fts, ft_sign, t_zero):
+    y = cuda.grid(1)
+    if y < omegas.shape[0]:
+        fts[y] = _ft_frequency_gpu(y, values, weights, times, omegas, value_offsets, time_offsets, omega_series, ft_sign, t_zero)
+
+
+# CPU versions of the kernels above, for machines without a GPU
+# the same calculation, with the threads of the GPU replaced by the iterations of a numba prange
+@numba.njit(parallel=True, cache=True)
+def non_uniform_ft_cpu_no_weights(values, times, omegas, value_offsets, time_offsets, omega_series, fts, ft_sign, t_zero):
+    for y in numba.prange(omegas.shape[0]):
+        fts[y] = _ft_frequency_cpu(y, values, None, times, omegas, value_offsets, time_offsets, omega_series, ft_sign, t_zero)
+
+
+@numba.njit(parallel=True, cache=True)
+def non_uniform_ft_cpu_with_weights(values, weights, times, omegas, value_offsets, time_offsets, omega_series, fts, ft_sign, t_zero):
+    for y in numba.prange(omegas.shape[0]):
+        fts[y] = _ft_frequency_cpu(y, values, weights, times, omegas, value_offsets, time_offsets, omega_series, ft_sign, t_zero)
+
+
+# batch: packed.PackedBatch, ft_sign, t_zero: float, threads: int (threads per block)
+# device: 'gpu', 'cpu' or None, None uses the GPU if numba.cuda.is_available() and the CPU otherwise
+# dtype: float64 (or None) or float32, values and weights are passed in dtype and set the precision of cos and sin,
+# the sums are accumulated in float64 (see py_ft.ft_uneven)
+# returns the packed fts (ndarray(1 dim) complex128), batch.unpack(fts) splits it into the series
+# the stages of the call are reported to the listeners of instrument (if there are any), for the GPU the arrays are copied
+# explicitly, so the transfers are separate stages, and the first launch of a kernel for new types is reported as 'compile'
+def non_uniform_ft_call_cuda_packed(batch, ft_sign, t_zero, threads=256, device=None, dtype=None):
+    name = 'cuda_ft.non_uniform_ft_call_cuda_packed'
     ft_sign = float(ft_sign)
     time_zero = float(t_zero)
-
-    # check shapes
-    if times.shape != values.shape:
-        raise ValueError(f'times and values do not have same shape. times is {times.shape} and values is {values.shape}')
-    if not weights is None and weights.shape != values.shape:
-        raise ValueError(f'weights is not None and has a different shape then values. weights is {weights.shape} and values is {values.shape}')
-    if times.shape[0] != omegas.shape[0]:
-        raise ValueError(f'times and omegas do not have same length in first dim. times is {times.shape} and values is {omegas.shape}')
-    if times.shape[1] == omegas.shape[1]:
-        # this is fine this way
-        result_shape = omegas.shape
-    elif times.shape[1] > omegas.shape[1]:
-        # this is expected
-        temp = np.zeros(times.shape)
-        temp[:omegas.shape[0], :omegas.shape[1]] = omegas[:, :]
-        omegas = temp
-        result_shape = times.shape
-    elif times.shape[1] < omegas.shape[1]:
-        # this is odd
-        print('Waring: more frequencies then values')
-        temp = np.zeros(omegas.shape)
-        temp[:times.shape[0], :times.shape[1]] = times[:, :]
-        times = temp
-        temp = np.zeros(omegas.shape)
-        temp[:values.shape[0], :values.shape[1]] = values[:, :]
-        values = temp
-        if not weights is None:
-            temp = np.zeros(omegas.shape)
-            temp[:weights.shape[0], :weights.shape[1]] = weights[:, :]
-            weights = temp
-        result_shape = omegas.shape
+    dtype = trig_dtype(dtype)
+    if device is None:
+        device = 'gpu' if cuda.is_available() else 'cpu'
+    if device not in ('gpu', 'cpu'):
+        raise ValueError(f"device needs to be 'gpu', 'cpu' or None, but is {device}")
+
+    fts = np.zeros(len(batch.omegas), dtype=np.complex128)
+    if len(fts) == 0:
+        return fts
+    with instrument.stage(name, 'pack') as stage:
+        omega_series = np.repeat(np.arange(len(batch), dtype=np.int64), batch.omega_lengths)
+        # this needs to be done on cpu, if not the multiplication will be done multiple times and desyncronised
+        if batch.weights is None:
+            values = batch.values.astype(dtype, copy=False)
+            weights = None
+        else:
+            values = (batch.weights * batch.values).astype(dtype, copy=False)
+            weights = batch.weights.astype(dtype, copy=False)
+        stage.count(nbytes=instrument.nbytes(omega_series, values, weights))
+
+    if device == 'cpu':
+        with instrument.stage(name, 'kernel') as stage:
+            if weights is None:
+                non_uniform_ft_cpu_no_weights(values, batch.times, batch.omegas, batch.value_offsets, batch.time_offsets, omega_series,
+                                              fts, ft_sign, time_zero)
+            else:
+                non_uniform_ft_cpu_with_weights(values, weights, batch.times, batch.omegas, batch.value_offsets, batch.time_offsets,
+                                                omega_series, fts, ft_sign, time_zero)
+            stage.count(n_series=len(batch), n_omegas=len(fts))
+        return fts
+
+    arrays = [values, batch.times, batch.omegas, batch.value_offsets, batch.time_offsets, omega_series]
+    if weights is not None:
+        arrays.insert(1, weights)
+    with instrument.stage(name, 'transfer') as stage:
+        arrays = [cuda.to_device(array) for array in arrays]
+        d_fts = cuda.to_device(fts)
+        stage.count(nbytes=sum(array.nbytes for array in arrays) + fts.nbytes)
+
+    if weights is None:
+        kernel, kernel_name = non_uniform_ft_cuda_no_weights, 'non_uniform_ft_cuda_no_weights'
     else:
-        raise Exception('unexpected behaviour')
+        kernel, kernel_name = non_uniform_ft_cuda_with_weights, 'non_uniform_ft_cuda_with_weights'
+    blockspergrid = math.ceil(len(fts) / threads)
+    # the cuda kernels compile at their first launch for new types, the time of that launch is reported as compile time
+    compiled = len(getattr(kernel, 'overloads', ()))
+    with instrument.stage(name, 'kernel') as stage:
+        kernel[blockspergrid, threads](*arrays, d_fts, ft_sign, time_zero)
+        cuda.synchronize()
+        stage.count(n_series=len(batch), n_omegas=len(fts))
+    if len(getattr(kernel, 'overloads', ())) > compiled:
+        instrument.report(kernel_name, 'compile', stage.seconds)
+
+    with instrument.stage(name, 'transfer') as stage:
+        d_fts.copy_to_host(fts)
+        stage.count(nbytes=fts.nbytes)
+    return fts
 
-    fts = np.zeros(result_shape, dtype=np.complex128)
-    blockspergrid = math.ceil(fts.shape[0] / kernel[0]), math.ceil(fts.shape[1] / kernel[1])
-    if weights is None
-        non_uniform_ft_cuda_no_weights[blockspergrid, kernel](values, times, omegas, fts, ft_sign, time_zero)
-    else:
-        # this needs to be done on cpu, if not the multiplication will be done multiple times and desyncronised
-        values = weights * values
-        non_uniform_ft_cuda_with_weights[blockspergrid, kernel](values, weights, times, omegas, fts, ft_sign, time_zero)
 
-    return fts
+# values: list (containing lists or ndarrays(1 dim)) or ndarray(2 dim) or ndarray(1 dim containing ndarrays (1 dim))
+# times, omegas, weights: same as values, or list or ndarray (1 dim) used for all time series
+# kernel: threads per block, the product of the tuple is used
+# device: 'gpu', 'cpu' or None, None uses the GPU if numba.cuda.is_available() and the CPU otherwise
+# dtype: see non_uniform_ft_call_cuda_packed
+# returns ndarray (2-dim) with one row per series, padded with 0 to max(longest values, longest omegas)
+def non_uniform_ft_call_cuda(values, times, omegas, ft_sign, t_zero, kernel=(16, 16), weights=None, device=None, dtype=None):
+    name = 'cuda_ft.non_uniform_ft_call_cuda'
+    with instrument.stage(name, 'pack') as stage:
+        batch = PackedBatch.from_lists(values, times, omegas, weights=weights)
+        stage.count(n_series=len(batch), n_omegas=len(batch.omegas), nbytes=batch.nbytes)
+    fts = non_uniform_ft_call_cuda_packed(batch, ft_sign, t_zero, threads=math.prod(kernel), device=device, dtype=dtype)
+    with instrument.stage(name, 'reshape'):
+        width = max(int(batch.value_lengths.max(initial=0)), int(batch.omega_lengths.max(initial=0)))
+        return batch.to_padded(fts, width)
+
+
+# checks that the cuda kernels and their prange twins (device='cpu') give the same fts, and the twins the same as
+# py_ft.ft_uneven, raises AssertionError if they differ (both share _make_ft_frequency, this checks the compiled kernels)
+# the batch has the edge cases of the kernels: a series of length 1 (nan for omg != 0), omg == 0, times == 0,
+# omegas per series, weights, and float32
+# without a GPU, the kernels run in the CUDA simulator (NUMBA_ENABLE_CUDASIM=1 set before numba is imported), which runs in CI
+# rtol, rtol_single: float, allowed difference relative to the largest |fts| for float64 and float32
+# require_gpu: boolean, if False and numba.cuda.is_available() is False only the twins are checked against py_ft
+# returns the largest relative differences, a dict with the keys (check, weights, dtype)
+def check_parity(rtol=1e-12, rtol_single=1e-5, require_gpu=True):
+    import py_ft
+
+    if require_gpu and not cuda.is_available():
+        raise RuntimeError('no GPU found, run with NUMBA_ENABLE_CUDASIM=1 to check the kernels in the CUDA simulator')
+    rng = np.random.default_rng(0)
+    values = [rng.standard_normal(n) for n in (50, 1, 37, 20)]
+    times = [np.sort(rng.uniform(0, 10, size=len(x))) for x in values]
+    times[2][0] = 0.0
+    weights = [rng.uniform(0.5, 2, size=len(x)) for x in values]
+    omegas = [np.linspace(0, 5, 40), np.linspace(0, 5, 40), np.linspace(0.1, 3, 17), np.linspace(0, 8, 60)]
+
+    differences = {}
+    for w in (None, weights):
+        batch = PackedBatch.from_lists(values, times, omegas, weights=w)
+        for dtype in (np.float64, np.float32):
+            tol = rtol if dtype == np.float64 else rtol_single
+            fts_cpu = non_uniform_ft_call_cuda_packed(batch, 1, 0, device='cpu', dtype=dtype)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                fts_py = np.concatenate([py_ft.ft_uneven(v, t, o, 1, 0, weights=None if w is None else w[i], dtype=dtype)
+                                         for i, (v, t, o) in enumerate(zip(values, times, omegas))])
+            compared = {'py_ft': fts_py}
+            if cuda.is_available():
+                compared['gpu'] = non_uniform_ft_call_cuda_packed(batch, 1, 0, device='gpu', dtype=dtype)
+            # for a single sample ssin2 is 0 only up to rounding, in float32 its fts are rounding noise instead of nan
+            keep = np.repeat(batch.value_lengths > 1 if dtype == np.float32 else np.ones(len(batch), dtype=bool),
+                             batch.omega_lengths)
+            scale = np.nanmax(np.abs(fts_cpu[keep]))
+            for check, fts in compared.items():
+                key = (check, 'weights' if w is not None else 'no weights', np.dtype(dtype).name)
+                np.testing.assert_allclose(fts[keep], fts_cpu[keep], rtol=0, atol=tol * scale, equal_nan=True, err_msg=str(key))
+                differences[key] = np.nanmax(np.abs(fts[keep] - fts_cpu[keep])) / scale
+    return differences
+
+
+# test if code runs, and if the CPU version agrees with the GPU (run with NUMBA_ENABLE_CUDASIM=1 without a GPU)
+if __name__ == '__main__':
+    for key, difference in check_parity(require_gpu=False).items():
+        print(key, difference)
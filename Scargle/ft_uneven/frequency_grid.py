@@ -0,0 +1,152 @@
+import numpy as np
+
+import py_ft
+
+
+# plans the angular frequencies omegas for ft_uneven from the sampling times
+# the width of a peak is about 2*pi/T (T the baseline max(times) - min(times)), the grid is spaced by fraction * 2*pi/T,
+# so every peak is sampled about 1/fraction times, and reaches up to an effective Nyquist frequency:
+#   times on a common grid (multiples of spacing p, with gaps): pi/p, above it the spectral window repeats exactly
+#   other times: pi/median spacing (pseudo Nyquist), or with method 'window' half the first frequency where the
+#   spectral window |sum(exp(1j*omg*times))|**2 / N**2 comes back above alias_level (an alias of omg = 0)
+# the grids are evenly spaced, so the recurrence and nufft paths of py_ft.ft_uneven can be used
+# only requires the "numpy" module
+
+
+# baseline max(times) - min(times)
+def baseline(times):
+    times = np.asarray(times, dtype=np.float64)
+    return times.max() - times.min()
+
+
+# spacing p if all times are on a grid t_0 + k*p (within rtol of p), else None
+# p is looked for as the smallest positive difference divided by 1, ..., max_divisor
+# p needs to be at least min_fraction of the median difference, a finer grid is the rounding of the time stamps
+# (e.g. to 1e-5 d), not the sampling, and its Nyquist frequency would be far too high
+def common_spacing(times, rtol=1e-6, max_divisor=16, min_fraction=0.05):
+    diffs = np.diff(np.unique(np.asarray(times, dtype=np.float64)))
+    if len(diffs) == 0:
+        return None
+    smallest = diffs.min()
+    for divisor in range(1, max_divisor + 1):
+        p = smallest / divisor
+        if p < min_fraction * np.median(diffs):
+            return None
+        steps = diffs / p
+        if np.all(np.abs(steps - np.round(steps)) < rtol * np.maximum(steps, 1)):
+            return p
+    return None
+
+
+# spectral window |sum(w*exp(1j*omg*times))|**2 / sum(w)**2, ndarray(1 dim) like omegas, 1 at omg = 0
+# times, omegas, weights: list or ndarray(1 dim), weights None (all 1), memory_budget: see py_ft.block_size
+def spectral_window(times, omegas, weights=None, memory_budget=None):
+    times = np.asarray(times, dtype=np.float64)
+    omegas = np.asarray(omegas, dtype=np.float64)
+    weights = np.ones(len(times)) if weights is None else np.asarray(weights, dtype=np.float64)
+    window = np.empty(len(omegas))
+    block = py_ft.block_size(len(times), memory_budget)
+    for start in range(0, len(omegas), block):
+        arg = np.multiply.outer(omegas[start:start + block], times)
+        window[start:start + block] = (np.cos(arg) @ weights)**2 + (np.sin(arg) @ weights)**2
+    return window / np.sum(weights)**2
+
+
+# effective Nyquist (angular) frequency of times
+# method: 'auto' (spacing of the common grid, else the median spacing), 'grid', 'median' or 'window'
+# 'grid' raises ValueError if the times are not on a common grid
+# 'window' scans the spectral window up to pi/min spacing (spaced by fraction * 2*pi/T) for the first alias
+# above alias_level and falls back to 'median' if there is none, it costs about one ft_uneven of that grid
+def nyquist(times, method='auto', fraction=0.2, alias_level=0.8):
+    if method not in ('auto', 'grid', 'median', 'window'):
+        raise ValueError(f"method needs to be 'auto', 'grid', 'median' or 'window', but is {method}")
+    times = np.sort(np.asarray(times, dtype=np.float64))
+    diffs = np.diff(times)
+    diffs = diffs[diffs > 0]
+    if len(diffs) == 0:
+        raise ValueError('times needs at least two different values')
+
+    if method in ('auto', 'grid'):
+        p = common_spacing(times)
+        if p is not None:
+            return np.pi / p
+        if method == 'grid':
+            raise ValueError('times are not on a common grid')
+
+    if method == 'window':
+        step = fraction * 2 * np.pi / baseline(times)
+        # beyond the main lobe of omg = 0 (first zero at 2*pi/T)
+        omegas = np.arange(2 * np.pi / baseline(times), np.pi / diffs.min() + step, step)
+        aliases = np.nonzero(spectral_window(times, omegas) > alias_level)[0]
+        if len(aliases):
+            return omegas[aliases[0]] / 2
+
+    return np.pi / np.median(diffs)
+
+
+# largest grid plan_grid returns by default, larger ones raise ValueError
+MAX_SIZE = 2**24
+
+
+# evenly spaced omegas from omega_min (0 or the first step above 0 if not include_zero) up to omega_max
+def _uniform(step, omega_min, omega_max, include_zero, max_size):
+    if omega_min == 0 and not include_zero:
+        omega_min = step
+    num = int(np.floor((omega_max - omega_min) / step + 1e-9)) + 1
+    if num > max_size:
+        raise ValueError(f'the grid needs {num} frequencies, more than max_size {max_size}, increase fraction or lower omega_max')
+    return omega_min + step * np.arange(max(num, 1))
+
+
+# times: list or ndarray(1 dim) for one series, or list (containing lists or ndarrays(1 dim)) or ndarray(2 dim) for many
+# fraction: float, spacing of the grid as a fraction of the peak width 2*pi/T
+# omega_min, omega_max: float or None, None uses 0 and the effective Nyquist frequency (see nyquist with method)
+# include_zero: boolean, keep omega 0 (the mean) in the grid, shared: boolean, one grid for all series
+# max_size: int or None (MAX_SIZE), raises ValueError for larger grids instead of returning them
+# returns omegas (ndarray(1 dim)) for one series or with shared, else a list with one grid per series
+# the shared grid is spaced for the longest baseline and reaches up to the highest Nyquist frequency of the series
+def plan_grid(times, fraction=0.2, omega_min=None, omega_max=None, include_zero=False, shared=False, method='auto',
+              max_size=None):
+    if fraction <= 0:
+        raise ValueError(f'fraction needs to be positive, but is {fraction}')
+    if max_size is None:
+        max_size = MAX_SIZE
+    omega_min = 0.0 if omega_min is None else float(omega_min)
+
+    if not py_ft.is2d(times):
+        step = fraction * 2 * np.pi / baseline(times)
+        top = nyquist(times, method, fraction) if omega_max is None else omega_max
+        return _uniform(step, omega_min, top, include_zero, max_size)
+
+    series = [np.asarray(t, dtype=np.float64) for t in times]
+    steps = [fraction * 2 * np.pi / baseline(t) for t in series]
+    tops = [nyquist(t, method, fraction) for t in series] if omega_max is None else [omega_max] * len(series)
+    if shared:
+        return _uniform(min(steps), omega_min, max(tops), include_zero, max_size)
+    return [_uniform(step, omega_min, top, include_zero, max_size) for step, top in zip(steps, tops)]
+
+
+# test if code runs, and if a peak is found with the planned grid
+if __name__ == '__main__':
+    rng = np.random.default_rng(1)
+
+    # nightly observations with gaps: a common grid of 1 day
+    days = np.sort(rng.choice(np.arange(365.0), size=120, replace=False))
+    omegas = plan_grid(days)
+    print(len(omegas), omegas[-1], np.pi, py_ft.uniform_grid(omegas, days, 1e-10) is not None)
+
+    # random times, the true frequency is found within the grid spacing
+    times = np.sort(rng.uniform(0, 100, size=300))
+    omg_true = 2.345
+    values = np.sin(omg_true * times) + 0.5 * rng.standard_normal(300)
+    omegas = plan_grid(times, fraction=0.1)
+    fts, lss = py_ft.ft_uneven(values, times, omegas, 1, 0, return_ls=True)
+    print(len(omegas), nyquist(times), nyquist(times, 'window'), abs(omegas[np.argmax(lss)] - omg_true), omegas[1] - omegas[0])
+
+    # time stamps rounded to 1e-5 d are not a sampling grid
+    rounded = np.round(np.sort(rng.uniform(0, 100, size=300)), 5)
+    assert common_spacing(rounded) is None and nyquist(rounded) < 1e3
+    print(len(plan_grid(rounded)))
+
+    grids = plan_grid([days, times])
+    print([len(g) for g in grids], len(plan_grid([days, times], shared=True)))
@@ -0,0 +1,179 @@
+import numpy as np
+
+from py_ft import block_size, ft_from_sums
+
+
+# ft_uneven of a time series that grows by new samples and can drop old ones (sliding window)
+# the transform only needs six sums per frequency over the samples (see py_ft.ft_from_sums):
+#   csum, ssum = sum(w * cos(2*omg*t)), sum(w * sin(2*omg*t)) for tau
+#   vcos, vsin = sum(w * v * cos(omg*t)), sum(w * v * sin(omg*t)) for sumr and sumi
+#   wsum = sum(w) for scos2 and ssin2, vsum = sum(w * v) for omg == 0
+# adding or removing k samples updates the sums in O(k * n_omegas), the samples are kept to allow removing them
+# the samples are kept in a buffer that doubles its capacity when it is full (amortized O(k) per append), and removing
+# the oldest samples only moves the start of the kept samples in the buffer
+# only requires the "numpy" module
+#
+#     inc = IncrementalFT(omegas, 1, 0)
+#     inc.append(values, times)
+#     fts = inc.fts()
+#     inc.remove_before(times[-1] - window)
+
+
+# number of samples the buffer has room for at the start
+INITIAL_CAPACITY = 64
+
+
+class IncrementalFT:
+    # omegas: list or ndarray(1 dim), ft_sign, time_zero: float, memory_budget: int or None (see py_ft.block_size)
+    def __init__(self, omegas, ft_sign, time_zero, memory_budget=None):
+        self.omegas = np.ascontiguousarray(omegas, dtype=np.float64)
+        if len(self.omegas) == 0:
+            raise ValueError('omegas argument cannot be empty')
+        self.ft_sign = ft_sign
+        self.time_zero = time_zero
+        self.memory_budget = memory_budget
+
+        # rows values, times and weights, the kept samples are the columns start, ..., stop-1
+        self._buffer = np.zeros((3, INITIAL_CAPACITY))
+        self._start = 0
+        self._stop = 0
+        self.recompute()
+
+    def __len__(self):
+        return self._stop - self._start
+
+    # the kept samples in the order they were added, views of the buffer
+    @property
+    def values(self):
+        return self._buffer[0, self._start:self._stop]
+
+    @property
+    def times(self):
+        return self._buffer[1, self._start:self._stop]
+
+    @property
+    def weights(self):
+        return self._buffer[2, self._start:self._stop]
+
+    # room for k more samples after stop, moves the kept samples to the front of the buffer, which is doubled
+    # if they would fill more than half of it, so every sample is moved O(1) times on average
+    def _reserve(self, k):
+        if self._stop + k <= self._buffer.shape[1]:
+            return
+        num_kept = len(self)
+        buffer = self._buffer
+        if 2 * (num_kept + k) > buffer.shape[1]:
+            buffer = np.zeros((3, max(2 * (num_kept + k), INITIAL_CAPACITY)))
+        buffer[:, :num_kept] = self._buffer[:, self._start:self._stop]
+        self._buffer = buffer
+        self._start = 0
+        self._stop = num_kept
+
+    # adds sign * the sums of the samples to the accumulators, in blocks of frequencies
+    def _accumulate(self, values, times, weights, sign):
+        wvalues = weights * values
+        block = block_size(len(values), self.memory_budget)
+        for start in range(0, len(self.omegas), block):
+            stop = min(start + block, len(self.omegas))
+            arg = np.multiply.outer(self.omegas[start:stop], times)
+            self.vcos[start:stop] += sign * (np.cos(arg) @ wvalues)
+            self.vsin[start:stop] += sign * (np.sin(arg) @ wvalues)
+            arg *= 2.0
+            self.csum[start:stop] += sign * (np.cos(arg) @ weights)
+            self.ssum[start:stop] += sign * (np.sin(arg) @ weights)
+        self.wsum += sign * np.sum(weights)
+        self.vsum += sign * np.sum(wvalues)
+
+    # values, times: list or ndarray(1 dim), weights: list or ndarray(1 dim) or None (all 1)
+    # the samples do not need to be sorted or later than the samples already added
+    def append(self, values, times, weights=None):
+        values = np.asarray(values, dtype=np.float64)
+        times = np.asarray(times, dtype=np.float64)
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+        if len(times) != len(values) or len(weights) != len(values):
+            raise ValueError(f'values, times and weights need the same length, but have {len(values)}, {len(times)} and {len(weights)}')
+
+        self._accumulate(values, times, weights, 1.0)
+        self._reserve(len(values))
+        self._buffer[:, self._stop:self._stop + len(values)] = values, times, weights
+        self._stop += len(values)
+
+    # removes the samples selected by mask (ndarray(1 dim) bool over the samples in the order they were added)
+    def _remove(self, mask):
+        num_removed = np.count_nonzero(mask)
+        if num_removed:
+            self._accumulate(self.values[mask], self.times[mask], self.weights[mask], -1.0)
+            if np.all(mask[:num_removed]):
+                # the oldest samples, as for a sliding window over samples added in time order
+                self._start += num_removed
+            else:
+                kept = self._buffer[:, self._start:self._stop][:, ~mask]
+                self._buffer[:, self._start:self._start + len(kept[0])] = kept
+                self._stop = self._start + len(kept[0])
+
+    # removes the k samples added first
+    def remove_oldest(self, k):
+        mask = np.zeros(len(self), dtype=bool)
+        mask[:max(k, 0)] = True
+        self._remove(mask)
+
+    # removes all samples with times < time (sliding window)
+    def remove_before(self, time):
+        self._remove(self.times < time)
+
+    # calculates the sums again from the kept samples, removes the rounding errors of many updates
+    def recompute(self):
+        num_omg = len(self.omegas)
+        self.csum = np.zeros(num_omg)
+        self.ssum = np.zeros(num_omg)
+        self.vcos = np.zeros(num_omg)
+        self.vsin = np.zeros(num_omg)
+        self.wsum = 0.0
+        self.vsum = 0.0
+        if len(self):
+            self._accumulate(self.values, self.times, self.weights, 1.0)
+
+    # returns fts (and lss) of the current samples, the same as py_ft.ft_uneven with these samples and weights
+    def fts(self, return_ls=False):
+        if len(self) == 0:
+            raise ValueError('no samples added')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fts, lss = ft_from_sums(self.csum, self.ssum, self.wsum, self.vcos, self.vsin, self.omegas, self.ft_sign, self.time_zero)
+
+        # if omg is 0
+        zero = self.omegas == 0
+        if np.any(zero):
+            fts[zero] = self.vsum/np.sqrt(len(self))
+            lss[zero] = fts[zero].real**2
+
+        if return_ls:
+            return fts, lss
+        else:
+            return fts
+
+
+# test if code runs and compare with a calculation from scratch
+if __name__ == '__main__':
+    import py_ft
+
+    ran = np.random.standard_normal
+    times = np.sort(np.random.uniform(0, 100, size=1000))
+    values = ran(size=1000)
+    weights = np.random.uniform(0.5, 2, size=1000)
+    omegas = np.linspace(0, 10, 500)
+
+    inc = IncrementalFT(omegas, 1, 0)
+    for start in range(0, 1000, 10):
+        inc.append(values[start:start + 10], times[start:start + 10], weights[start:start + 10])
+        inc.remove_before(times[start] - 20)
+    window = times >= times[990] - 20
+    fts_direct = py_ft.ft_uneven(values[window], times[window], omegas, 1, 0, weights=weights[window])
+    print(np.max(np.abs(inc.fts() - fts_direct)) / np.max(np.abs(fts_direct)))
+
+    # samples out of time order, removed from the middle, the buffer keeps the samples in the order they were added
+    inc.append(values[:5], times[:5], weights[:5])
+    inc.remove_before(times[980])
+    kept = np.concatenate((np.flatnonzero(times >= times[980]), np.arange(5)[times[:5] >= times[980]]))
+    assert np.array_equal(inc.times, times[kept]) and np.array_equal(inc.values, values[kept])
+    inc.remove_oldest(len(inc))
+    assert len(inc) == 0 and inc._buffer.shape[1] <= 4 * 1000
@@ -0,0 +1,215 @@
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+
+# opt-in instrumentation of the bulk transforms in py_ft, numba_ft, cuda_ft and shared_basis
+# every stage of a call (parsing the arguments, packing, building the shared basis, the kernel, transfers to and from
+# the GPU, reshaping the results) reports one Event with its wall time and the data it handled to all listeners,
+# numba compilations (not loads from the on-disk cache) are reported as stage 'compile' of the compiled function
+# (including the functions it calls), their time is also part of the 'kernel' stage that triggered them
+# without listeners a stage is a shared do-nothing object, so the transforms only pay a few attribute lookups per call
+# only requires the python standard library, numba is imported only to report compilations when a listener is added
+#
+#     with instrument.recording() as events:
+#         numba_ft.ft_uneven_bulk_adaptive(values, times, omegas, 1, 0)
+#     print(instrument.totals(events))
+#
+# or instrument.add_listener(callback) to forward every Event to a metrics system
+
+
+# function: name of the instrumented function (e.g. 'numba_ft.bulk_kernel') or of the compiled function
+# stage: 'parse', 'pack', 'basis', 'transfer', 'kernel', 'reduce' (top_k peaks), 'reshape' or 'compile'
+# seconds: wall time, n_series, n_omegas: series and frequencies (summed over the series) handled, nbytes: bytes moved
+Event = namedtuple('Event', ['function', 'stage', 'seconds', 'n_series', 'n_omegas', 'nbytes'])
+
+STAGES = ('parse', 'pack', 'basis', 'transfer', 'kernel', 'reduce', 'reshape', 'compile')
+
+_listeners = []
+_lock = threading.Lock()
+
+
+# the stage returned while instrumentation is disabled
+class _Disabled:
+    seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, n_series=0, n_omegas=0, nbytes=0):
+        pass
+
+
+_DISABLED = _Disabled()
+
+
+class _Stage:
+    def __init__(self, function, stage):
+        self.function = function
+        self.stage = stage
+        self.n_series = 0
+        self.n_omegas = 0
+        self.nbytes = 0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        _emit(Event(self.function, self.stage, self.seconds, self.n_series, self.n_omegas, self.nbytes))
+        return False
+
+    # adds to the data handled by the stage, can be called several times within the with block
+    def count(self, n_series=0, n_omegas=0, nbytes=0):
+        self.n_series += n_series
+        self.n_omegas += n_omegas
+        self.nbytes += nbytes
+
+
+# context manager timing one stage of function, its count(n_series, n_omegas, nbytes) method records the data handled
+#     with instrument.stage('py_ft.ft_uneven_bulk', 'pack') as stage:
+#         batch = PackedBatch.from_lists(values, times, omegas)
+#         stage.count(n_series=len(batch), nbytes=batch.nbytes)
+def stage(function, name):
+    if not _listeners:
+        return _DISABLED
+    return _Stage(function, name)
+
+
+def enabled():
+    return bool(_listeners)
+
+
+# total bytes of arrays (None is skipped), for Stage.count
+def nbytes(*arrays):
+    return sum(array.nbytes for array in arrays if array is not None)
+
+
+def _emit(event):
+    for listener in list(_listeners):
+        listener(event)
+
+
+# reports an Event measured elsewhere (e.g. a compilation), does nothing without listeners
+def report(function, name, seconds, n_series=0, n_omegas=0, nbytes=0):
+    if _listeners:
+        _emit(Event(function, name, seconds, n_series, n_omegas, nbytes))
+
+
+# reports the compilations of numba (event 'numba:compile') as Events, installed while there are listeners
+class _CompileListener:
+    def __init__(self):
+        from numba.core import event
+
+        class Listener(event.Listener):
+            def __init__(self):
+                self.local = threading.local()
+
+            def on_start(self, ev):
+                self.local.__dict__.setdefault('starts', []).append(time.perf_counter())
+
+            # functions compiled while compiling another one (e.g. ft_uneven for _bulk_intern) are part of its time
+            def on_end(self, ev):
+                seconds = time.perf_counter() - self.local.starts.pop()
+                if self.local.starts:
+                    return
+                function = ev.data['dispatcher'].py_func
+                _emit(Event(f'{function.__module__}.{function.__qualname__}', 'compile', seconds, 0, 0, 0))
+
+        self.event = event
+        self.listener = Listener()
+        event.register('numba:compile', self.listener)
+
+    def close(self):
+        self.event.unregister('numba:compile', self.listener)
+
+
+_compile_listener = None
+
+
+# callback: callable taking one Event, called in the thread running the stage
+def add_listener(callback):
+    global _compile_listener
+    with _lock:
+        if not _listeners:
+            try:
+                _compile_listener = _CompileListener()
+            except ImportError:
+                _compile_listener = None
+        _listeners.append(callback)
+
+
+def remove_listener(callback):
+    global _compile_listener
+    with _lock:
+        _listeners.remove(callback)
+        if not _listeners and _compile_listener is not None:
+            _compile_listener.close()
+            _compile_listener = None
+
+
+# records all Events of the with block into the yielded list, callback (or None) gets them as well
+@contextmanager
+def recording(callback=None):
+    events = []
+
+    def listener(event):
+        events.append(event)
+        if callback is not None:
+            callback(event)
+
+    add_listener(listener)
+    try:
+        yield events
+    finally:
+        remove_listener(listener)
+
+
+# sums the Events per stage, returns dict stage -> dict(calls, seconds, n_series, n_omegas, nbytes)
+# by_function: key (function, stage) instead of stage
+def totals(events, by_function=False):
+    result = {}
+    for event in events:
+        key = (event.function, event.stage) if by_function else event.stage
+        total = result.setdefault(key, dict(calls=0, seconds=0.0, n_series=0, n_omegas=0, nbytes=0))
+        total['calls'] += 1
+        total['seconds'] += event.seconds
+        total['n_series'] += event.n_series
+        total['n_omegas'] += event.n_omegas
+        total['nbytes'] += event.nbytes
+    return result
+
+
+# test if code runs, and the overhead of a disabled stage
+if __name__ == '__main__':
+    import timeit
+
+    import numpy as np
+
+    # the listeners of the module imported by py_ft, not of __main__
+    import instrument
+    import numba_ft
+    import py_ft
+
+    ran = np.random.standard_normal
+    values = [ran(size=n) for n in (300, 200, 100)]
+    times = [np.sort(np.random.uniform(0, 10, size=len(x))) for x in values]
+    omegas = np.linspace(0, 5, 200)
+
+    with instrument.recording() as events:
+        py_ft.ft_uneven_bulk(values, times, omegas, 1, 0)
+        numba_ft.ft_uneven_bulk_adaptive(values, times, omegas, 1, 0)
+        numba_ft.ft_uneven_bulk_adaptive(np.array([ran(size=100)] * 4), times[2], omegas, 1, 0)
+    for key, total in instrument.totals(events, by_function=True).items():
+        print(key, total)
+
+    def disabled():
+        with instrument.stage('test', 'kernel') as s:
+            s.count(n_series=1)
+    print('disabled stage:', timeit.timeit(disabled, number=100000) / 100000 * 1e9, 'ns')
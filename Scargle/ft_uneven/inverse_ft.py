@@ -0,0 +1,153 @@
+import numpy as np
+
+from shared_basis import get_basis
+
+
+# inverse of ft_uneven: values at given times whose ft_uneven on omegas is closest to given fts (least squares)
+# ft_uneven is linear in the values, with tau, scos2 and ssin2 (see py_ft.ft_from_sums) it is
+#   fts * exp(-1j*(tau - omg*time_zero)) = C @ (w*v) / sqrt(2*scos2) + 1j * ft_sign * S @ (w*v) / sqrt(2*ssin2)
+# with C, S the cos and sin of omg*times - tau, so real and imaginary part give 2 real equations per frequency
+# the normal equations are solved by conjugate gradients, every step needs the sums C @ x, S @ x and C.T @ y, S.T @ y,
+# which are calculated in blocks of frequencies (shared_basis.SharedBasis.blocks) without building the (N, M) matrices
+# cost: every iteration is a direct evaluation, O(n_series * N * M) multiply-adds, and if the basis does not fit into
+# memory_budget the cos and sin of the blocks are calculated again (O(N * M)) in every iteration, so a solve takes
+# about (number of iterations) times as long as ft_uneven_bulk on the same series; there is no nufft here, nufft_ft
+# only has the forward sums (over times for every omega), not their transpose (over omegas for every time)
+# the tau rotation makes C and S orthogonal for every frequency, so the diagonal of the normal equations
+# is a good preconditioner (Jacobi)
+# only requires the "numpy" module
+
+
+# the linear map values -> (real, imaginary) parts of the rotated fts, and its transpose
+class _Operator:
+    def __init__(self, basis, weights):
+        self.basis = basis
+        self.weights = weights
+        zero = basis.omegas == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.scale_cos = np.where(zero, 1 / np.sqrt(len(basis.times)), 1 / np.sqrt(2 * basis.scos2))
+            self.scale_sin = np.where(zero, 0.0, 1 / np.sqrt(2 * basis.ssin2))
+        # degenerate frequencies (e.g. ssin2 == 0) do not constrain the values
+        self.scale_cos[~np.isfinite(self.scale_cos)] = 0.0
+        self.scale_sin[~np.isfinite(self.scale_sin)] = 0.0
+
+    # values: ndarray(2 dim) (n_series, N), returns real, imag: ndarray(2 dim) (n_series, M)
+    def forward(self, values):
+        if self.weights is not None:
+            values = values * self.weights
+        real = np.empty((len(values), len(self.basis.omegas)))
+        imag = np.empty((len(values), len(self.basis.omegas)))
+        for start, stop, cos_arg, sin_arg in self.basis.blocks():
+            real[:, start:stop] = (values @ cos_arg) * self.scale_cos[start:stop]
+            imag[:, start:stop] = (values @ sin_arg) * self.scale_sin[start:stop]
+        return real, imag
+
+    # real, imag: ndarray(2 dim) (n_series, M), returns ndarray(2 dim) (n_series, N)
+    def adjoint(self, real, imag):
+        values = np.zeros((len(real), len(self.basis.times)))
+        for start, stop, cos_arg, sin_arg in self.basis.blocks():
+            values += (real[:, start:stop] * self.scale_cos[start:stop]) @ cos_arg.T
+            values += (imag[:, start:stop] * self.scale_sin[start:stop]) @ sin_arg.T
+        if self.weights is not None:
+            values *= self.weights
+        return values
+
+    # adjoint(*forward(values)) in one pass over the blocks of frequencies, so every block is calculated only once
+    def normal(self, values):
+        if self.weights is not None:
+            values = values * self.weights
+        result = np.zeros_like(values)
+        for start, stop, cos_arg, sin_arg in self.basis.blocks():
+            result += ((values @ cos_arg) * self.scale_cos[start:stop]**2) @ cos_arg.T
+            result += ((values @ sin_arg) * self.scale_sin[start:stop]**2) @ sin_arg.T
+        if self.weights is not None:
+            result *= self.weights
+        return result
+
+    # diagonal of adjoint(forward(.)), ndarray(1 dim) (N)
+    def diagonal(self):
+        diagonal = np.zeros(len(self.basis.times))
+        for start, stop, cos_arg, sin_arg in self.basis.blocks():
+            diagonal += cos_arg**2 @ self.scale_cos[start:stop]**2 + sin_arg**2 @ self.scale_sin[start:stop]**2
+        if self.weights is not None:
+            diagonal *= self.weights**2
+        return diagonal
+
+
+# fts: list or ndarray(1 dim) (M) for one series, or ndarray(2 dim) (n_series, M) for many series with the same times and omegas
+# times, omegas: list or ndarray(1 dim), ft_sign, time_zero: float, weights: list or ndarray(1 dim) or None, as in the forward ft
+# damp: float >= 0, adds damp * |values|**2 to the least squares problem, needed if there are fewer frequencies than times
+# tol: float, the iteration stops when the residual of the normal equations is reduced by tol (for every series),
+# closely spaced times make the problem ill-conditioned, so tol needs to be well below the wanted accuracy of the values
+# max_iter: int or None (10 * len(times)), memory_budget: int or None, see shared_basis.SharedBasis
+# returns values (ndarray(1 dim) or (n_series, N)), and with return_info the number of iterations and the final relative residuals
+def ift_uneven(fts, times, omegas, ft_sign, time_zero, weights=None, damp=0.0, tol=1e-10, max_iter=None, memory_budget=None,
+               return_info=False):
+    fts = np.asarray(fts, dtype=np.complex128)
+    single = fts.ndim == 1
+    fts = np.atleast_2d(fts)
+    times = np.asarray(times, dtype=np.float64)
+    omegas = np.asarray(omegas, dtype=np.float64)
+    if fts.shape[1] != len(omegas):
+        raise ValueError(f'fts needs one value for every omega, but has {fts.shape[1]} for {len(omegas)} omegas')
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+    if max_iter is None:
+        max_iter = 10 * len(times)
+
+    basis = get_basis(times, omegas, weights, memory_budget=memory_budget)
+    operator = _Operator(basis, weights)
+
+    # undo the phase exp(1j*(tau - omg*time_zero)) and ft_sign
+    rotated = fts * np.exp(-1j * (basis.tau - omegas * time_zero))
+    rhs = operator.adjoint(rotated.real, ft_sign * rotated.imag)
+
+    # preconditioned conjugate gradients, all series at once, every series with its own step sizes
+    preconditioner = operator.diagonal() + damp
+    preconditioner[preconditioner == 0] = 1.0
+    values = np.zeros_like(rhs)
+    residual = rhs.copy()
+    rhs_norm = np.linalg.norm(rhs, axis=1)
+    rhs_norm[rhs_norm == 0] = 1.0
+    z = residual / preconditioner
+    direction = z.copy()
+    rz = np.sum(residual * z, axis=1)
+
+    iterations = 0
+    relative = np.linalg.norm(residual, axis=1) / rhs_norm
+    while iterations < max_iter and np.any(relative > tol):
+        q = operator.normal(direction) + damp * direction
+        pq = np.sum(direction * q, axis=1)
+        # converged series (or a zero direction) are not changed
+        active = (relative > tol) & (pq > 0)
+        alpha = np.where(active, rz / np.where(active, pq, 1.0), 0.0)
+        values += alpha[:, None] * direction
+        residual -= alpha[:, None] * q
+        z = residual / preconditioner
+        rz_new = np.sum(residual * z, axis=1)
+        beta = np.where(active, rz_new / np.where(rz == 0, 1.0, rz), 0.0)
+        direction = z + beta[:, None] * direction
+        rz = rz_new
+        iterations += 1
+        relative = np.linalg.norm(residual, axis=1) / rhs_norm
+
+    if single:
+        values, relative = values[0], relative[0]
+    if return_info:
+        return values, iterations, relative
+    return values
+
+
+# test if code runs and if the values of a series are rebuilt from its fts
+if __name__ == '__main__':
+    import py_ft
+
+    ran = np.random.standard_normal
+    # jittered sampling, very close pairs of times would need much higher frequencies to be told apart
+    times = 0.5 * np.arange(200) + np.random.uniform(0, 0.4, size=200)
+    values = np.sin(0.7 * times) + 0.3 * ran(size=(3, 200))
+    omegas = np.linspace(0, 4 * np.pi, 800)
+
+    fts = np.array(py_ft.ft_uneven_bulk(values, times, omegas, 1, 0))
+    rebuilt, iterations, residual = ift_uneven(fts, times, omegas, 1, 0, return_info=True)
+    print(iterations, np.max(np.abs(rebuilt - values)))
@@ -0,0 +1,36 @@
+% make_reference.m
+%--------------------------------------------------------------------------
+% Writes the reference outputs of ft_uneven.m for the regression check of
+% the python backends (python bench_suite.py reference)
+%--------------------------------------------------------------------------
+%  Input: reference_inputs.json  -- cases written by bench_suite.py
+% Output: reference_outputs.json -- ft_vec (real and imaginary part) and
+%                                   ls_vec of every case
+%--------------------------------------------------------------------------
+
+cases = jsondecode( fileread( 'reference_inputs.json' ) );
+if ~iscell( cases )
+    cases = num2cell( cases );
+end
+
+outputs = cell( numel( cases ), 1 );
+for ii_case = 1: numel( cases )
+
+    this_case = cases{ ii_case };
+    data_in = struct( 'xx_vec', this_case.xx_vec, 'tt_vec', this_case.tt_vec, ...
+                      'ww_vec', this_case.ww_vec, 'ft_sign', this_case.ft_sign, ...
+                      'tt_zero', this_case.tt_zero );
+    if ~isempty( this_case.wt_vec )
+        data_in.wt_vec = this_case.wt_vec;
+    end
+
+    data_out = ft_uneven( data_in );
+    outputs{ ii_case } = struct( 'ft_real', real( data_out.ft_vec ), ...
+                                 'ft_imag', imag( data_out.ft_vec ), ...
+                                 'ls_vec', real( data_out.ls_vec ) );
+
+end
+
+fid = fopen( 'reference_outputs.json', 'w' );
+fprintf( fid, '%s', jsonencode( outputs ) );
+fclose( fid );
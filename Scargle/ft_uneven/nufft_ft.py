@@ -0,0 +1,130 @@
+import numpy as np
+
+from py_ft import uniform_grid, ft_from_sums
+
+
+# ft_uneven for large problems, using a non-uniform FFT instead of the direct sums
+# runs in O(N_times + N_omegas log N_omegas) instead of O(N_times * N_omegas)
+# only requires the "numpy" module
+# the frequencies have to be evenly spaced (omega_k = omega_0 + k*domega)
+
+# The samples are spread onto a regular grid with a Gaussian kernel (like the extirpolation of Press & Rybicki 1989,
+# but with the kernel of Greengard & Lee 2004), the grid is transformed with numpy.fft and the kernel is divided out.
+# Only the sums over exp(i*omg*times) and exp(2i*omg*times) are needed, tau, scos2 and ssin2 follow from
+# the half angle identities (see py_ft.ft_from_sums).
+
+
+# number of samples spread onto the grid at once, limits the memory used for spreading
+_CHUNK = 2**16
+
+# smallest tol the nufft reaches, below it the rounding errors of the spreading and the fft dominate
+MIN_TOL = 1e-13
+
+
+# computes sum_j coeffs[j] * exp(1j * k * x[j]) for k = 0, ..., num_k-1
+# x: ndarray(1 dim) of phases, coeffs: ndarray(1 dim, complex), num_k: int, tol: float
+# the absolute error is about tol * sum(abs(coeffs))
+def nufft1(x, coeffs, num_k, tol=1e-10):
+    # oversampled grid and width of the kernel (Greengard & Lee, oversampling ratio 2)
+    spread = max(2, int(np.ceil(-np.log10(tol))) + 1)
+    num_grid = max(2 * num_k, 2 * spread + 2)
+    num_grid += num_grid % 2
+    # Gaussian width for the oversampling ratio of the actual grid, which is above 2 for small num_k
+    ratio = num_grid / num_k
+    tau = np.pi * spread / (num_k**2 * ratio * (ratio - 0.5))
+    h = 2 * np.pi / num_grid
+
+    # shift the modes to -num_k//2, ..., num_k - num_k//2 - 1, which keeps the kernel correction small
+    shift = num_k // 2
+    x = np.mod(x, 2 * np.pi)
+    coeffs = coeffs * np.exp(1j * shift * x)
+
+    grid = np.zeros(num_grid, dtype=np.complex128)
+    offsets = np.arange(-spread + 1, spread + 1)
+    for start in range(0, len(x), _CHUNK):
+        x_chunk = x[start:start + _CHUNK]
+        nearest = np.floor(x_chunk / h).astype(np.int64)
+        index = nearest[:, None] + offsets[None, :]
+        kernel = np.exp(-(x_chunk[:, None] - index * h)**2 / (4 * tau)) * coeffs[start:start + _CHUNK, None]
+        index = np.mod(index, num_grid).ravel()
+        grid += np.bincount(index, weights=kernel.real.ravel(), minlength=num_grid)
+        grid += 1j * np.bincount(index, weights=kernel.imag.ravel(), minlength=num_grid)
+
+    k = np.arange(num_k) - shift
+    return np.sqrt(np.pi / tau) * np.exp(tau * k**2) * np.fft.ifft(grid)[k]
+
+
+# sums of coeffs * exp(1j * omegas * times) for the evenly spaced omegas, omega_0 + k*domega
+def _grid_sums(coeffs, times, omega_0, domega, num_omg, tol):
+    coeffs = coeffs * np.exp(1j * omega_0 * times)
+    return nufft1(domega * times, coeffs, num_omg, tol)
+
+
+# same arguments and results as py_ft.ft_uneven, the frequencies have to be evenly spaced
+# tol: float, the sums behind fts have an absolute error of about tol * sum(abs(weights * values)),
+# the error of fts relative to its largest value is about tol (0.3 to 2 times tol)
+def ft_uneven(values, times, omegas, ft_sign, time_zero, weights=None, return_ls=False, lin_weights=False, tol=1e-10):
+    values = np.asarray(values, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    omegas = np.asarray(omegas, dtype=np.float64)
+
+    num_val = len(values)
+    num_omg = len(omegas)
+
+    # raise error if no frequencies are given
+    if num_omg == 0:
+        raise ValueError('omegas argument cannot be empty')
+
+    grid = uniform_grid(omegas, times, tol)
+    if grid is None:
+        raise ValueError('omegas needs to be evenly spaced for the nufft method')
+    omega_0, domega = grid
+
+    if weights is None:
+        weights = np.ones(num_val)
+        wsum = float(num_val)
+    else:
+        weights = np.asarray(weights, dtype=np.float64)
+        values = weights * values
+        wsum = np.sum(weights)
+
+    # sum(w * exp(2i*omg*t)) gives csum and ssum, sum(w * v * exp(i*omg*t)) the sums without tau
+    sums2 = _grid_sums(weights.astype(np.complex128), 2.0 * times, omega_0, domega, num_omg, tol)
+    sums1 = _grid_sums(values.astype(np.complex128), times, omega_0, domega, num_omg, tol)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fts, lss = ft_from_sums(sums2.real, sums2.imag, wsum, sums1.real, sums1.imag, omegas, ft_sign, time_zero)
+
+    # omg == 0 is calculated like in the direct method
+    zero = omegas == 0
+    if np.any(zero):
+        fts[zero] = np.sum(values)/np.sqrt(num_val)
+        lss[zero] = fts[zero].real**2
+
+    if return_ls:
+        return fts, lss
+    else:
+        return fts
+
+
+# test if code runs and compare with the direct method
+if __name__ == '__main__':
+    import py_ft
+
+    ran = np.random.standard_normal
+    times = np.sort(np.random.uniform(0, 100, size=1000))
+    values = ran(size=1000)
+    omegas = np.linspace(0.01, 10, 500)
+
+    fts_direct = py_ft.ft_uneven(values, times, omegas, 1, 0)
+    fts_nufft = ft_uneven(values, times, omegas, 1, 0)
+    print(np.max(np.abs(fts_nufft - fts_direct)) / np.max(np.abs(fts_direct)))
+
+    # small grids use a grid with a higher oversampling ratio, the kernel has to follow it
+    for num_omg in (3, 4, 5, 7, 8, 16):
+        omegas = np.linspace(0.01, 10, num_omg)
+        fts_direct = py_ft.ft_uneven(values, times, omegas, 1, 0)
+        for tol in (1e-6, 1e-10):
+            error = np.max(np.abs(ft_uneven(values, times, omegas, 1, 0, tol=tol) - fts_direct)) / np.max(np.abs(fts_direct))
+            assert error < 10 * tol, (num_omg, tol, error)
+    print('small grids ok')
@@ -1,9 +1,18 @@
+import types
+
 import numpy as np 
+import numba
 from numba import njit, prange
 
+import instrument
+from packed import PackedBatch
+from py_ft import trig_dtype, use_shared_basis
+from shared_basis import get_basis
+
 
 # for data types of parameters see py_ft:
 # py_ft.ft_uneven == numba_ft.ft_uneven (without the return_ls argument)
+# py_ft.ft_uneven with n_harmonics == numba_ft.ft_uneven_harmonics
 # py_ft.ft_uneven_bulk == ft_uneven_bulk_adaptive
 # prefer numpy arrays for increased speed
 
@@ -27,7 +36,7 @@ def indexed(length, d2=False):
     return dummy_d1
 
 
-@njit
+@njit(cache=True)
 def indexing(length, index, d2):
     if d2:
         return slice(index, index+1, 1)
@@ -37,170 +46,627 @@ def indexing(length, index, d2):
 def is2d(array):
     return type(array[0]) == list or type(array[0]) == np.ndarray
 
-    
-# calculates ft for non-uniform sampled times. Only one time series
-@njit
-def ft_uneven(values, times, omegas, ft_sign, time_zero, weights=None, lin_weights=False):
 
-    num_val = len(values)
-    num_omg = len(omegas)
+# lists of series (or ndarrays of objects) can have different lengths and are calculated in the packed layout
+def is_ragged(array):
+    if array is None or (type(array) == np.ndarray and array.dtype != object):
+        return False
+    return is2d(array)
 
-    # raise error if no frequencies are given
-    if num_omg == 0:
-        raise ValueError('omegas argument cannot be empty')
 
-    fts = np.zeros(num_omg, dtype=np.cdouble)
 
-    # if there are no weights given
-    if weights is None:
-        for i in range(num_omg):
-            omg = omegas[i]
-            # if omg is not 0
-            if omg:
-                csum = np.sum(np.cos(2.0 * omg * times))
-                ssum = np.sum(np.sin(2.0 * omg * times))
-                tau = 0.5 * np.arctan2(ssum, csum)
+# This Block of methods is used for evenly spaced frequency grids, see py_ft for details
 
-                sumr = np.sum(values * np.cos(omg * times - tau))
-                sumi = np.sum(values * np.sin(omg * times - tau))
 
-                scos2 = np.sum((np.cos(omg * times - tau))**2)
-                ssin2 = np.sum((np.sin(omg * times - tau))**2)
+# returns domega if omegas is evenly spaced within tol (as phase error), else 0.0
+@njit(cache=True)
+def uniform_grid(omegas, times, tol):
+    num_omg = len(omegas)
+    if num_omg < 3:
+        return 0.0
+    domega = (omegas[-1] - omegas[0]) / (num_omg - 1)
+    deviation = 0.0
+    for i in range(num_omg):
+        deviation = max(deviation, abs(omegas[i] - (omegas[0] + i * domega)))
+    if deviation * np.max(np.abs(times)) > tol:
+        return 0.0
+    return domega
 
-                ft_real = sumr/(2**0.5 * scos2**0.5)
-                ft_imag = ft_sign * sumi/(2**0.5 * ssin2**0.5)
-                phi_this = tau - omg * time_zero
 
-                fts[i] = (ft_real + ft_imag * 1j) * np.exp(1j*phi_this)
-                
-            else:
-                fts[i] = np.sum(values)/np.sqrt(num_val)
+@njit(cache=True)
+def resync_interval(tol):
+    return max(1, int(tol / (8 * np.finfo(np.float64).eps)))
 
-    else:
-        #if lin_weights:
-        values = weights * values
-        for i in range(num_omg):
-            omg = omegas[i]
-            #if not lin_weights:
-            #    values = weights * values
-            # if omg is not 0
-            if omg:
-                csum = np.sum(weights * np.cos(2.0 * omg * times))
-                ssum = np.sum(weights * np.sin(2.0 * omg * times))
-                tau = 0.5 * np.arctan2(ssum, csum)
 
-                sumr = np.sum(values * np.cos(omg * times - tau))
-                sumi = np.sum(values * np.sin(omg * times - tau))
+# calculates the ft for one frequency from the sums over the samples, see py_ft.ft_from_sums
+@njit(error_model="numpy", cache=True)
+def ft_from_sums(csum, ssum, wsum, vcos, vsin, omg, ft_sign, time_zero):
+    tau = 0.5 * np.arctan2(ssum, csum)
+    cos_tau = np.cos(tau)
+    sin_tau = np.sin(tau)
 
-                scos2 = np.sum(weights * (np.cos(omg * times - tau))**2)
-                ssin2 = np.sum(weights * (np.sin(omg * times - tau))**2)
+    sumr = vcos * cos_tau + vsin * sin_tau
+    sumi = vsin * cos_tau - vcos * sin_tau
 
-                ft_real = sumr/(2**0.5 * scos2**0.5)
-                ft_imag = ft_sign * sumi / (2**0.5 * ssin2**0.5)
-                phi_this = tau - omg * time_zero
+    rsum = np.hypot(csum, ssum)
+    scos2 = 0.5 * (wsum + rsum)
+    ssin2 = 0.5 * (wsum - rsum)
 
-                fts[i] = (ft_real + ft_imag * 1j) * np.exp(1j*phi_this)
+    ft_real = sumr/(2**0.5 * scos2**0.5)
+    ft_imag = ft_sign * sumi/(2**0.5 * ssin2**0.5)
+    phi_this = tau - omg * time_zero
 
-            else:
-                fts[i] = np.sum(values)/np.sqrt(num_val)
-    return fts#, num_omg
+    return (ft_real + ft_imag * 1j) * np.exp(1j*phi_this)
 
 
-# functions for looping over bulk, diffent functions for diffent forms of times and omega
+# ft_uneven for an evenly spaced frequency grid, cos and sin are updated in place by the angle-addition theorem
+# weights are expected to be already multiplied into values
+@njit(cache=True)
+def _ft_uneven_recurrence(values, times, omegas, ft_sign, time_zero, weights, domega, resync):
+    num_val = len(values)
+    num_omg = len(omegas)
+
+    fts = np.zeros(num_omg, dtype=np.cdouble)
 
-# times and omega are both 2d
-def _bulk_intern(values, times, omegas, ft_sign, time_zero, weights=None, lin_weights=False):
-    results = np.zeros((len(values), len(omegas)), dtype=np.complex128)
     if weights is None:
-        for i in prange(len(values)):
-            results[i, :len(omegas[i])] = ft_uneven(values[i], times[i], omegas[i], ft_sign, time_zero, weights=None, lin_weights=lin_weights) 
+        wsum = float(num_val)
     else:
-        for i in prange(len(values)):
-            results[i, :len(omegas[i])] = ft_uneven(values[i], times[i], omegas[i], ft_sign, time_zero, weights=weights[i], lin_weights=lin_weights) 
-    return results
+        wsum = np.sum(weights)
+
+    cos_d = np.cos(domega * times)
+    sin_d = np.sin(domega * times)
+    cos_omg = np.empty(num_val)
+    sin_omg = np.empty(num_val)
+
+    for i in range(num_omg):
+        omg = omegas[i]
+        direct = i % resync == 0
+        csum = 0.0
+        ssum = 0.0
+        vcos = 0.0
+        vsin = 0.0
+        for k in range(num_val):
+            if direct:
+                cos_omg[k] = np.cos(omg * times[k])
+                sin_omg[k] = np.sin(omg * times[k])
+            else:
+                temp = cos_omg[k] * cos_d[k] - sin_omg[k] * sin_d[k]
+                sin_omg[k] = sin_omg[k] * cos_d[k] + cos_omg[k] * sin_d[k]
+                cos_omg[k] = temp
+            if weights is None:
+                wcos = cos_omg[k]
+            else:
+                wcos = weights[k] * cos_omg[k]
+            csum += wcos * cos_omg[k]
+            ssum += wcos * sin_omg[k]
+            vcos += values[k] * cos_omg[k]
+            vsin += values[k] * sin_omg[k]
+
+        # if omg is not 0
+        if omg:
+            # cos(2x) = 2cos(x)**2 - 1, sin(2x) = 2sin(x)cos(x)
+            fts[i] = ft_from_sums(2.0 * csum - wsum, 2.0 * ssum, wsum, vcos, vsin, omg, ft_sign, time_zero)
+        else:
+            fts[i] = np.sum(values)/np.sqrt(num_val)
+
+    return fts
+
+
+# cos and sin of arg, for single in float32 after reducing arg to [-pi, pi] in float64 (see py_ft.phases)
+# both are returned as float64, so the sums are accumulated in float64
+@njit(cache=True)
+def cos_sin(arg, single):
+    if single:
+        phase = np.float32(arg - 2 * np.pi * np.floor(arg / (2 * np.pi) + 0.5))
+        return np.float64(np.cos(phase)), np.float64(np.sin(phase))
+    return np.cos(arg), np.sin(arg)
+
+
+# calculates the ft for one frequency omg != 0 without temporary arrays
+# one pass over the samples for csum and ssum, a second one for sumr, sumi and scos2, ssin2 = wsum - scos2
+# division by zero (degenerate series, e.g. a single sample) gives inf or nan like in py_ft instead of an exception
+# float32 values use float32 cos and sin (see cos_sin)
+@njit(error_model="numpy", cache=True)
+def _ft_fused(values, times, weights, omg, ft_sign, time_zero, wsum):
+    num_val = len(values)
+    single = values.itemsize == 4
+
+    csum = 0.0
+    ssum = 0.0
+    for k in range(num_val):
+        cos_arg, sin_arg = cos_sin(2.0 * omg * times[k], single)
+        if weights is None:
+            csum += cos_arg
+            ssum += sin_arg
+        else:
+            csum += weights[k] * cos_arg
+            ssum += weights[k] * sin_arg
+    tau = 0.5 * np.arctan2(ssum, csum)
+
+    sumr = 0.0
+    sumi = 0.0
+    scos2 = 0.0
+    for k in range(num_val):
+        cos_arg, sin_arg = cos_sin(omg * times[k] - tau, single)
+        if weights is None:
+            sumr += values[k] * cos_arg
+            sumi += values[k] * sin_arg
+            scos2 += cos_arg * cos_arg
+        else:
+            sumr += weights[k] * values[k] * cos_arg
+            sumi += weights[k] * values[k] * sin_arg
+            scos2 += weights[k] * cos_arg * cos_arg
+    ssin2 = wsum - scos2
+
+    ft_real = sumr/(2**0.5 * scos2**0.5)
+    ft_imag = ft_sign * sumi/(2**0.5 * ssin2**0.5)
+    phi_this = tau - omg * time_zero
+
+    return (ft_real + ft_imag * 1j) * np.exp(1j*phi_this)
 
 
-# times is 2d, omega is 1d
-def _bulk_intern_fixed_omg(values, times, omegas, ft_sign, time_zero, weights=None, lin_weights=False):
-    results = np.zeros((len(values), len(omegas)), dtype=np.complex128)
-    if weights is None:
-        for i in range(len(values)):
-            results[i] = ft_uneven(values[i], times[i], omegas, ft_sign, time_zero, weights=None, lin_weights=lin_weights) 
-    else:
-        for i in range(len(values)):
-            results[i] = ft_uneven(values[i], times[i], omegas, ft_sign, time_zero, weights=weights[i], lin_weights=lin_weights) 
-    return results
+# calculates ft for non-uniform sampled times. Only one time series
+# recurrence_tol: if given and omegas is evenly spaced, cos and sin are calculated by recurrence (see py_ft.ft_uneven)
+# cos and sin are calculated in the precision of values: float32 values use float32 cos and sin with float64 sums
+# (like py_ft.ft_uneven with dtype=float32), the recurrence always uses float64
+@njit(cache=True)
+def ft_uneven(values, times, omegas, ft_sign, time_zero, weights=None, lin_weights=False, recurrence_tol=None):
 
+    num_val = len(values)
+    num_omg = len(omegas)
 
-# times is 1d, omgega is 2d
-def _bulk_intern_fixed_time():
-    results = np.zeros((len(values), len(omegas)), dtype=np.complex128)
+    # raise error if no frequencies are given
+    if num_omg == 0:
+        raise ValueError('omegas argument cannot be empty')
+
+    if recurrence_tol is not None:
+        domega = uniform_grid(omegas, times, recurrence_tol)
+        if domega != 0.0:
+            if weights is None:
+                return _ft_uneven_recurrence(values, times, omegas, ft_sign, time_zero, None, domega,
+                                             resync_interval(recurrence_tol))
+            return _ft_uneven_recurrence(weights * values, times, omegas, ft_sign, time_zero, weights, domega,
+                                         resync_interval(recurrence_tol))
+
+    fts = np.zeros(num_omg, dtype=np.cdouble)
+
+    # sum of the weights and of the (weighted) values, needed for scos2 + ssin2 and omg == 0
     if weights is None:
-        for i in prange(len(values)):
-            results[i, :len(omegas[i])] = ft_uneven(values[i], times, omegas[i], ft_sign, time_zero, weights=None, lin_weights=lin_weights) 
+        wsum = float(num_val)
+        vsum = np.sum(values)
     else:
-        for i in prange(len(values)):
-            results[i, :len(omegas[i])] = ft_uneven(values[i], times, omegas[i], ft_sign, time_zero, weights=weights[i], lin_weights=lin_weights) 
-    return results
+        wsum = 0.0
+        vsum = 0.0
+        for k in range(num_val):
+            wsum += weights[k]
+            vsum += weights[k] * values[k]
+
+    for i in range(num_omg):
+        omg = omegas[i]
+        # if omg is not 0
+        if omg:
+            fts[i] = _ft_fused(values, times, weights, omg, ft_sign, time_zero, wsum)
+        else:
+            fts[i] = vsum/np.sqrt(num_val)
+
+    return fts#, num_omg
+
+
+# ft_uneven of the harmonics k*omegas (k = 1, ..., n_harmonics) in one pass over the samples per frequency
+# (py_ft.ft_uneven with n_harmonics), cos and sin of k*omg*times by the Chebyshev recurrence from those of omg*times
+# returns fts (ndarray(2 dim) (n_harmonics, len(omegas))) and lss summed over the harmonics (2*|ft|**2 each, ft**2 for omg 0)
+@njit(error_model="numpy", cache=True)
+def ft_uneven_harmonics(values, times, omegas, ft_sign, time_zero, n_harmonics, weights=None):
+    num_val = len(values)
+    num_omg = len(omegas)
+
+    # raise error if no frequencies are given
+    if num_omg == 0:
+        raise ValueError('omegas argument cannot be empty')
+    if n_harmonics < 1:
+        raise ValueError('n_harmonics needs to be at least 1')
 
+    fts = np.zeros((n_harmonics, num_omg), dtype=np.cdouble)
+    lss = np.zeros(num_omg)
+    # sums of w*cos**2, w*cos*sin, w*v*cos and w*v*sin of k*omg*times for every harmonic
+    ccsum = np.empty(n_harmonics)
+    cssum = np.empty(n_harmonics)
+    vcos = np.empty(n_harmonics)
+    vsin = np.empty(n_harmonics)
 
-# times and omega are both 1d
-def _bulk_intern_fixed_time_omg(values, times, omegas, ft_sign, time_zero, weights=None, lin_weights=False):
-    results = np.zeros((len(values), len(omegas)), dtype=np.complex128)
     if weights is None:
-        for i in prange(len(values)):
-            results[i] = ft_uneven(values[i], times, omegas, ft_sign, time_zero, weights=None, lin_weights=lin_weights) 
+        wsum = float(num_val)
+        vsum = np.sum(values)
     else:
-        for i in prange(len(values)):
-            results[i] = ft_uneven(values[i], times, omegas, ft_sign, time_zero, weights=weights[i], lin_weights=lin_weights) 
+        wsum = 0.0
+        vsum = 0.0
+        for j in range(num_val):
+            wsum += weights[j]
+            vsum += weights[j] * values[j]
+
+    for i in range(num_omg):
+        omg = omegas[i]
+        # if omg is 0, every harmonic is 0 as well
+        if not omg:
+            for k in range(n_harmonics):
+                fts[k, i] = vsum/np.sqrt(num_val)
+            lss[i] = n_harmonics * (vsum/np.sqrt(num_val))**2
+            continue
+
+        ccsum[:] = 0.0
+        cssum[:] = 0.0
+        vcos[:] = 0.0
+        vsin[:] = 0.0
+        for j in range(num_val):
+            w = 1.0 if weights is None else weights[j]
+            wv = w * values[j]
+            cos_1 = np.cos(omg * times[j])
+            sin_1 = np.sin(omg * times[j])
+            cos_k, sin_k = cos_1, sin_1
+            cos_prev, sin_prev = 1.0, 0.0
+            for k in range(n_harmonics):
+                if k:
+                    cos_k, cos_prev = 2.0 * cos_1 * cos_k - cos_prev, cos_k
+                    sin_k, sin_prev = 2.0 * cos_1 * sin_k - sin_prev, sin_k
+                ccsum[k] += w * cos_k * cos_k
+                cssum[k] += w * cos_k * sin_k
+                vcos[k] += wv * cos_k
+                vsin[k] += wv * sin_k
+
+        for k in range(n_harmonics):
+            # cos(2x) = 2cos(x)**2 - 1, sin(2x) = 2sin(x)cos(x)
+            ft = ft_from_sums(2.0 * ccsum[k] - wsum, 2.0 * cssum[k], wsum, vcos[k], vsin[k], (k + 1) * omg, ft_sign, time_zero)
+            fts[k, i] = ft
+            lss[i] += 2.0 * (ft.real**2 + ft.imag**2)
+
+    return fts, lss
+
+
+# compiles func with numba and caches the machine code on disk (in __pycache__ or NUMBA_CACHE_DIR)
+# the on-disk cache is named after the function, so the serial and the parallel version get their own copy of func
+def compile_cached(func, parallel):
+    name = func.__name__ + ('_parallel' if parallel else '_single')
+    copy = types.FunctionType(func.__code__, func.__globals__, name, func.__defaults__, func.__closure__)
+    copy.__qualname__ = name
+    return njit(parallel=parallel, cache=True)(copy)
+
+
+# functions for looping over bulk
+# all forms of times and omega (1d or 2d) are passed as 2d arrays, 1d arrays are broadcast to 2d without a copy (stride 0)
+# one work item is a block of frequencies of one series, so also a few long series are spread over all threads
+
+def _bulk_intern(values, times, omegas, ft_sign, time_zero, results, n_blocks, weights=None, lin_weights=False):
+    num_omg = omegas.shape[1]
+    block = (num_omg + n_blocks - 1) // n_blocks
+    for item in prange(values.shape[0] * n_blocks):
+        i = item // n_blocks
+        start = (item % n_blocks) * block
+        stop = min(start + block, num_omg)
+        if stop > start:
+            if weights is None:
+                results[i, start:stop] = ft_uneven(values[i], times[i], omegas[i, start:stop], ft_sign, time_zero, weights=None,
+                                                   lin_weights=lin_weights)
+            else:
+                results[i, start:stop] = ft_uneven(values[i], times[i], omegas[i, start:stop], ft_sign, time_zero, weights=weights[i],
+                                                   lin_weights=lin_weights)
     return results
 
 
-# here the fucntions from above are given to the compiler, one multithreaded, one single threaded each
-_bulk_intern_single = njit(_bulk_intern)
-_bulk_intern_parallel = njit(parallel=True)(_bulk_intern)
-
-_bulk_intern_s_f_omg = njit(_bulk_intern_fixed_omg)
-_bulk_intern_p_f_omg = njit(parallel=True)(_bulk_intern_fixed_omg)
+# here the fucntion from above is given to the compiler, one multithreaded, one single threaded
+_bulk_intern_single = compile_cached(_bulk_intern, parallel=False)
+_bulk_intern_parallel = compile_cached(_bulk_intern, parallel=True)
+
+
+# broadcasts a 1d argument (used for all series) to 2d without copying, 2d arguments are passed on
+def _as_2d(array, n_series, dtype=np.float64):
+    array = np.asarray(array, dtype=dtype)
+    if array.ndim == 1:
+        return np.broadcast_to(array, (n_series, len(array)))
+    return array
+
+
+# bulk calculation for rectangular input: values 2d, times, omegas and weights 1d (used for all series) or 2d
+# dtype: float64 (or None) or float32, values and weights are passed in dtype and set the precision of cos and sin (see ft_uneven)
+# returns ndarray (2 dim) (n_series, n_omegas)
+def bulk_kernel(values, times, omegas, ft_sign, time_zero, weights=None, lin_weights=False, multithreading=True, dtype=None):
+    dtype = trig_dtype(dtype)
+    with instrument.stage('numba_ft.bulk_kernel', 'pack') as stage:
+        values = np.asarray(values, dtype=dtype)
+        n_series = values.shape[0]
+        times = _as_2d(times, n_series)
+        omegas = _as_2d(omegas, n_series)
+        if weights is not None:
+            weights = _as_2d(weights, n_series, dtype)
+        # broadcast rows are not copied, so only the bytes of one row count
+        stage.count(nbytes=sum(array.nbytes if array.strides[0] else array[0].nbytes for array in (values, times, omegas, weights)
+                               if array is not None))
+
+    results = np.zeros((n_series, omegas.shape[1]), dtype=np.complex128)
+    if multithreading:
+        # enough work items for every thread, but not more than one per frequency
+        n_blocks = max(1, min(omegas.shape[1], -(-4 * numba.get_num_threads() // max(n_series, 1))))
+        func = _bulk_intern_parallel
+    else:
+        n_blocks = 1
+        func = _bulk_intern_single
+    with instrument.stage('numba_ft.bulk_kernel', 'kernel') as stage:
+        results = func(values, times, omegas, float(ft_sign), float(time_zero), results, n_blocks, weights=weights,
+                       lin_weights=lin_weights)
+        stage.count(n_series=n_series, n_omegas=results.size)
+    return results
 
-_bulk_intern_s_f_t = njit(_bulk_intern_fixed_time)
-_bulk_intern_p_f_t = njit(parallel=True)(_bulk_intern_fixed_time)
 
-_bulk_intern_s_f_tomg = njit(_bulk_intern_fixed_time_omg)
-_bulk_intern_p_f_tomg = njit(parallel=True)(_bulk_intern_fixed_time_omg)
+# packed batch (see packed.PackedBatch), the series are calculated in parallel
+def _packed_intern(values, times, omegas, value_offsets, omega_offsets, time_offsets, ft_sign, time_zero, fts, weights=None,
+                   lin_weights=False):
+    for i in prange(len(value_offsets) - 1):
+        start, stop = value_offsets[i], value_offsets[i+1]
+        omg_start, omg_stop = omega_offsets[i], omega_offsets[i+1]
+        time_start = time_offsets[i]
+        time_stop = time_start + stop - start
+        # series without frequencies are skipped
+        if omg_stop > omg_start:
+            if weights is None:
+                fts[omg_start:omg_stop] = ft_uneven(values[start:stop], times[time_start:time_stop], omegas[omg_start:omg_stop], ft_sign,
+                                                    time_zero, weights=None, lin_weights=lin_weights)
+            else:
+                fts[omg_start:omg_stop] = ft_uneven(values[start:stop], times[time_start:time_stop], omegas[omg_start:omg_stop], ft_sign,
+                                                    time_zero, weights=weights[start:stop], lin_weights=lin_weights)
+    return fts
+
+
+_packed_intern_single = compile_cached(_packed_intern, parallel=False)
+_packed_intern_parallel = compile_cached(_packed_intern, parallel=True)
+
+
+# bulk calculation for a packed.PackedBatch, returns the packed fts, batch.unpack(fts) splits them into the series
+# dtype: see bulk_kernel
+def ft_uneven_packed(batch, ft_sign, time_zero, lin_weights=False, multithreading=True, dtype=None):
+    dtype = trig_dtype(dtype)
+    values = batch.values.astype(dtype, copy=False)
+    weights = None if batch.weights is None else batch.weights.astype(dtype, copy=False)
+    fts = np.zeros(len(batch.omegas), dtype=np.complex128)
+    func = _packed_intern_parallel if multithreading else _packed_intern_single
+    with instrument.stage('numba_ft.ft_uneven_packed', 'kernel') as stage:
+        fts = func(values, batch.times, batch.omegas, batch.value_offsets, batch.omega_offsets, batch.time_offsets, float(ft_sign),
+                   float(time_zero), fts, weights=weights, lin_weights=lin_weights)
+        stage.count(n_series=len(batch), n_omegas=len(fts))
+    return fts
+
+
+# This Block of methods keeps only the strongest peaks of the spectra (top_k of ft_uneven_bulk_adaptive), see peaks.py
+
+
+# scalar version of peaks.parabolic_vertex
+@njit(error_model="numpy", cache=True)
+def _parabolic_vertex(x0, x1, x2, y0, y1, y2, phase0, phase1, phase2):
+    d0 = (y1 - y0) / (x1 - x0)
+    d1 = (y2 - y1) / (x2 - x1)
+    curv = (d1 - d0) / (x2 - x0)
+    if not curv < 0:
+        return x1, y1, phase1
+    slope = d0 + curv * (x1 - x0)
+    shift = -slope / (2 * curv)
+    y = y1 + slope * shift + curv * shift**2
+    if shift > 0:
+        dphase, width = phase2 - phase1, x2 - x1
+    else:
+        dphase, width = phase0 - phase1, x0 - x1
+    dphase = (dphase + np.pi) % (2 * np.pi) - np.pi
+    phase = phase1
+    if shift != 0:
+        phase += dphase * shift / width
+    return x1 + shift, y, phase
+
+
+# puts a peak into the k slots (nan if empty) of one series, replacing the weakest one if all are used
+@njit(cache=True)
+def _keep_peak(omg, power, phase, peak_omegas, powers, phases):
+    weakest = 0
+    for j in range(len(powers)):
+        if np.isnan(powers[j]):
+            weakest = j
+            break
+        if powers[j] < powers[weakest]:
+            weakest = j
+    if np.isnan(powers[weakest]) or power > powers[weakest]:
+        peak_omegas[weakest] = omg
+        powers[weakest] = power
+        phases[weakest] = phase
+
+
+# the k strongest peaks of lss of one series into peak_omegas, powers, phases (length k, filled with nan)
+# the fts are calculated frequency by frequency (like ft_uneven) and only the last three are kept,
+# lss = 2*|ft|**2 for omg != 0 (see py_ft.ft_from_sums) and ft**2 for omg == 0
+@njit(error_model="numpy", cache=True)
+def _series_peaks(values, times, omegas, weights, ft_sign, time_zero, refine, peak_omegas, powers, phases):
+    num_val = len(values)
+    num_omg = len(omegas)
+    if weights is None:
+        wsum = float(num_val)
+        vsum = np.sum(values)
+    else:
+        wsum = 0.0
+        vsum = 0.0
+        for k in range(num_val):
+            wsum += weights[k]
+            vsum += weights[k] * values[k]
+
+    # window over the frequencies i-2, i-1, i
+    win_omg = np.zeros(3)
+    win_power = np.zeros(3)
+    win_phase = np.zeros(3)
+    for i in range(num_omg + 1):
+        for j in range(2):
+            win_omg[j] = win_omg[j+1]
+            win_power[j] = win_power[j+1]
+            win_phase[j] = win_phase[j+1]
+        if i < num_omg:
+            omg = omegas[i]
+            if omg:
+                ft = _ft_fused(values, times, weights, omg, ft_sign, time_zero, wsum)
+                win_power[2] = 2.0 * (ft.real**2 + ft.imag**2)
+            else:
+                ft = complex(vsum/np.sqrt(num_val))
+                win_power[2] = ft.real**2
+            win_omg[2] = omg
+            win_phase[2] = np.arctan2(ft.imag, ft.real)
+
+        # is frequency i-1 a peak
+        c = i - 1
+        if c < 0:
+            continue
+        if (c == 0 or win_power[1] >= win_power[0]) and (c == num_omg - 1 or win_power[1] > win_power[2]):
+            if refine and 0 < c < num_omg - 1:
+                omg, power, phase = _parabolic_vertex(win_omg[0], win_omg[1], win_omg[2], win_power[0], win_power[1], win_power[2],
+                                                      win_phase[0], win_phase[1], win_phase[2])
+            else:
+                omg, power, phase = win_omg[1], win_power[1], win_phase[1]
+            _keep_peak(omg, power, phase, peak_omegas, powers, phases)
+
+    # sorted by decreasing power, empty slots (nan) last
+    for j in range(1, len(powers)):
+        m = j
+        while m > 0 and (np.isnan(powers[m-1]) or powers[m] > powers[m-1]) and not np.isnan(powers[m]):
+            for array in (peak_omegas, powers, phases):
+                array[m-1], array[m] = array[m], array[m-1]
+            m -= 1
+
+
+def _bulk_peaks_intern(values, times, omegas, ft_sign, time_zero, refine, peak_omegas, powers, phases, weights=None):
+    for i in prange(values.shape[0]):
+        if weights is None:
+            _series_peaks(values[i], times[i], omegas[i], None, ft_sign, time_zero, refine, peak_omegas[i], powers[i], phases[i])
+        else:
+            _series_peaks(values[i], times[i], omegas[i], weights[i], ft_sign, time_zero, refine, peak_omegas[i], powers[i], phases[i])
+
+
+_bulk_peaks_intern_single = compile_cached(_bulk_peaks_intern, parallel=False)
+_bulk_peaks_intern_parallel = compile_cached(_bulk_peaks_intern, parallel=True)
+
+
+def _packed_peaks_intern(values, times, omegas, value_offsets, omega_offsets, time_offsets, ft_sign, time_zero, refine, peak_omegas,
+                         powers, phases, weights=None):
+    for i in prange(len(value_offsets) - 1):
+        start, stop = value_offsets[i], value_offsets[i+1]
+        time_start = time_offsets[i]
+        time_stop = time_start + stop - start
+        omg = omegas[omega_offsets[i]:omega_offsets[i+1]]
+        if weights is None:
+            _series_peaks(values[start:stop], times[time_start:time_stop], omg, None, ft_sign, time_zero, refine, peak_omegas[i], powers[i],
+                          phases[i])
+        else:
+            _series_peaks(values[start:stop], times[time_start:time_stop], omg, weights[start:stop], ft_sign, time_zero, refine,
+                          peak_omegas[i], powers[i], phases[i])
+
+
+_packed_peaks_intern_single = compile_cached(_packed_peaks_intern, parallel=False)
+_packed_peaks_intern_parallel = compile_cached(_packed_peaks_intern, parallel=True)
+
+
+# the k strongest peaks of every series for rectangular input (see bulk_kernel), returns peak_omegas, powers, phases
+# (ndarrays(2 dim) (n_series, k)), the spectra are never stored
+def bulk_peaks(values, times, omegas, ft_sign, time_zero, k, weights=None, refine=False, multithreading=True, dtype=None):
+    dtype = trig_dtype(dtype)
+    values = np.asarray(values, dtype=dtype)
+    n_series = values.shape[0]
+    times = _as_2d(times, n_series)
+    omegas = _as_2d(omegas, n_series)
+    if weights is not None:
+        weights = _as_2d(weights, n_series, dtype)
+    peaks = tuple(np.full((n_series, k), np.nan) for _ in range(3))
+    func = _bulk_peaks_intern_parallel if multithreading else _bulk_peaks_intern_single
+    with instrument.stage('numba_ft.bulk_peaks', 'kernel') as stage:
+        func(values, times, omegas, float(ft_sign), float(time_zero), refine, *peaks, weights=weights)
+        stage.count(n_series=n_series, n_omegas=n_series * omegas.shape[1])
+    return peaks
+
+
+# the k strongest peaks of every series of a packed.PackedBatch, see bulk_peaks
+def ft_uneven_packed_peaks(batch, ft_sign, time_zero, k, refine=False, multithreading=True, dtype=None):
+    dtype = trig_dtype(dtype)
+    values = batch.values.astype(dtype, copy=False)
+    weights = None if batch.weights is None else batch.weights.astype(dtype, copy=False)
+    peaks = tuple(np.full((len(batch), k), np.nan) for _ in range(3))
+    func = _packed_peaks_intern_parallel if multithreading else _packed_peaks_intern_single
+    with instrument.stage('numba_ft.ft_uneven_packed_peaks', 'kernel') as stage:
+        func(values, batch.times, batch.omegas, batch.value_offsets, batch.omega_offsets, batch.time_offsets, float(ft_sign),
+             float(time_zero), refine, *peaks, weights=weights)
+        stage.count(n_series=len(batch), n_omegas=len(batch.omegas))
+    return peaks
 
 
 # makes a bulk calculation of ft_uneven. Can run multithreaded: USE THIS
 # this function is not compiled to allow different input types giving a adaptive version
 # but it can't be called from another function compiled with njit
-def ft_uneven_bulk_adaptive(values, times, omegas, ft_sign, time_zero, weights=None, lin_weights=False, multithreading=True):
-    # fixed omg, fixed time, multithreading
-    func_dict = {
-    (True, True, True): _bulk_intern_p_f_tomg,
-    (True, True, False): _bulk_intern_s_f_tomg,
-    (True, False, True): _bulk_intern_p_f_omg,
-    (True, False, False): _bulk_intern_s_f_omg,
-    (False, True, True): _bulk_intern_p_f_t,
-    (False, True, False): _bulk_intern_s_f_t,
-    (False, False, True): _bulk_intern_single,
-    (False, False, False): _bulk_intern_parallel
-    }
-
-    # check with function can be run, depneding on the from of times and omega
-    t_form = not is2d(times)
-    omg_form = not is2d(omegas)
-
-    results = func_dict[(omg_form, t_form, multithreading)](values, times, omegas, ft_sign, time_zero, weights=weights, lin_weights=False)
-
-    # restructure and remove 0 from results, then return
-    if type(omegas) == np.ndarray and len(omegas.shape) == 2 or omg_form:
-        return results
-    else:
-        res_list = []
-        for i in range(len(results)):
-            res_list.append(results[:len(omegas[i])])
-        return res_list
-    
+# dtype: see bulk_kernel, not used for the shared basis
+# shared_basis: see py_ft.ft_uneven_bulk, None uses it unless dtype is float32, its matrix products run on the threads of
+# the BLAS library, so multithreading does not apply to it
+# the stages of the call (and numba compilations) are reported to the listeners of instrument (if there are any)
+# top_k: int or None, instead of the spectra return the top_k strongest peaks of lss of every series (see peaks.py)
+# as peak_omegas, powers, phases (ndarrays(2 dim) (n_series, top_k)), refine: boolean, parabolic refinement of the peaks
+# the kernels keep the peaks while they go through the frequencies, the spectra are not stored
+def ft_uneven_bulk_adaptive(values, times, omegas, ft_sign, time_zero, weights=None, lin_weights=False, multithreading=True, dtype=None,
+                            top_k=None, refine=False, shared_basis=None):
+    name = 'numba_ft.ft_uneven_bulk_adaptive'
+    with instrument.stage(name, 'parse'):
+        ragged = is_ragged(values) or is_ragged(times) or is_ragged(omegas) or is_ragged(weights)
+        shared = not ragged and use_shared_basis(shared_basis, times, omegas, weights, trig_dtype(dtype) != np.float64)
+
+    if top_k is not None:
+        if top_k < 1:
+            raise ValueError(f'top_k needs to be at least 1, but is {top_k}')
+        if ragged:
+            with instrument.stage(name, 'pack') as stage:
+                batch = PackedBatch.from_lists(values, times, omegas, weights=weights)
+                stage.count(n_series=len(batch), n_omegas=len(batch.omegas), nbytes=batch.nbytes)
+            return ft_uneven_packed_peaks(batch, ft_sign, time_zero, top_k, refine=refine, multithreading=multithreading, dtype=dtype)
+        if shared:
+            return get_basis(times, omegas, weights).peaks(values, ft_sign, time_zero, top_k, refine=refine)
+        return bulk_peaks(values, times, omegas, ft_sign, time_zero, top_k, weights=weights, refine=refine, multithreading=multithreading,
+                          dtype=dtype)
+
+    # series of different lengths are packed instead of padded, see packed.PackedBatch
+    if ragged:
+        with instrument.stage(name, 'pack') as stage:
+            batch = PackedBatch.from_lists(values, times, omegas, weights=weights)
+            stage.count(n_series=len(batch), n_omegas=len(batch.omegas), nbytes=batch.nbytes)
+        fts = ft_uneven_packed(batch, ft_sign, time_zero, lin_weights=lin_weights, multithreading=multithreading, dtype=dtype)
+        with instrument.stage(name, 'reshape'):
+            return batch.unpack(fts)
+
+    # times, omegas and weights shared by all series: the cached basis reduces the batch to matrix products
+    if shared:
+        return get_basis(times, omegas, weights).transform(values, ft_sign, time_zero)
+
+    return bulk_kernel(values, times, omegas, ft_sign, time_zero, weights=weights, lin_weights=lin_weights, multithreading=multithreading,
+                       dtype=dtype)
+
+
+# dtypes (precision of cos and sin, see bulk_kernel) and weighting of the time series compiled by warm_up
+SIGNATURES = ((np.float64, False), (np.float64, True), (np.float32, False), (np.float32, True))
+
+
+# compiles the kernels for SIGNATURES, or loads them from the on-disk cache, so the first real call does not wait for numba
+# run it once when building an environment (python -c "import numba_ft; numba_ft.warm_up()") to fill the cache
+def warm_up(signatures=SIGNATURES, multithreading=(False, True)):
+    omegas = np.array([0.0, 0.5, 1.0])
+    for dtype, weighted in signatures:
+        values = np.ones((2, 4), dtype=dtype)
+        times = np.tile(np.arange(4, dtype=dtype), (2, 1))
+        weights = np.ones((2, 4), dtype=dtype) if weighted else None
+        ft_uneven(values[0], times[0], omegas, 1.0, 0.0, weights=None if weights is None else weights[0])
+        ft_uneven_harmonics(values[0], times[0], omegas, 1.0, 0.0, 2, weights=None if weights is None else weights[0])
+        for parallel in multithreading:
+            # all forms of times and omegas
+            for t in (times, times[0]):
+                for omg in (omegas, np.tile(omegas, (2, 1))):
+                    bulk_kernel(values, t, omg, 1.0, 0.0, weights=weights, multithreading=parallel, dtype=dtype)
+                    bulk_peaks(values, t, omg, 1.0, 0.0, 2, weights=weights, multithreading=parallel, dtype=dtype)
+            batch = PackedBatch.from_lists(values, times, omegas, weights=weights)
+            ft_uneven_packed(batch, 1.0, 0.0, multithreading=parallel, dtype=dtype)
+            ft_uneven_packed_peaks(batch, 1.0, 0.0, 2, multithreading=parallel, dtype=dtype)
+
 
 # test if code runs
 if __name__ == '__main__':
@@ -214,5 +680,5 @@ if __name__ == '__main__':
     #ft_uneven_bulk(values, times, omegas, 1, 0)
     ft_uneven(values[0], times, omegas, 1, 0)
     print(len(omegas))
-    njit(parallel=True)(_bulk_intern_fixed_time_omg)(values, times, omegas, 1, 0)
+    bulk_kernel(values, times, omegas, 1, 0)
     ft_uneven_bulk_adaptive(values, times, omegas, 1, 0)
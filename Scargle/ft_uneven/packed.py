@@ -0,0 +1,151 @@
+import numpy as np
+
+
+# packed (CSR-style) layout for a batch of time series of different lengths
+# the samples of all series are concatenated into 1-dim arrays, series i uses
+# values[value_offsets[i]:value_offsets[i+1]] and omegas[omega_offsets[i]:omega_offsets[i+1]]
+# the results (fts, lss) of a batch are packed the same way as the omegas
+# times are read from times[time_offsets[i]:time_offsets[i] + length of series i], by default time_offsets is value_offsets,
+# times shared by all series are stored only once with all time_offsets 0 (like a stride 0 broadcast)
+# used by py_ft.ft_uneven_packed, numba_ft.ft_uneven_packed and cuda_ft.non_uniform_ft_call_cuda_packed
+
+
+class PackedBatch:
+    # values, times, omegas: ndarray(1 dim), value_offsets, omega_offsets: ndarray(1 dim, int) of length n_series+1
+    # weights: ndarray(1 dim) or None, packed like values, time_offsets: ndarray(1 dim, int) of length n_series+1 or None
+    # the arrays are used as they are if they already have the right type (no copy)
+    def __init__(self, values, times, omegas, value_offsets, omega_offsets, weights=None, time_offsets=None):
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.times = np.ascontiguousarray(times, dtype=np.float64)
+        self.omegas = np.ascontiguousarray(omegas, dtype=np.float64)
+        self.value_offsets = np.ascontiguousarray(value_offsets, dtype=np.int64)
+        self.omega_offsets = np.ascontiguousarray(omega_offsets, dtype=np.int64)
+        self.weights = None if weights is None else np.ascontiguousarray(weights, dtype=np.float64)
+        if time_offsets is None:
+            self.time_offsets = self.value_offsets
+        else:
+            self.time_offsets = np.ascontiguousarray(time_offsets, dtype=np.int64)
+
+        if len(self.value_offsets) != len(self.omega_offsets):
+            raise ValueError(f'value_offsets and omega_offsets need the same length, but have '
+                             f'{len(self.value_offsets)} and {len(self.omega_offsets)}')
+        if self.value_offsets[-1] != len(self.values) or self.omega_offsets[-1] != len(self.omegas):
+            raise ValueError('the last offsets need to be the lengths of values and omegas')
+        if time_offsets is None and len(self.times) != len(self.values):
+            raise ValueError(f'times and values need the same length, but have {len(self.times)} and {len(self.values)}')
+        if time_offsets is not None and (len(self.time_offsets) != len(self.value_offsets) or
+                                         np.any(self.time_offsets[:-1] + np.diff(self.value_offsets) > len(self.times))):
+            raise ValueError('time_offsets need the length of value_offsets and have to point to enough times for every series')
+        if self.weights is not None and len(self.weights) != len(self.values):
+            raise ValueError(f'weights and values need the same length, but have {len(self.weights)} and {len(self.values)}')
+
+    # builds the packed batch from the arguments of the bulk functions
+    # values: list (containing lists or ndarrays(1 dim)) or ndarray(2 dim) or ndarray(1 dim containing ndarrays (1 dim))
+    # times, omegas, weights: same as values, or list or ndarray(1 dim) used for all time series, weights can be None
+    # times used for all series are not copied for every series (see time_offsets)
+    @classmethod
+    def from_lists(cls, values, times, omegas, weights=None):
+        values, value_lengths = _pack(values)
+        n_series = len(value_lengths)
+        value_offsets = _offsets(value_lengths)
+
+        if _is_shared(times):
+            times = np.asarray(times, dtype=np.float64)
+            time_lengths = np.full(n_series, len(times), dtype=np.int64)
+            time_offsets = np.zeros(n_series + 1, dtype=np.int64)
+            time_offsets[-1] = len(times)
+        else:
+            times, time_lengths = _pack(times, n_series)
+            time_offsets = None
+        if np.any(time_lengths != value_lengths):
+            raise ValueError('times and values need the same lengths for every time series')
+
+        omegas, omega_lengths = _pack(omegas, n_series)
+        if weights is not None:
+            weights, weight_lengths = _pack(weights, n_series)
+            if np.any(weight_lengths != value_lengths):
+                raise ValueError('weights and values need the same lengths for every time series')
+        return cls(values, times, omegas, value_offsets, _offsets(omega_lengths), weights=weights, time_offsets=time_offsets)
+
+    def __len__(self):
+        return len(self.value_offsets) - 1
+
+    @property
+    def value_lengths(self):
+        return np.diff(self.value_offsets)
+
+    @property
+    def omega_lengths(self):
+        return np.diff(self.omega_offsets)
+
+    # bytes of all arrays of the batch
+    @property
+    def nbytes(self):
+        nbytes = self.values.nbytes + self.times.nbytes + self.omegas.nbytes + self.value_offsets.nbytes + self.omega_offsets.nbytes
+        if self.time_offsets is not self.value_offsets:
+            nbytes += self.time_offsets.nbytes
+        if self.weights is not None:
+            nbytes += self.weights.nbytes
+        return nbytes
+
+    # values, times, omegas, weights of series i (views, no copy)
+    def series(self, i):
+        val = slice(self.value_offsets[i], self.value_offsets[i+1])
+        omg = slice(self.omega_offsets[i], self.omega_offsets[i+1])
+        time = slice(self.time_offsets[i], self.time_offsets[i] + val.stop - val.start)
+        weights = None if self.weights is None else self.weights[val]
+        return self.values[val], self.times[time], self.omegas[omg], weights
+
+    # splits packed results (like omegas) into a list with one array (view) per series
+    def unpack(self, results):
+        return np.split(results, self.omega_offsets[1:-1])
+
+    # writes packed results into a 2-dim array, padded with 0 after the last frequency of each series
+    def to_padded(self, results, width=None):
+        lengths = self.omega_lengths
+        if width is None:
+            width = int(lengths.max(initial=0))
+        padded = np.zeros((len(self), width), dtype=results.dtype)
+        rows = np.repeat(np.arange(len(self)), lengths)
+        cols = np.arange(len(results)) - np.repeat(self.omega_offsets[:-1], lengths)
+        padded[rows, cols] = results
+        return padded
+
+
+# cumulative offsets from the lengths of the series
+def _offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+# a 1-dim argument of numbers, used for all series
+def _is_shared(array):
+    if isinstance(array, np.ndarray) and array.dtype != object:
+        return array.ndim == 1
+    return isinstance(array, (list, tuple)) and len(array) > 0 and not isinstance(array[0], (list, tuple, np.ndarray))
+
+
+# concatenates one argument of the bulk functions into a 1-dim array and returns it with the lengths of the series
+# a 1-dim argument of numbers is used for all n_series series
+def _pack(array, n_series=None):
+    if isinstance(array, np.ndarray) and array.dtype != object:
+        if array.ndim == 2:
+            return array.ravel(), np.full(array.shape[0], array.shape[1], dtype=np.int64)
+        if array.ndim == 1 and n_series is not None:
+            return np.tile(array, n_series), np.full(n_series, len(array), dtype=np.int64)
+        raise TypeError(f'expected a 2-dimensional array, but recived array was {array.ndim} dimesions')
+    if isinstance(array, (list, tuple, np.ndarray)):
+        if len(array) and not isinstance(array[0], (list, tuple, np.ndarray)):
+            if n_series is None:
+                raise TypeError('values needs to contain only lists or ndarrays if it is 1-dimensonal')
+            array = np.asarray(array, dtype=np.float64)
+            return np.tile(array, n_series), np.full(n_series, len(array), dtype=np.int64)
+        lengths = np.array([len(x) for x in array], dtype=np.int64)
+        if len(array) == 0:
+            return np.zeros(0), lengths
+        # series of the same length are converted in one call, others are concatenated once
+        if np.all(lengths == lengths[0]):
+            return np.asarray(array, dtype=np.float64).reshape(-1), lengths
+        return np.concatenate([np.asarray(x, dtype=np.float64) for x in array]), lengths
+    raise TypeError(f'expected list or numpy ndarray, but type is {type(array)}')
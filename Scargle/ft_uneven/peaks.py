@@ -0,0 +1,73 @@
+import numpy as np
+
+
+# reduction of spectra to their k strongest peaks (omega, power, phase), used by the top_k option of
+# py_ft.ft_uneven_bulk and numba_ft.ft_uneven_bulk_adaptive (which keeps them on the fly, see numba_ft._series_peaks)
+# a peak is a local maximum of the power lss over the omegas of a series (omegas sorted):
+#   lss[i] >= lss[i-1] and lss[i] > lss[i+1], the first and last omega only compare with their one neighbour
+# the phase is the angle of the ft
+# with refine, the omega and power of a peak that is not at the end of the grid are the vertex of the parabola
+# through the peak and its neighbours, the phase is interpolated linearly towards the neighbour on the side of the vertex
+# rows with fewer than k peaks are filled with nan
+# only requires the "numpy" module
+
+
+# vertex of the parabola through (x0, y0), (x1, y1), (x2, y2) and the phase at it, elementwise
+# returns (x1, y1, phase1) where the parabola has no maximum (curvature >= 0)
+def parabolic_vertex(x0, x1, x2, y0, y1, y2, phase0, phase1, phase2):
+    d0 = (y1 - y0) / (x1 - x0)
+    d1 = (y2 - y1) / (x2 - x1)
+    curv = (d1 - d0) / (x2 - x0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # p(x) = y1 + slope * (x - x1) + curv * (x - x1)**2 with slope the derivative at x1
+        slope = d0 + curv * (x1 - x0)
+        shift = np.where(curv < 0, -slope / (2 * curv), 0.0)
+    x = x1 + shift
+    y = y1 + slope * shift + curv * shift**2
+    # phase difference to the neighbour on the side of the vertex, wrapped to [-pi, pi)
+    side = shift > 0
+    dphase = np.where(side, phase2 - phase1, phase0 - phase1)
+    dphase = (dphase + np.pi) % (2 * np.pi) - np.pi
+    with np.errstate(invalid='ignore', divide='ignore'):
+        width = np.where(side, x2 - x1, x0 - x1)
+        phase = phase1 + np.where(shift != 0, dphase * shift / width, 0.0)
+    return x, y, phase
+
+
+# omegas: ndarray(1 dim) (M) used for all rows, or ndarray(2 dim) (rows, M), lss: ndarray(2 dim) (rows, M),
+# fts: ndarray(2 dim) (rows, M) complex, k: int, refine: boolean, the peaks are selected by their (refined) power
+# returns peak_omegas, powers, phases: ndarray(2 dim) (rows, k), sorted by decreasing power
+def top_peaks(omegas, lss, fts, k, refine=False):
+    lss = np.atleast_2d(lss)
+    fts = np.atleast_2d(fts)
+    omegas = np.broadcast_to(omegas, lss.shape)
+    rows, num_omg = lss.shape
+
+    peak = np.ones(lss.shape, dtype=bool)
+    peak[:, 1:] &= lss[:, 1:] >= lss[:, :-1]
+    peak[:, :-1] &= lss[:, :-1] > lss[:, 1:]
+
+    peak_omegas = omegas
+    powers = lss
+    phases = np.angle(fts)
+    if refine and num_omg >= 3:
+        inner = peak[:, 1:-1]
+        x, y, phase = parabolic_vertex(omegas[:, :-2], omegas[:, 1:-1], omegas[:, 2:], lss[:, :-2], lss[:, 1:-1], lss[:, 2:],
+                                       phases[:, :-2], phases[:, 1:-1], phases[:, 2:])
+        peak_omegas, powers, phases = peak_omegas.copy(), powers.copy(), phases.copy()
+        peak_omegas[:, 1:-1] = np.where(inner, x, peak_omegas[:, 1:-1])
+        powers[:, 1:-1] = np.where(inner, y, powers[:, 1:-1])
+        phases[:, 1:-1] = np.where(inner, phase, phases[:, 1:-1])
+
+    power = np.where(peak, powers, -np.inf)
+    kk = min(k, num_omg)
+    index = np.argpartition(-power, kk - 1, axis=1)[:, :kk] if kk < num_omg else np.tile(np.arange(num_omg), (rows, 1))
+    index = np.take_along_axis(index, np.argsort(-np.take_along_axis(power, index, axis=1), axis=1, kind='stable'), axis=1)
+    found = np.isfinite(np.take_along_axis(power, index, axis=1))
+
+    result = []
+    for array in (peak_omegas, powers, phases):
+        padded = np.full((rows, k), np.nan)
+        padded[:, :kk] = np.where(found, np.take_along_axis(array, index, axis=1), np.nan)
+        result.append(padded)
+    return tuple(result)
@@ -1,5 +1,10 @@
 import numpy as np 
 
+import instrument
+from packed import PackedBatch
+from peaks import top_peaks
+from shared_basis import get_basis
+
 # call ft_uneven for a single time series and ft_uneven_bulk for multiple time series
 
 
@@ -24,20 +29,253 @@ def is_none():
     return dummy
 
 
+def is2d(array):
+    return type(array[0]) == list or type(array[0]) == np.ndarray
+
+
 def select_indexed(array):
     if array is None:
         return is_none()
     if type(array[0]) == list or type(array[0]) == np.ndarray:
-        return indexed(times)
+        return indexed(array)
+    else:
+        return not_indexed(array)
+
+
+# This Block of methods is used for evenly spaced frequency grids
+
+
+# checks if omegas is an evenly spaced grid omega_k = omega_0 + k*domega
+# the grid is accepted if replacing omegas by the ideal grid shifts no phase omg*times by more than tol
+# returns (omega_0, domega) or None
+def uniform_grid(omegas, times, tol):
+    omegas = np.asarray(omegas, dtype=np.float64)
+    num_omg = len(omegas)
+    if num_omg < 3:
+        return None
+    omega_0 = omegas[0]
+    domega = (omegas[-1] - omegas[0]) / (num_omg - 1)
+    if domega == 0:
+        return None
+    deviation = np.max(np.abs(omegas - (omega_0 + domega * np.arange(num_omg))))
+    if deviation * np.max(np.abs(times)) > tol:
+        return None
+    return omega_0, domega
+
+
+# number of recurrence steps between two direct evaluations of cos/sin
+# every step adds a rounding error of a few eps to cos and sin, which grows linearly with the steps
+def resync_interval(tol):
+    return max(1, int(tol / (8 * np.finfo(np.float64).eps)))
+
+
+# calculates fts and lss for one frequency from the sums over the samples
+# csum, ssum: weighted sums of cos and sin of 2*omg*times, wsum: sum of the weights (or number of samples)
+# vcos, vsin: sums of values times cos and sin of omg*times (without tau)
+# uses cos(omg*t - tau) = cos(omg*t)cos(tau) + sin(omg*t)sin(tau) and scos2 + ssin2 = wsum
+def ft_from_sums(csum, ssum, wsum, vcos, vsin, omg, ft_sign, time_zero):
+    tau = 0.5 * np.arctan2(ssum, csum)
+    cos_tau = np.cos(tau)
+    sin_tau = np.sin(tau)
+
+    sumr = vcos * cos_tau + vsin * sin_tau
+    sumi = vsin * cos_tau - vcos * sin_tau
+
+    rsum = np.hypot(csum, ssum)
+    scos2 = 0.5 * (wsum + rsum)
+    ssin2 = 0.5 * (wsum - rsum)
+
+    ft_real = sumr/(2**0.5 * scos2**0.5)
+    ft_imag = ft_sign * sumi/(2**0.5 * ssin2**0.5)
+    phi_this = tau - omg * time_zero
+
+    return (ft_real + ft_imag * 1j) * np.exp(1j*phi_this), (sumr**2/scos2) + (sumi**2/ssin2)
+
+
+# ft_uneven for an evenly spaced frequency grid
+# cos and sin of omg*times are updated with the angle-addition theorem instead of being recalculated,
+# cos and sin of 2*omg*times follow from the double angle theorem
+# every resync steps cos and sin are calculated directly to limit the drift of the recurrence
+def _ft_uneven_recurrence(values, times, omegas, ft_sign, time_zero, weights, domega, resync):
+    num_val = len(values)
+    num_omg = len(omegas)
+
+    lss = np.zeros(num_omg)
+    fts = np.zeros(num_omg, dtype=np.cdouble)
+
+    if weights is None:
+        wsum = float(num_val)
+    else:
+        values = weights * values
+        wsum = np.sum(weights)
+
+    cos_d = np.cos(domega * times)
+    sin_d = np.sin(domega * times)
+
+    for i in range(num_omg):
+        omg = omegas[i]
+        if i % resync == 0:
+            cos_omg = np.cos(omg * times)
+            sin_omg = np.sin(omg * times)
+        else:
+            cos_omg, sin_omg = cos_omg * cos_d - sin_omg * sin_d, sin_omg * cos_d + cos_omg * sin_d
+
+        # if omg is not 0
+        if omg:
+            if weights is None:
+                wcos = cos_omg
+            else:
+                wcos = weights * cos_omg
+            # cos(2x) = 2cos(x)**2 - 1, sin(2x) = 2sin(x)cos(x)
+            csum = 2.0 * np.dot(wcos, cos_omg) - wsum
+            ssum = 2.0 * np.dot(wcos, sin_omg)
+            fts[i], lss[i] = ft_from_sums(csum, ssum, wsum, np.dot(values, cos_omg), np.dot(values, sin_omg),
+                                          omg, ft_sign, time_zero)
+
+        else:
+            fts[i] = np.sum(values)/np.sqrt(num_val)
+            lss[i] = fts[i].real**2
+
+    return fts, lss
+
+
+# This Block of methods is used for the precision of the trigonometric functions
+
+
+# checks the dtype argument, float64 (default) or float32
+def trig_dtype(dtype):
+    dtype = np.dtype(np.float64 if dtype is None else dtype)
+    if dtype not in (np.float64, np.float32):
+        raise ValueError(f'dtype needs to be float64 or float32, but is {dtype}')
+    return dtype
+
+
+# phases omegas * times - tau for a block of frequencies, shape (len(omegas), len(times)), as dtype
+# for float32 the phases are reduced to [-pi, pi] in float64 first, as omg*times can be large enough
+# that float32 keeps none of the digits of the phase
+def phases(omegas, times, tau=None, dtype=np.float64):
+    arg = np.multiply.outer(omegas, times)
+    if tau is not None:
+        arg -= tau[:, None]
+    if dtype == np.float32:
+        arg -= 2 * np.pi * np.round(arg / (2 * np.pi))
+        arg = arg.astype(np.float32)
+    return arg
+
+
+# This Block of methods is used to calculate many frequencies at once
+
+
+# memory in bytes, which the temporary arrays of one block of frequencies may use
+MEMORY_BUDGET = 2**26
+
+
+# number of frequencies per block, a block needs about 5 arrays of shape (block, num_val)
+def block_size(num_val, memory_budget=None):
+    if memory_budget is None:
+        memory_budget = MEMORY_BUDGET
+    return max(1, int(memory_budget // (5 * 8 * max(num_val, 1))))
+
+
+# calculates fts and lss for a block of frequencies, values are already weighted
+# the results for omg == 0 are not valid and have to be replaced
+# dtype: precision of cos and sin (see phases), the sums are always accumulated in float64
+def _ft_uneven_block(values, times, omegas, ft_sign, time_zero, weights, dtype=np.float64):
+    arg = phases(2.0 * omegas, times, dtype=dtype)
+    if weights is None:
+        csum = np.sum(np.cos(arg), axis=1, dtype=np.float64)
+        ssum = np.sum(np.sin(arg), axis=1, dtype=np.float64)
+    else:
+        csum = np.cos(arg) @ weights
+        ssum = np.sin(arg) @ weights
+    tau = 0.5 * np.arctan2(ssum, csum)
+
+    arg = phases(omegas, times, tau, dtype=dtype)
+    cos_arg = np.cos(arg)
+    sin_arg = np.sin(arg, out=arg)
+
+    sumr = cos_arg @ values
+    sumi = sin_arg @ values
+
+    cos_arg *= cos_arg
+    sin_arg *= sin_arg
+    if weights is None:
+        scos2 = np.sum(cos_arg, axis=1, dtype=np.float64)
+        ssin2 = np.sum(sin_arg, axis=1, dtype=np.float64)
     else:
-        return not_indexed(times)
+        scos2 = cos_arg @ weights
+        ssin2 = sin_arg @ weights
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ft_real = sumr/(2**0.5 * scos2**0.5)
+        ft_imag = ft_sign * sumi/(2**0.5 * ssin2**0.5)
+        phi_this = tau - omegas * time_zero
+
+        return (ft_real + ft_imag * 1j) * np.exp(1j*phi_this), (sumr**2/scos2) + (sumi**2/ssin2)
+
+
+# calculates the fts of the harmonics 1, ..., n_harmonics of a block of frequencies, values are already weighted
+# cos and sin of k*omg*times follow from those of omg*times by the Chebyshev recurrence
+#   cos((k+1)x) = 2cos(x)cos(kx) - cos((k-1)x), sin((k+1)x) = 2cos(x)sin(kx) - sin((k-1)x)
+# so every extra harmonic costs two products per sample instead of cos and sin, tau of every harmonic comes from
+# the double angle theorem (see _ft_uneven_recurrence), returns fts (n_harmonics, block) and lss summed over the harmonics
+# the results for omg == 0 are not valid and have to be replaced
+def _ft_uneven_harmonics_block(values, times, omegas, ft_sign, time_zero, weights, wsum, n_harmonics, dtype=np.float64):
+    arg = phases(omegas, times, dtype=dtype)
+    cos_1 = np.cos(arg)
+    sin_1 = np.sin(arg, out=arg)
+    two_cos_1 = 2.0 * cos_1
+    cos_k, sin_k = cos_1, sin_1
+    cos_prev, sin_prev = np.ones_like(cos_1), np.zeros_like(sin_1)
+
+    fts = np.zeros((n_harmonics, len(omegas)), dtype=np.cdouble)
+    lss = np.zeros(len(omegas))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for k in range(n_harmonics):
+            if k:
+                cos_k, cos_prev = two_cos_1 * cos_k - cos_prev, cos_k
+                sin_k, sin_prev = two_cos_1 * sin_k - sin_prev, sin_k
+            wcos = cos_k if weights is None else cos_k * weights
+            # cos(2x) = 2cos(x)**2 - 1, sin(2x) = 2sin(x)cos(x)
+            csum = 2.0 * np.einsum('ij,ij->i', wcos, cos_k, dtype=np.float64) - wsum
+            ssum = 2.0 * np.einsum('ij,ij->i', wcos, sin_k, dtype=np.float64)
+            fts[k], lss_k = ft_from_sums(csum, ssum, wsum, cos_k @ values, sin_k @ values, (k + 1) * omegas, ft_sign, time_zero)
+            lss += lss_k
+    return fts, lss
 
 
 # main methods for ft_uneven calculation
 
 
+# problem size (len(values) * len(omegas)) above which method='auto' uses the nufft for evenly spaced omegas
+AUTO_NUFFT_SIZE = 2**20
+
+# fewest omegas for which method='auto' uses the nufft, below the direct sums cost about as much
+AUTO_NUFFT_MIN_OMEGAS = 64
+
+
+# True if method='auto' should use the nufft: a large problem with enough evenly spaced omegas and a tolerance
+# the nufft can reach (see nufft_ft.MIN_TOL), otherwise the direct sums are used
+def use_nufft(num_val, omegas, times, tol):
+    import nufft_ft
+    return (num_val * len(omegas) > AUTO_NUFFT_SIZE and len(omegas) >= AUTO_NUFFT_MIN_OMEGAS and tol >= nufft_ft.MIN_TOL
+            and uniform_grid(omegas, times, tol) is not None)
+
+
 # values, times, omegas: list or ndarray(1 dim), ft_sign, time_zero: float, weights: list or ndarray(1 dim), return_ls, lin_weights: boolean
-def ft_uneven(values, times, omegas, ft_sign, time_zero, weights=None, return_ls=False, lin_weights=False):
+# recurrence_tol: float or None, if given and omegas is evenly spaced, cos and sin are calculated by recurrence
+# the results then agree with the direct calculation to about recurrence_tol (relative to the largest fts)
+# method: 'direct', 'nufft' or 'auto', 'nufft' requires evenly spaced omegas and uses nufft_ft.ft_uneven,
+# 'auto' uses the nufft for large problems with evenly spaced omegas (see use_nufft) and the direct sums otherwise
+# nufft_tol: float, accuracy of the nufft (see nufft_ft.ft_uneven)
+# memory_budget: int or None, bytes used for the temporary arrays of a block of frequencies, None uses MEMORY_BUDGET
+# dtype: float64 (or None) or float32, precision of cos and sin in the direct method, the phases are reduced in float64
+# and the sums are accumulated in float64 (see readme for the accuracy), the recurrence and the nufft always use float64
+# n_harmonics: int, with n_harmonics > 1 the fts of the harmonics k*omegas (k = 1, ..., n_harmonics) are calculated in the
+# same pass (see _ft_uneven_harmonics_block) and returned as ndarray(2 dim) (n_harmonics, len(omegas)), row k-1 is
+# ft_uneven of k*omegas, lss is the sum of the lss of the harmonics, only the direct method is used (recurrence_tol is ignored)
+def ft_uneven(values, times, omegas, ft_sign, time_zero, weights=None, return_ls=False, lin_weights=False, recurrence_tol=None,
+              method='direct', nufft_tol=1e-10, memory_budget=None, dtype=None, n_harmonics=1):
 
     num_val = len(values)
     num_omg = len(omegas)
@@ -46,65 +284,93 @@ def ft_uneven(values, times, omegas, ft_sign, time_zero, weights=None, return_ls
     if num_omg == 0:
         raise ValueError('omegas argument cannot be empty')
 
-    lss = np.zeros(num_omg)
-    fts = np.zeros(num_omg, dtype=np.cdouble)
-
-    # if there are no weights given
-    if weights is None:
-        for i in range(num_omg):
-            omg = omegas[i]
-            # if omg is not 0
-            if omg:
-                csum = np.sum(np.cos(2.0 * omg * times))
-                ssum = np.sum(np.sin(2.0 * omg * times))
-                tau = 0.5 * np.arctan2(ssum, csum)
-
-                sumr = np.sum(values * np.cos(omg * times - tau))
-                sumi = np.sum(values * np.sin(omg * times - tau))
-
-                scos2 = np.sum((np.cos(omg * times - tau))**2)
-                ssin2 = np.sum((np.sin(omg * times - tau))**2)
-
-                ft_real = sumr/(2**0.5 * scos2**0.5)
-                ft_imag = ft_sign * sumi/(2**0.5 * ssin2**0.5)
-                phi_this = tau - omg * time_zero
-
-                fts[i] = (ft_real + ft_imag * 1j) * np.exp(1j*phi_this)
-                lss[i] = (sumr**2/scos2) + (sumi**2/ssin2)
-                
+    if method not in ('direct', 'nufft', 'auto'):
+        raise ValueError(f"method needs to be 'direct', 'nufft' or 'auto', but is {method}")
+    if n_harmonics < 1:
+        raise ValueError(f'n_harmonics needs to be at least 1, but is {n_harmonics}')
+    if n_harmonics > 1:
+        if method == 'nufft':
+            raise ValueError("n_harmonics > 1 needs method 'direct' or 'auto'")
+        return _ft_uneven_harmonics(values, times, omegas, ft_sign, time_zero, weights, return_ls, memory_budget, dtype,
+                                    n_harmonics)
+    if method == 'auto' and use_nufft(num_val, omegas, times, nufft_tol):
+        method = 'nufft'
+    if method == 'nufft':
+        import nufft_ft
+        return nufft_ft.ft_uneven(values, times, omegas, ft_sign, time_zero, weights=weights, return_ls=return_ls,
+                                  lin_weights=lin_weights, tol=nufft_tol)
+
+    dtype = trig_dtype(dtype)
+    values = np.asarray(values, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    omegas = np.asarray(omegas, dtype=np.float64)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+
+    if recurrence_tol is not None:
+        grid = uniform_grid(omegas, times, recurrence_tol)
+        if grid is not None:
+            fts, lss = _ft_uneven_recurrence(values, times, omegas, ft_sign, time_zero,
+                                             weights, grid[1], resync_interval(recurrence_tol))
+            if return_ls:
+                return fts, lss
             else:
-                fts[i] = np.sum(values)/np.sqrt(num_val)
-                lss[i] = fts[i]**2
+                return fts
 
-    else:
+    if weights is not None:
         #if lin_weights:
         values = weights * values
-        for i in range(num_omg):
-            omg = omegas[i]
-            #if not lin_weights:
-                #values = weights * values
-            # if omg is not 0
-            if omg:
-                csum = np.sum(weights * np.cos(2.0 * omg * times))
-                ssum = np.sum(weights * np.sin(2.0 * omg * times))
-                tau = 0.5 * np.arctan2(ssum, csum)
 
-                sumr = np.sum(values * np.cos(omg * times - tau))
-                sumi = np.sum(values * np.sin(omg * times - tau))
+    lss = np.zeros(num_omg)
+    fts = np.zeros(num_omg, dtype=np.cdouble)
 
-                scos2 = np.sum(weights * (np.cos(omg * times - tau))**2)
-                ssin2 = np.sum(weights * (np.sin(omg * times - tau))**2)
+    # frequencies are calculated in blocks, each as a 2d array (block, num_val)
+    block = block_size(num_val, memory_budget)
+    for start in range(0, num_omg, block):
+        stop = min(start + block, num_omg)
+        fts[start:stop], lss[start:stop] = _ft_uneven_block(values, times, omegas[start:stop], ft_sign, time_zero, weights,
+                                                             dtype)
 
-                ft_real = sumr/(2**0.5 * scos2**0.5)
-                ft_imag = ft_sign * sumi / (2**0.5 * ssin2**0.5)
-                phi_this = tau - omg * time_zero
+    # if omg is 0
+    zero = omegas == 0
+    if np.any(zero):
+        fts[zero] = np.sum(values)/np.sqrt(num_val)
+        lss[zero] = fts[zero].real**2
 
-                fts[i] = (ft_real + ft_imag * 1j) * np.exp(1j*phi_this)
-                lss[i] = (sumr**2/scos2) + (sumi**2/ssin2)
+    if return_ls:
+        return fts, lss
+    else:
+        return fts
 
-            else:
-                fts[i] = np.sum(values)/np.sqrt(num_val)
-                lss[i] = fts[i]**2
+
+# ft_uneven with n_harmonics > 1
+def _ft_uneven_harmonics(values, times, omegas, ft_sign, time_zero, weights, return_ls, memory_budget, dtype, n_harmonics):
+    dtype = trig_dtype(dtype)
+    values = np.asarray(values, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    omegas = np.asarray(omegas, dtype=np.float64)
+    num_val = len(values)
+    if weights is None:
+        wsum = float(num_val)
+    else:
+        weights = np.asarray(weights, dtype=np.float64)
+        values = weights * values
+        wsum = np.sum(weights)
+
+    fts = np.zeros((n_harmonics, len(omegas)), dtype=np.cdouble)
+    lss = np.zeros(len(omegas))
+    # the recurrence keeps about 7 arrays of shape (block, num_val)
+    block = max(1, block_size(num_val, memory_budget) * 5 // 7)
+    for start in range(0, len(omegas), block):
+        stop = min(start + block, len(omegas))
+        fts[:, start:stop], lss[start:stop] = _ft_uneven_harmonics_block(values, times, omegas[start:stop], ft_sign, time_zero,
+                                                                          weights, wsum, n_harmonics, dtype)
+
+    # if omg is 0, every harmonic is 0 as well
+    zero = omegas == 0
+    if np.any(zero):
+        fts[:, zero] = np.sum(values)/np.sqrt(num_val)
+        lss[zero] = n_harmonics * fts[0, zero].real**2
 
     if return_ls:
         return fts, lss
@@ -112,33 +378,306 @@ def ft_uneven(values, times, omegas, ft_sign, time_zero, weights=None, return_ls
         return fts
 
 
+# True if a bulk calculation uses shared_basis.get_basis, see the shared_basis argument of ft_uneven_bulk
+# other_path: the arguments ask for a calculation the shared basis does not do (e.g. the process pool or float32)
+def use_shared_basis(shared_basis, times, omegas, weights, other_path):
+    possible = not is2d(times) and not is2d(omegas) and (weights is None or not is2d(weights))
+    if shared_basis is None:
+        return possible and not other_path
+    if shared_basis and not possible:
+        raise ValueError('shared_basis=True needs 1-dim times, omegas and weights')
+    return bool(shared_basis)
+
+
 # values: list (containing lists or ndarrays(1 dim)) or ndarray(2 dim) or ndarray(1 dim containing ndarrays (1 dim))
 # times, omegas: list (containing lists or ndarrays(1 dim)) or ndarray(2 dim) or ndarray(1 dim containing ndarrays (1 dim)) or list or ndarray (1 dim)
 # if times, omegas is 1-dim, times and omegas are used for all time series
 #ft_sign, time_zero: float, weights: list or ndarray(1 dim), return_ls, lin_weights: boolean
+# shared_basis: None, True or False, if times, omegas and weights are 1-dim, tau, scos2, ssin2 and the basis can be taken
+# from shared_basis.get_basis (one process, float64), None does so unless multithreading or a float32 dtype is asked for,
+# True always (ValueError for 2-dim arguments), False never
+# executor: BulkExecutor or None, used if multithreading is True, None uses a pool shared by all calls (see default_executor)
+# dtype: float64 (or None) or float32, see ft_uneven, not used for the shared basis
+# the stages of the call are reported to the listeners of instrument (if there are any)
+# top_k: int or None, instead of the spectra return the top_k strongest peaks of lss of every series (see peaks.py)
+# as peak_omegas, powers, phases (ndarrays(2 dim) (n_series, top_k)), refine: boolean, parabolic refinement of the peaks
+# the full spectra are only kept for one series (or a block of series for the shared basis) at a time
 
 # mulitthreading required multiprocessing module (should be preinstalled)
-def ft_uneven_bulk(values, times, omegas, ft_sign, time_zero, weights=None, return_ls=False, lin_weights=False, multithreading=False):
-    # parse times, omegas and weights 
-    times = select_indexed(times)
-    omegas = select_indexed(omegas)
-    weights = select_indexed(weights)
+def ft_uneven_bulk(values, times, omegas, ft_sign, time_zero, weights=None, return_ls=False, lin_weights=False, multithreading=False,
+                   executor=None, dtype=None, top_k=None, refine=False, shared_basis=None):
+    name = 'py_ft.ft_uneven_bulk'
+    with instrument.stage(name, 'parse'):
+        shared = use_shared_basis(shared_basis, times, omegas, weights, multithreading or trig_dtype(dtype) != np.float64)
+
+    if top_k is not None:
+        return _ft_uneven_bulk_peaks(values, times, omegas, ft_sign, time_zero, weights, lin_weights, multithreading, executor, dtype,
+                                     top_k, refine, shared)
+
+    # times, omegas and weights shared by all series: the cached basis reduces the batch to matrix products
+    if shared:
+        fts, lss = get_basis(times, omegas, weights).transform(values, ft_sign, time_zero, return_ls=True)
+        with instrument.stage(name, 'reshape'):
+            if return_ls:
+                return list(zip(fts, lss))
+            return list(fts)
 
     # different ways of envoking calculations depending if multiprocessing should be used
-    if not multithreading:
-        # straight forward, one loop going over each times series one at the time
-        results = []
+    if multithreading:
+        # the series are packed and calculated in chunks by a persistent pool of processes
+        if executor is None:
+            executor = default_executor()
+        with instrument.stage(name, 'pack') as stage:
+            batch = PackedBatch.from_lists(values, times, omegas, weights=weights)
+            stage.count(n_series=len(batch), n_omegas=len(batch.omegas), nbytes=batch.nbytes)
+        fts, lss = executor.ft_uneven_packed(batch, ft_sign, time_zero, return_ls=True, lin_weights=lin_weights, dtype=dtype)
+        with instrument.stage(name, 'reshape'):
+            if return_ls:
+                return list(zip(batch.unpack(fts), batch.unpack(lss)))
+            return batch.unpack(fts)
+
+    # parse times, omegas and weights 
+    with instrument.stage(name, 'parse'):
+        times = select_indexed(times)
+        omegas = select_indexed(omegas)
+        weights = select_indexed(weights)
+
+    # straight forward, one loop going over each times series one at the time
+    results = []
+    with instrument.stage(name, 'kernel') as stage:
         for i in range(len(values)):
-            results.append(ft_uneven(values[i], times(i), omegas(i), ft_sign, time_zero, weights=weights(i), return_ls=return_ls, lin_weights=lin_weights))
-    else:
-        from multiprocessing import Pool 
-        pool = Pool()
-        n = len(values)
-        results = pool.starmap(ft_uneven, zip(values, [times(i) for i in range(n)], [omegas(i) for i in range(n)], \
-            [ft_sign]*n, [time_zero]*n, [weights(i) for i in range(n)], [return_ls]*n, [lin_weights]*n))
+            results.append(ft_uneven(values[i], times(i), omegas(i), ft_sign, time_zero, weights=weights(i), return_ls=return_ls, lin_weights=lin_weights,
+                                     dtype=dtype))
+            stage.count(n_series=1, n_omegas=len(omegas(i)))
     return results
 
 
+# ft_uneven_bulk with top_k, returns peak_omegas, powers, phases
+def _ft_uneven_bulk_peaks(values, times, omegas, ft_sign, time_zero, weights, lin_weights, multithreading, executor, dtype, top_k,
+                          refine, shared):
+    name = 'py_ft.ft_uneven_bulk'
+    if top_k < 1:
+        raise ValueError(f'top_k needs to be at least 1, but is {top_k}')
+
+    if shared:
+        return get_basis(times, omegas, weights).peaks(values, ft_sign, time_zero, top_k, refine=refine)
+
+    with instrument.stage(name, 'pack') as stage:
+        batch = PackedBatch.from_lists(values, times, omegas, weights=weights)
+        stage.count(n_series=len(batch), n_omegas=len(batch.omegas), nbytes=batch.nbytes)
+    if multithreading:
+        if executor is None:
+            executor = default_executor()
+        return executor.ft_uneven_peaks(batch, ft_sign, time_zero, top_k, refine=refine, lin_weights=lin_weights, dtype=dtype)
+
+    peaks = tuple(np.full((len(batch), top_k), np.nan) for _ in range(3))
+    with instrument.stage(name, 'kernel') as stage:
+        _ft_uneven_packed_range(batch, 0, len(batch), None, None, ft_sign, time_zero, lin_weights, dtype, peaks=peaks, refine=refine)
+        stage.count(n_series=len(batch), n_omegas=len(batch.omegas))
+    return peaks
+
+
+# calculates the series start, ..., stop-1 of a packed batch and writes them into fts and lss (packed like the omegas)
+# peaks: tuple of 3 ndarrays(2 dim) (n_series, k) or None, if given the peaks of every series (see peaks.top_peaks)
+# are written into their rows instead, and fts and lss are not used
+def _ft_uneven_packed_range(batch, start, stop, fts, lss, ft_sign, time_zero, lin_weights, dtype=None, peaks=None, refine=False):
+    for i in range(start, stop):
+        omg = slice(batch.omega_offsets[i], batch.omega_offsets[i+1])
+        # series without frequencies are skipped
+        if omg.start == omg.stop:
+            continue
+        values, times, omegas, weights = batch.series(i)
+        series_fts, series_lss = ft_uneven(values, times, omegas, ft_sign, time_zero, weights=weights, return_ls=True,
+                                           lin_weights=lin_weights, dtype=dtype)
+        if peaks is None:
+            fts[omg], lss[omg] = series_fts, series_lss
+        else:
+            for out, array in zip(peaks, top_peaks(omegas, series_lss, series_fts, peaks[0].shape[1], refine)):
+                out[i] = array[0]
+
+
+# batch: packed.PackedBatch, ft_sign, time_zero: float, return_ls, lin_weights: boolean, dtype: see ft_uneven
+# returns the packed fts (and lss), with one entry for every omega of the batch, batch.unpack splits them into the series
+def ft_uneven_packed(batch, ft_sign, time_zero, return_ls=False, lin_weights=False, dtype=None):
+    fts = np.zeros(len(batch.omegas), dtype=np.cdouble)
+    lss = np.zeros(len(batch.omegas))
+    with instrument.stage('py_ft.ft_uneven_packed', 'kernel') as stage:
+        _ft_uneven_packed_range(batch, 0, len(batch), fts, lss, ft_sign, time_zero, lin_weights, dtype)
+        stage.count(n_series=len(batch), n_omegas=len(batch.omegas))
+
+    if return_ls:
+        return fts, lss
+    else:
+        return fts
+
+
+# This Block of methods is used for multiprocessing of bulk calculations
+
+
+# splits the series of a batch into n_chunks ranges (start, stop) of about the same cost len(times) * len(omegas)
+def balanced_chunks(batch, n_chunks):
+    cost = np.cumsum(batch.value_lengths * batch.omega_lengths + 1)
+    if len(cost) == 0:
+        return []
+    bounds = np.searchsorted(cost, cost[-1] * np.arange(1, n_chunks) / n_chunks, side='right')
+    bounds = np.unique(np.concatenate(([0], bounds, [len(cost)])))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+# runs in the processes of the pool, the arrays of the batch and the results are attached from shared memory
+# spec: dict name -> (shared memory name, dtype, shape), with the arrays 'peak_omegas', 'powers', 'phases' the peaks are
+# calculated instead of fts and lss (see _ft_uneven_packed_range)
+def _bulk_worker(spec, start, stop, ft_sign, time_zero, lin_weights, dtype=None, refine=False):
+    from multiprocessing import shared_memory
+    buffers = {key: shared_memory.SharedMemory(name=name) for key, (name, _, _) in spec.items()}
+    try:
+        arrays = {key: np.ndarray(shape, dtype=dtype, buffer=buffers[key].buf) for key, (_, dtype, shape) in spec.items()}
+        batch = PackedBatch(arrays['values'], arrays['times'], arrays['omegas'], arrays['value_offsets'], arrays['omega_offsets'],
+                            weights=arrays.get('weights'), time_offsets=arrays['time_offsets'])
+        if 'peak_omegas' in arrays:
+            peaks = (arrays['peak_omegas'], arrays['powers'], arrays['phases'])
+            _ft_uneven_packed_range(batch, start, stop, None, None, ft_sign, time_zero, lin_weights, dtype, peaks=peaks, refine=refine)
+        else:
+            _ft_uneven_packed_range(batch, start, stop, arrays['fts'], arrays['lss'], ft_sign, time_zero, lin_weights, dtype)
+    finally:
+        # the views need to be released before the shared memory can be closed
+        arrays = batch = None
+        for buffer in buffers.values():
+            buffer.close()
+
+
+# seconds to wait for the first task of a new pool, see BulkExecutor
+POOL_START_TIMEOUT = 60
+
+
+# the first task of a new pool, returns when a process has started
+def _pool_ready():
+    return True
+
+
+# 'forkserver' if the threads of numba's threading layer are running (forking them can hang the process at exit,
+# the tbb layer is not fork safe) and it is available (not on Windows), None (the default of the platform) otherwise
+def _default_start_method():
+    import sys
+    from multiprocessing import get_all_start_methods
+    parallel = sys.modules.get('numba.np.ufunc.parallel')
+    if getattr(parallel, '_is_initialized', False) and 'forkserver' in get_all_start_methods():
+        return 'forkserver'
+    return None
+
+
+# a pool of processes, which is kept for repeated bulk calculations and shut down by close() (or by a with block)
+# the packed batch and the results are exchanged through shared memory, only the names of the buffers are pickled
+# processes: int or None (number of cpus), chunks_per_process: int, the series are split into this many chunks per process
+# start_method: str or None, see multiprocessing.get_context, None uses the default of the platform, unless numba's
+# threading layer already runs threads in the calling process, then 'forkserver' (where available, see _default_start_method)
+# 'forkserver' and 'spawn' import the main module again, so the calling script needs an if __name__ == '__main__' guard,
+# if the processes fail to start a RuntimeError is raised instead of waiting for them
+class BulkExecutor:
+    def __init__(self, processes=None, chunks_per_process=4, start_method=None):
+        import os
+        self.processes = processes or os.cpu_count()
+        self.chunks_per_process = chunks_per_process
+        self.start_method = start_method
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get_pool(self):
+        if self._pool is None:
+            from multiprocessing import get_context, TimeoutError
+            context = get_context(self.start_method if self.start_method is not None else _default_start_method())
+            pool = context.Pool(self.processes)
+            # a process that fails while starting (e.g. a script without the guard with 'spawn' or 'forkserver')
+            # is replaced by the pool again and again, and a task sent to it would wait forever
+            try:
+                pool.apply_async(_pool_ready).get(timeout=POOL_START_TIMEOUT)
+            except TimeoutError:
+                pool.terminate()
+                raise RuntimeError(f'the processes of the pool did not start within {POOL_START_TIMEOUT} s, with the start method '
+                                   f"'{context.get_start_method()}' the calling script needs an if __name__ == '__main__' guard")
+            self._pool = pool
+        return self._pool
+
+    # same as ft_uneven_packed, but calculated by the pool
+    def ft_uneven_packed(self, batch, ft_sign, time_zero, return_ls=False, lin_weights=False, dtype=None):
+        outputs = {'fts': np.zeros(len(batch.omegas), dtype=np.cdouble), 'lss': np.zeros(len(batch.omegas))}
+        fts, lss = self._run(batch, outputs, ft_sign, time_zero, lin_weights, dtype, 'py_ft.BulkExecutor.ft_uneven_packed')
+        if return_ls:
+            return fts, lss
+        else:
+            return fts
+
+    # the k strongest peaks of every series of the batch, see ft_uneven_bulk with top_k
+    def ft_uneven_peaks(self, batch, ft_sign, time_zero, k, refine=False, lin_weights=False, dtype=None):
+        outputs = {key: np.full((len(batch), k), np.nan) for key in ('peak_omegas', 'powers', 'phases')}
+        return self._run(batch, outputs, ft_sign, time_zero, lin_weights, dtype, 'py_ft.BulkExecutor.ft_uneven_peaks', refine)
+
+    # copies the batch and the (initialized) outputs into shared memory, runs _bulk_worker on chunks of the series
+    # and returns copies of the outputs in their order
+    def _run(self, batch, outputs, ft_sign, time_zero, lin_weights, dtype, name, refine=False):
+        from multiprocessing import shared_memory
+
+        arrays = {'values': batch.values, 'times': batch.times, 'omegas': batch.omegas,
+                  'value_offsets': batch.value_offsets, 'omega_offsets': batch.omega_offsets, 'time_offsets': batch.time_offsets}
+        arrays.update(outputs)
+        if batch.weights is not None:
+            arrays['weights'] = batch.weights
+
+        buffers = {}
+        try:
+            spec = {}
+            with instrument.stage(name, 'transfer') as stage:
+                for key, array in arrays.items():
+                    buffers[key] = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                    np.ndarray(array.shape, dtype=array.dtype, buffer=buffers[key].buf)[...] = array
+                    spec[key] = (buffers[key].name, array.dtype.str, array.shape)
+                    stage.count(nbytes=array.nbytes)
+
+            with instrument.stage(name, 'kernel') as stage:
+                chunks = balanced_chunks(batch, self.processes * self.chunks_per_process)
+                self._get_pool().starmap(_bulk_worker, [(spec, start, stop, ft_sign, time_zero, lin_weights, dtype, refine)
+                                                        for start, stop in chunks])
+                stage.count(n_series=len(batch), n_omegas=len(batch.omegas))
+
+            with instrument.stage(name, 'transfer') as stage:
+                results = tuple(np.ndarray(array.shape, dtype=array.dtype, buffer=buffers[key].buf).copy() for key, array in outputs.items())
+                stage.count(nbytes=sum(array.nbytes for array in results))
+        finally:
+            for buffer in buffers.values():
+                buffer.close()
+                buffer.unlink()
+        return results
+
+    # function(*args) for every tuple args of arg_list in the processes of the pool, returns the results in order
+    # function needs to be importable by the processes (defined at module level)
+    def map(self, function, arg_list):
+        return self._get_pool().starmap(function, arg_list)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+_default_executor = None
+
+
+# the executor used by ft_uneven_bulk(multithreading=True), created on first use and shut down at exit
+def default_executor():
+    global _default_executor
+    if _default_executor is None:
+        import atexit
+        _default_executor = BulkExecutor()
+        atexit.register(_default_executor.close)
+    return _default_executor
+
+
 # test if code runs
 if __name__ == '__main__':
     ran = np.random.standard_normal
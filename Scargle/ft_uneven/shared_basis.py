@@ -0,0 +1,180 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+import instrument
+from peaks import top_peaks
+
+
+# precomputation for bulk calculations where all time series share times, omegas and weights
+# tau, scos2, ssin2 and the basis cos(omg*times - tau), sin(omg*times - tau) only depend on times, omegas and weights,
+# so they are calculated once and the whole batch reduces to the matrix products values @ basis
+# only requires the "numpy" module, used by py_ft.ft_uneven_bulk and numba_ft.ft_uneven_bulk_adaptive
+
+
+# memory in bytes for the cos and sin basis of one SharedBasis, if it is larger only tau, scos2, ssin2 are kept
+# and the basis is calculated in blocks of frequencies for every batch
+MEMORY_BUDGET = 2**28
+
+# bytes of the SharedBasis kept by get_basis (see SharedBasis.nbytes), the least recently used ones are removed first,
+# the newest one is always kept
+CACHE_BYTES = 2**28
+
+
+class SharedBasis:
+    # times, omegas: ndarray(1 dim), weights: ndarray(1 dim) or None, memory_budget: int or None (MEMORY_BUDGET)
+    def __init__(self, times, omegas, weights=None, memory_budget=None):
+        if memory_budget is None:
+            memory_budget = MEMORY_BUDGET
+        self.times = np.ascontiguousarray(times, dtype=np.float64)
+        self.omegas = np.ascontiguousarray(omegas, dtype=np.float64)
+        self.weights = None if weights is None else np.ascontiguousarray(weights, dtype=np.float64)
+
+        num_val = len(self.times)
+        num_omg = len(self.omegas)
+        if num_omg == 0:
+            raise ValueError('omegas argument cannot be empty')
+
+        self.tau = np.zeros(num_omg)
+        self.scos2 = np.zeros(num_omg)
+        self.ssin2 = np.zeros(num_omg)
+
+        # the whole basis is kept if it fits into the memory budget
+        self.block = max(1, int(memory_budget // (2 * 8 * max(num_val, 1))))
+        if self.block >= num_omg:
+            self.cos_basis = np.empty((num_val, num_omg))
+            self.sin_basis = np.empty((num_val, num_omg))
+        else:
+            self.cos_basis = self.sin_basis = None
+
+        for start in range(0, num_omg, self.block):
+            stop = min(start + self.block, num_omg)
+            omg = self.omegas[start:stop]
+            arg = np.multiply.outer(self.times, 2.0 * omg)
+            if self.weights is None:
+                csum = np.sum(np.cos(arg), axis=0)
+                ssum = np.sum(np.sin(arg), axis=0)
+            else:
+                csum = self.weights @ np.cos(arg)
+                ssum = self.weights @ np.sin(arg)
+            self.tau[start:stop] = 0.5 * np.arctan2(ssum, csum)
+
+            cos_arg, sin_arg = self._basis_block(start, stop)
+            if self.weights is None:
+                self.scos2[start:stop] = np.sum(cos_arg**2, axis=0)
+                self.ssin2[start:stop] = np.sum(sin_arg**2, axis=0)
+            else:
+                self.scos2[start:stop] = self.weights @ cos_arg**2
+                self.ssin2[start:stop] = self.weights @ sin_arg**2
+            if self.cos_basis is not None:
+                self.cos_basis[:, start:stop] = cos_arg
+                self.sin_basis[:, start:stop] = sin_arg
+
+    # cos and sin of omg*times - tau for the frequencies start, ..., stop-1, shape (len(times), stop-start)
+    def _basis_block(self, start, stop):
+        arg = np.multiply.outer(self.times, self.omegas[start:stop]) - self.tau[start:stop]
+        return np.cos(arg), np.sin(arg)
+
+    # yields (start, stop, cos, sin) for blocks of frequencies, cos and sin of shape (len(times), stop-start)
+    # the kept basis is one block, otherwise the blocks are calculated one at a time
+    def blocks(self):
+        if self.cos_basis is not None:
+            yield 0, len(self.omegas), self.cos_basis, self.sin_basis
+            return
+        for start in range(0, len(self.omegas), self.block):
+            stop = min(start + self.block, len(self.omegas))
+            cos_arg, sin_arg = self._basis_block(start, stop)
+            yield start, stop, cos_arg, sin_arg
+
+    @property
+    def nbytes(self):
+        nbytes = self.tau.nbytes + self.scos2.nbytes + self.ssin2.nbytes
+        if self.cos_basis is not None:
+            nbytes += self.cos_basis.nbytes + self.sin_basis.nbytes
+        return nbytes
+
+    # values: ndarray(2 dim) (n_series, len(times)), ft_sign, time_zero: float
+    # returns fts (and lss) as ndarray(2 dim) (n_series, len(omegas)), the same as ft_uneven for every series
+    def transform(self, values, ft_sign, time_zero, return_ls=False):
+        with instrument.stage('shared_basis.SharedBasis.transform', 'pack') as stage:
+            values = np.asarray(values, dtype=np.float64)
+            stage.count(nbytes=values.nbytes)
+        if values.ndim != 2 or values.shape[1] != len(self.times):
+            raise ValueError(f'values needs the shape (n_series, {len(self.times)}), but has {values.shape}')
+        if self.weights is not None:
+            values = values * self.weights
+
+        num_omg = len(self.omegas)
+        sumr = np.empty((len(values), num_omg))
+        sumi = np.empty((len(values), num_omg))
+        with instrument.stage('shared_basis.SharedBasis.transform', 'kernel') as stage:
+            for start, stop, cos_arg, sin_arg in self.blocks():
+                sumr[:, start:stop] = values @ cos_arg
+                sumi[:, start:stop] = values @ sin_arg
+            stage.count(n_series=len(values), n_omegas=len(values) * num_omg)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ft_real = sumr/(2**0.5 * self.scos2**0.5)
+            ft_imag = ft_sign * sumi/(2**0.5 * self.ssin2**0.5)
+            fts = (ft_real + ft_imag * 1j) * np.exp(1j*(self.tau - self.omegas * time_zero))
+            lss = (sumr**2/self.scos2) + (sumi**2/self.ssin2)
+
+        # if omg is 0
+        zero = self.omegas == 0
+        if np.any(zero):
+            fts[:, zero] = (np.sum(values, axis=1)/np.sqrt(len(self.times)))[:, None]
+            lss[:, zero] = fts[:, zero].real**2
+
+        if return_ls:
+            return fts, lss
+        else:
+            return fts
+
+    # the k strongest peaks of every series (see peaks.top_peaks), returns peak_omegas, powers, phases (n_series, k)
+    # the series are transformed in blocks, so only the spectra of one block (within MEMORY_BUDGET) are kept
+    def peaks(self, values, ft_sign, time_zero, k, refine=False):
+        values = np.asarray(values, dtype=np.float64)
+        result = tuple(np.full((len(values), k), np.nan) for _ in range(3))
+        rows = max(1, MEMORY_BUDGET // (3 * 8 * len(self.omegas)))
+        for start in range(0, len(values), rows):
+            fts, lss = self.transform(values[start:start + rows], ft_sign, time_zero, return_ls=True)
+            with instrument.stage('shared_basis.SharedBasis.peaks', 'reduce'):
+                for out, array in zip(result, top_peaks(self.omegas, lss, fts, k, refine)):
+                    out[start:start + rows] = array
+        return result
+
+
+_cache = OrderedDict()
+
+
+# fingerprint of an array (shape, dtype and a hash of the content), used as key of the cache
+def fingerprint(array):
+    if array is None:
+        return None
+    array = np.ascontiguousarray(array)
+    return array.shape, array.dtype.str, hashlib.blake2b(memoryview(array).cast('B'), digest_size=16).digest()
+
+
+# returns the SharedBasis for times, omegas and weights, taken from the cache if it was calculated before
+def get_basis(times, omegas, weights=None, memory_budget=None):
+    times = np.asarray(times, dtype=np.float64)
+    omegas = np.asarray(omegas, dtype=np.float64)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+    key = (fingerprint(times), fingerprint(omegas), fingerprint(weights), memory_budget)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    with instrument.stage('shared_basis.get_basis', 'basis') as stage:
+        basis = SharedBasis(times, omegas, weights=weights, memory_budget=memory_budget)
+        stage.count(n_omegas=len(omegas), nbytes=basis.nbytes)
+    _cache[key] = basis
+    while len(_cache) > 1 and sum(cached.nbytes for cached in _cache.values()) > CACHE_BYTES:
+        _cache.popitem(last=False)
+    return basis
+
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,146 @@
+import numpy as np
+
+import instrument
+import py_ft
+from shared_basis import get_basis
+
+
+# false alarm probabilities of the power lss of ft_uneven by permuting (or resampling) the values over the fixed times
+# for the maximum of lss over all omegas the permuted values are a draw of the noise only hypothesis, so the fraction
+# of simulations with a larger maximum than the data is the false alarm probability of its highest peak
+# tau, scos2, ssin2 and the basis only depend on times, omegas and weights (shared_basis.get_basis), so every chunk
+# of simulated series is one matrix product per block of frequencies and only the running maximum of lss is kept
+# the simulations are split into chunks of a fixed size, every chunk draws from its own stream of
+# numpy.random.SeedSequence(seed).spawn, so the results for a seed do not depend on multithreading or the executor
+# the weights stay with the times, only the values are permuted
+# only requires the "numpy" module, multithreading uses the pool of py_ft.BulkExecutor
+
+
+# simulations per chunk, the unit of work of a process and of a random stream
+CHUNK = 256
+
+
+# maximum over the omegas of the power lss (2 * |ft|**2, see ft_uneven with return_ls) for every row of values
+# basis: shared_basis.SharedBasis, values: ndarray(2 dim) (n_series, len(basis.times)), returns ndarray(1 dim) (n_series)
+def max_power(basis, values):
+    values = np.asarray(values, dtype=np.float64)
+    if basis.weights is not None:
+        values = values * basis.weights
+
+    best = np.full(len(values), -np.inf)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for start, stop, cos_arg, sin_arg in basis.blocks():
+            lss = (values @ cos_arg)**2 / basis.scos2[start:stop] + (values @ sin_arg)**2 / basis.ssin2[start:stop]
+            # if omg is 0
+            zero = basis.omegas[start:stop] == 0
+            if np.any(zero):
+                lss[:, zero] = (np.sum(values, axis=1)**2 / len(basis.times))[:, None]
+            best = np.fmax(best, np.nanmax(lss, axis=1))
+    return best
+
+
+# n permuted (method 'permutation') or resampled with replacement (method 'bootstrap') copies of values
+def resample(values, n, rng, method='permutation'):
+    if method == 'permutation':
+        return rng.permuted(np.broadcast_to(values, (n, len(values))), axis=1)
+    if method == 'bootstrap':
+        return values[rng.integers(0, len(values), size=(n, len(values)))]
+    raise ValueError(f"method needs to be 'permutation' or 'bootstrap', but is {method}")
+
+
+# values minus their (weighted) mean, for every row
+def _center(values, weights):
+    if weights is None:
+        return values - np.mean(values, axis=-1, keepdims=True)
+    return values - (values @ weights / np.sum(weights))[..., None]
+
+
+# runs in the processes of the pool (or in the calling process), the basis is taken from the cache of the process
+def _chunk_worker(values, times, omegas, weights, n, seed, method, center, memory_budget):
+    basis = get_basis(times, omegas, weights, memory_budget=memory_budget)
+    simulated = resample(values, n, np.random.default_rng(seed), method)
+    if center:
+        simulated = _center(simulated, weights)
+    return max_power(basis, simulated)
+
+
+# values, times, omegas: list or ndarray(1 dim), weights: list or ndarray(1 dim) or None, as in ft_uneven
+# n_sims: int, method: 'permutation' or 'bootstrap', seed: int, numpy.random.SeedSequence or None
+# center: boolean, subtract the (weighted) mean of every simulated series, so the mean does not show up at low omegas
+# multithreading: boolean, executor: py_ft.BulkExecutor or None (py_ft.default_executor), memory_budget: see get_basis
+# returns the maxima of lss of the simulations, ndarray(1 dim) (n_sims)
+def max_power_distribution(values, times, omegas, n_sims=1000, weights=None, method='permutation', seed=None, center=True,
+                           multithreading=False, executor=None, memory_budget=None):
+    name = 'significance.max_power_distribution'
+    values = np.asarray(values, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    omegas = np.asarray(omegas, dtype=np.float64)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+    if len(values) != len(times):
+        raise ValueError(f'values and times need the same length, but have {len(values)} and {len(times)}')
+    if method not in ('permutation', 'bootstrap'):
+        raise ValueError(f"method needs to be 'permutation' or 'bootstrap', but is {method}")
+
+    sizes = [min(CHUNK, n_sims - start) for start in range(0, n_sims, CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(values, times, omegas, weights, n, s, method, center, memory_budget) for n, s in zip(sizes, seeds)]
+
+    with instrument.stage(name, 'kernel') as stage:
+        if multithreading:
+            if executor is None:
+                executor = py_ft.default_executor()
+            maxima = executor.map(_chunk_worker, args)
+        else:
+            maxima = [_chunk_worker(*arg) for arg in args]
+        stage.count(n_series=n_sims, n_omegas=n_sims * len(omegas))
+    return np.concatenate(maxima) if maxima else np.zeros(0)
+
+
+# fraction of max_powers at or above every power (ndarray or float), with the observed maximum counted as one of the
+# simulations, (1 + count) / (1 + n_sims), so it is never 0
+def empirical_fap(max_powers, powers):
+    max_powers = np.sort(np.asarray(max_powers, dtype=np.float64))
+    above = len(max_powers) - np.searchsorted(max_powers, powers, side='left')
+    return (1 + above) / (1 + len(max_powers))
+
+
+# power whose false alarm probability is fap (ndarray or float), the (1 - fap) quantile of max_powers
+def false_alarm_level(max_powers, fap):
+    return np.quantile(max_powers, 1 - np.asarray(fap))
+
+
+# false alarm probability of the highest peak of lss of values, see max_power_distribution for the arguments
+# returns fap, the observed maximum of lss and the maxima of the simulations (ndarray(1 dim) (n_sims))
+def false_alarm_probability(values, times, omegas, n_sims=1000, weights=None, method='permutation', seed=None, center=True,
+                            multithreading=False, executor=None, memory_budget=None):
+    values = np.asarray(values, dtype=np.float64)
+    observed = values if not center else _center(values, None if weights is None else np.asarray(weights, dtype=np.float64))
+    basis = get_basis(times, omegas, weights, memory_budget=memory_budget)
+    observed_max = max_power(basis, observed[None, :])[0]
+    max_powers = max_power_distribution(values, times, omegas, n_sims, weights=weights, method=method, seed=seed, center=center,
+                                        multithreading=multithreading, executor=executor, memory_budget=memory_budget)
+    return empirical_fap(max_powers, observed_max), observed_max, max_powers
+
+
+# test if code runs, if max_power agrees with ft_uneven and if a signal gets a small fap
+if __name__ == '__main__':
+    rng = np.random.default_rng(1)
+    times = np.sort(rng.uniform(0, 50, size=150))
+    omegas = np.linspace(0, 10, 1000)
+    noise = rng.standard_normal(150)
+
+    lss = np.array([py_ft.ft_uneven(v, times, omegas, 1, 0, return_ls=True)[1] for v in (noise, noise + 1)])
+    print(np.max(np.abs(max_power(get_basis(times, omegas), [noise, noise + 1]) - lss.max(axis=1))))
+
+    for signal in (0.0, 0.5):
+        values = noise + signal * np.sin(1.3 * times)
+        fap, observed, max_powers = false_alarm_probability(values, times, omegas, n_sims=1000, seed=2)
+        print(signal, fap, observed, false_alarm_level(max_powers, [0.1, 0.01]))
+
+    # the same simulations with the pool of processes
+    serial = max_power_distribution(noise, times, omegas, n_sims=600, seed=3, method='bootstrap')
+    with py_ft.BulkExecutor(processes=2) as executor:
+        parallel = max_power_distribution(noise, times, omegas, n_sims=600, seed=3, method='bootstrap', multithreading=True,
+                                          executor=executor)
+    print(np.array_equal(serial, parallel))
@@ -0,0 +1,134 @@
+import numpy as np
+
+
+# bulk calculation of ft_uneven in chunks of series, for batches whose results do not fit into memory
+# the chunks are sized to a memory budget and can be written into a caller-supplied buffer or a numpy.memmap on disk:
+#
+#     out = np.lib.format.open_memmap('fts.npy', mode='w+', dtype=np.complex128, shape=(n_series, n_omegas))
+#     ft_uneven_bulk_into(out, values, times, omegas, 1, 0)
+
+
+# memory in bytes used for the results and temporary arrays of one chunk
+MEMORY_BUDGET = 2**28
+
+
+def _is2d(array):
+    return array is not None and (type(array[0]) == list or type(array[0]) == np.ndarray)
+
+
+# rows start, ..., stop-1 of an argument of the bulk functions, 1d arguments are used for all series
+def _rows(array, start, stop):
+    if _is2d(array):
+        return array[start:stop]
+    return array
+
+
+# number of series per chunk, a series needs about 64 bytes per frequency (result and temporaries) and 24 per sample
+def chunk_size(values, omegas, memory_budget=None):
+    if memory_budget is None:
+        memory_budget = MEMORY_BUDGET
+    if _is2d(omegas):
+        num_omg = omegas.shape[1] if type(omegas) == np.ndarray and omegas.ndim == 2 else max(len(x) for x in omegas)
+    else:
+        num_omg = len(omegas)
+    num_val = values.shape[1] if type(values) == np.ndarray and values.ndim == 2 else max(len(x) for x in values)
+    return max(1, int(memory_budget // (64 * num_omg + 24 * num_val)))
+
+
+# the bulk function of a backend, returning a 2d array (or a list for series with different numbers of omegas)
+def _bulk(backend, multithreading):
+    if backend == 'numba':
+        import numba_ft
+
+        def bulk(values, times, omegas, ft_sign, time_zero, weights, lin_weights):
+            return numba_ft.ft_uneven_bulk_adaptive(values, times, omegas, ft_sign, time_zero, weights=weights, lin_weights=lin_weights,
+                                                    multithreading=multithreading)
+        return bulk
+    if backend == 'py':
+        import py_ft
+
+        def bulk(values, times, omegas, ft_sign, time_zero, weights, lin_weights):
+            results = py_ft.ft_uneven_bulk(values, times, omegas, ft_sign, time_zero, weights=weights, lin_weights=lin_weights,
+                                           multithreading=multithreading)
+            if len(set(len(x) for x in results)) <= 1:
+                return np.array(results)
+            return results
+        return bulk
+    raise ValueError(f"backend needs to be 'numba' or 'py', but is {backend}")
+
+
+# generator over chunks of series, yields (start, stop, fts) with fts the results of the series start, ..., stop-1
+# arguments as for py_ft.ft_uneven_bulk, backend: 'numba' (numba_ft.ft_uneven_bulk_adaptive) or 'py' (py_ft.ft_uneven_bulk)
+# memory_budget: int or None (MEMORY_BUDGET), bytes per chunk
+# out: ndarray (2 dim) (n_series, n_omegas) complex or numpy.memmap or None, if given the chunks are written into it
+# and the yielded fts are views of out, the memory used by the generator then does not depend on the number of series
+# with omegas per series n_omegas is the largest number of omegas, the row of a series with fewer is filled up with nan
+# (the yielded fts are then a list of the views out[i, :number of omegas of series i])
+def ft_uneven_bulk_stream(values, times, omegas, ft_sign, time_zero, weights=None, lin_weights=False, backend='numba', multithreading=True,
+                          memory_budget=None, out=None):
+    bulk = _bulk(backend, multithreading)
+    n_series = len(values)
+    chunk = chunk_size(values, omegas, memory_budget)
+    if out is not None and len(out) != n_series:
+        raise ValueError(f'out needs one row per series, but has {len(out)} rows for {n_series} series')
+
+    for start in range(0, n_series, chunk):
+        stop = min(start + chunk, n_series)
+        fts = bulk(_rows(values, start, stop), _rows(times, start, stop), _rows(omegas, start, stop), ft_sign, time_zero,
+                   _rows(weights, start, stop), lin_weights)
+        if out is not None:
+            fts = _write_rows(out, start, stop, fts)
+        yield start, stop, fts
+
+
+# writes the fts of the series start, ..., stop-1 into their rows of out, returns the views of out
+def _write_rows(out, start, stop, fts):
+    if isinstance(fts, np.ndarray) and fts.ndim == 2 and fts.shape[1] == out.shape[1]:
+        out[start:stop] = fts
+        return out[start:stop]
+    views = []
+    for i, series_fts in zip(range(start, stop), fts):
+        num_omg = len(series_fts)
+        if num_omg > out.shape[1]:
+            raise ValueError(f'out has {out.shape[1]} columns, but series {i} has {num_omg} omegas')
+        out[i, :num_omg] = series_fts
+        out[i, num_omg:] = np.nan
+        views.append(out[i, :num_omg])
+    return views
+
+
+# calculates all chunks into out (ndarray or numpy.memmap (n_series, n_omegas)) and returns it
+def ft_uneven_bulk_into(out, values, times, omegas, ft_sign, time_zero, weights=None, lin_weights=False, backend='numba',
+                        multithreading=True, memory_budget=None):
+    for _ in ft_uneven_bulk_stream(values, times, omegas, ft_sign, time_zero, weights=weights, lin_weights=lin_weights, backend=backend,
+                                   multithreading=multithreading, memory_budget=memory_budget, out=out):
+        pass
+    if hasattr(out, 'flush'):
+        out.flush()
+    return out
+
+
+# test if code runs
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    ran = np.random.standard_normal
+    values = ran(size=(1000, 100))
+    times = np.sort(np.random.uniform(0, 10, size=100))
+    omegas = np.linspace(0, 5, 200)
+
+    with tempfile.TemporaryDirectory() as directory:
+        out = np.lib.format.open_memmap(os.path.join(directory, 'fts.npy'), mode='w+', dtype=np.complex128, shape=(1000, 200))
+        ft_uneven_bulk_into(out, values, times, omegas, 1, 0, memory_budget=2**20)
+        print(np.max(np.abs(out[10] - ft_uneven_bulk_into(np.zeros((1, 200), dtype=np.complex128), values[10:11], times, omegas, 1, 0)[0])))
+        del out
+
+    # omegas per series with different lengths, the rows are filled up with nan
+    ragged = [omegas[:200 - i % 7] for i in range(1000)]
+    for backend in ('numba', 'py'):
+        out = ft_uneven_bulk_into(np.zeros((1000, 200), dtype=np.complex128), values, times, ragged, 1, 0, backend=backend,
+                                  multithreading=False, memory_budget=2**20)
+        import py_ft
+        direct = py_ft.ft_uneven(values[3], times, ragged[3], 1, 0)
+        print(backend, np.max(np.abs(out[3, :197] - direct)), np.isnan(out[3, 197:]).all())